@@ -0,0 +1,335 @@
+"""
+Benchmarks for Obsidian Duplicate Finder.
+
+Generates synthetic Obsidian vaults with seeded exact and near duplicates,
+times each stage of a VaultScanner scan, records peak RSS, and scores the
+result against the seeded duplicates. Every vault size runs in a fresh
+process so peak memory is not carried over between sizes.
+
+    python dedupe_bench.py run --sizes 1000 10000 100000 --output report.json
+    python dedupe_bench.py compare baseline.json report.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import combinations
+
+from dedupe_engine import DEFAULT_BLOCK_SIZE, VaultScanner, peak_rss_mb
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+_SYLLABLES = [
+    'ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'xe', 'zu',
+    'ba', 'de', 'fi', 'go', 'hu', 'ja', 'pe', 'qui', 'wo', 'yi'
+]
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(_SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def edit_words(words, edits, vocabulary, rng):
+    """Apply edits random word substitutions, insertions or deletions."""
+    words = list(words)
+    for _ in range(edits):
+        operation = rng.random()
+        position = rng.randrange(len(words))
+        if operation < 0.5:
+            words[position] = rng.choice(vocabulary)
+        elif operation < 0.75 or len(words) < 2:
+            words.insert(position, rng.choice(vocabulary))
+        else:
+            del words[position]
+    return words
+
+
+def note_text(title, tags, created, words):
+    frontmatter = (
+        f"---\ntitle: {title}\ntags: [{', '.join(tags)}]\n"
+        f"created: {created}\n---\n"
+    )
+    paragraphs = [
+        ' '.join(words[start:start + 60]) for start in range(0, len(words), 60)
+    ]
+    return frontmatter + f"# {title}\n\n" + '\n\n'.join(paragraphs) + "\n"
+
+
+def generate_vault(vault_path, notes, exact_share=0.05, near_share=0.10,
+                   min_edits=1, max_edits=10, words_per_note=300,
+                   vocabulary_size=20000, folder_depth=3, seed=0):
+    """
+    Write a synthetic vault of `notes` Markdown files and return the seeded
+    duplicate clusters as lists of vault-relative paths.
+
+    exact_share and near_share are the fractions of notes that are exact
+    copies and near duplicates (min_edits to max_edits word edits) of
+    another note. Notes live in nested folders up to folder_depth deep and
+    start with YAML frontmatter.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    # Zipf-like word frequencies, as in natural text
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    tags = ['project', 'idea', 'meeting', 'journal', 'reference', 'todo']
+
+    n_exact = int(notes * exact_share)
+    n_near = int(notes * near_share)
+    n_base = max(1, notes - n_exact - n_near)
+
+    def folder_for(index):
+        depth = index % (folder_depth + 1)
+        parts = [f"folder{(index >> (3 * level)) % 8}" for level in range(depth)]
+        return os.path.join(*parts) if parts else ''
+
+    def write(relative_path, text):
+        full_path = os.path.join(vault_path, relative_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    base_notes = []
+    for index in range(n_base):
+        words = rng.choices(vocabulary, weights, k=words_per_note)
+        title = f"Note {index}"
+        meta = (title, rng.sample(tags, 2), f"2024-01-{index % 28 + 1:02d}")
+        relative_path = os.path.join(folder_for(index), f"note-{index}.md")
+        write(relative_path, note_text(*meta, words))
+        base_notes.append((relative_path, meta, words))
+
+    clusters = {}
+    for index in range(n_exact + n_near):
+        source = rng.randrange(n_base)
+        source_path, meta, words = base_notes[source]
+        if index < n_exact:
+            relative_path = os.path.join(folder_for(index + 1), f"copy-{index}.md")
+        else:
+            words = edit_words(
+                words, rng.randint(min_edits, max_edits), vocabulary, rng
+            )
+            relative_path = os.path.join(folder_for(index + 2), f"near-{index}.md")
+        write(relative_path, note_text(*meta, words))
+        clusters.setdefault(source_path, [source_path]).append(relative_path)
+    return list(clusters.values())
+
+
+def pairs_of(groups):
+    return {
+        pair for group in groups for pair in combinations(sorted(group), 2)
+    }
+
+
+def accuracy(found_groups, true_groups):
+    found = pairs_of(found_groups)
+    true = pairs_of(true_groups)
+    hits = len(found & true)
+    return {
+        'true_pairs': len(true),
+        'found_pairs': len(found),
+        'precision': round(hits / len(found), 4) if found else 1.0,
+        'recall': round(hits / len(true), 4) if true else 1.0
+    }
+
+
+def measure(vault_path, truth_path, threshold, workers, block_size, use_lsh,
+            use_simhash=False):
+    """
+    Scan an existing vault with VaultScanner and report the stages of its
+    ScanProfile; runs in a child process. walk, read and preprocess
+    overlap inside ingest, so they report busy_s rather than wall_s.
+    """
+    scanner = VaultScanner(
+        vault_path, workers=workers, block_size=block_size, use_lsh=use_lsh,
+        use_cache=False, use_simhash=use_simhash
+    )
+    started = time.perf_counter()
+    scanner.scan(threshold)
+    found = [
+        [os.path.relpath(path, vault_path) for path in group['files']]
+        for group in scanner.groups(threshold)
+    ]
+    total_wall_s = round(time.perf_counter() - started, 4)
+    with open(truth_path, encoding='utf-8') as f:
+        truth = json.load(f)
+
+    return {
+        'notes': len(scanner.paths),
+        'stages': scanner.profile.stages,
+        'total_wall_s': total_wall_s,
+        'peak_rss_mb': peak_rss_mb(),
+        'groups': len(found),
+        'accuracy': accuracy(found, truth)
+    }
+
+
+def stage_seconds(stage):
+    """Wall time of a stage, or busy time for the overlapped ingest stages."""
+    return stage['wall_s'] if 'wall_s' in stage else stage.get('busy_s')
+
+
+def run_benchmarks(args):
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {
+            key: getattr(args, key) for key in (
+                'threshold', 'workers', 'block_size', 'lsh', 'simhash', 'exact_share',
+                'near_share', 'min_edits', 'max_edits', 'words_per_note',
+                'vocabulary_size', 'folder_depth', 'seed'
+            )
+        },
+        'runs': []
+    }
+    for size in args.sizes:
+        work_dir = tempfile.mkdtemp(prefix=f'dedupe-bench-{size}-', dir=args.work_dir)
+        vault_path = os.path.join(work_dir, 'vault')
+        truth_path = os.path.join(work_dir, 'truth.json')
+        try:
+            started = time.perf_counter()
+            truth = generate_vault(
+                vault_path, size, args.exact_share, args.near_share,
+                args.min_edits, args.max_edits, args.words_per_note,
+                args.vocabulary_size, args.folder_depth, args.seed
+            )
+            generate_s = round(time.perf_counter() - started, 2)
+            with open(truth_path, 'w', encoding='utf-8') as f:
+                json.dump(truth, f)
+            print(f"{size} notes: generated in {generate_s}s, measuring...",
+                  file=sys.stderr)
+
+            command = [
+                sys.executable, os.path.abspath(__file__), 'measure',
+                vault_path, truth_path, '--threshold', str(args.threshold),
+                '--block-size', str(args.block_size)
+            ]
+            if args.workers:
+                command += ['--workers', str(args.workers)]
+            if args.lsh:
+                command.append('--lsh')
+            if args.simhash:
+                command.append('--simhash')
+            result = subprocess.run(
+                command, check=True, capture_output=True, text=True
+            )
+            run = json.loads(result.stdout)
+            run['size'] = size
+            run['generate_s'] = generate_s
+            report['runs'].append(run)
+            print(
+                f"{size} notes: {run['total_wall_s']}s, "
+                f"peak {run['peak_rss_mb']} MB, "
+                f"precision {run['accuracy']['precision']}, "
+                f"recall {run['accuracy']['recall']}",
+                file=sys.stderr
+            )
+        finally:
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+def compare_reports(args):
+    """Print per-stage wall time and memory ratios between two reports."""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = {run['size']: run for run in json.load(f)['runs']}
+    with open(args.candidate, encoding='utf-8') as f:
+        candidate = {run['size']: run for run in json.load(f)['runs']}
+
+    for size in sorted(set(baseline) & set(candidate)):
+        old, new = baseline[size], candidate[size]
+        print(f"{size} notes")
+        for name, stage in new['stages'].items():
+            if name not in old['stages']:
+                continue
+            before = stage_seconds(old['stages'][name])
+            after = stage_seconds(stage)
+            if before is None or after is None:
+                continue
+            ratio = f"{before / after:.2f}x" if after else "-"
+            print(f"  {name:<12} {before:>9.3f}s -> {after:>9.3f}s  {ratio}")
+        print(
+            f"  {'peak RSS':<12} {old['peak_rss_mb']:>8.1f}MB -> "
+            f"{new['peak_rss_mb']:>8.1f}MB"
+        )
+        for key in ('precision', 'recall'):
+            print(
+                f"  {key:<12} {old['accuracy'][key]:>10} -> "
+                f"{new['accuracy'][key]:>10}"
+            )
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='dedupe_bench.py',
+        description="Benchmark the duplicate scan on synthetic vaults."
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="generate vaults and benchmark them")
+    run.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    run.add_argument('--exact-share', type=float, default=0.05)
+    run.add_argument('--near-share', type=float, default=0.10)
+    run.add_argument('--min-edits', type=int, default=1)
+    run.add_argument('--max-edits', type=int, default=10)
+    run.add_argument('--words-per-note', type=int, default=300)
+    run.add_argument('--vocabulary-size', type=int, default=20000)
+    run.add_argument('--folder-depth', type=int, default=3)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--work-dir', default=None,
+                     help="where to generate vaults (default: system temp)")
+    run.add_argument('--keep', action='store_true',
+                     help="keep the generated vaults")
+    run.add_argument('--output', help="write the JSON report to this file")
+    run.set_defaults(handler=run_benchmarks)
+
+    measure_parser = commands.add_parser(
+        'measure', help="time one existing vault (used internally)"
+    )
+    measure_parser.add_argument('vault')
+    measure_parser.add_argument('truth')
+    measure_parser.set_defaults(handler=lambda args: print(json.dumps(measure(
+        args.vault, args.truth, args.threshold / 100.0, args.workers,
+        args.block_size, args.lsh, args.simhash
+    ))))
+
+    for command in (run, measure_parser):
+        command.add_argument('--threshold', type=float, default=80)
+        command.add_argument('--workers', type=int, default=None)
+        command.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+        command.add_argument('--lsh', action='store_true')
+        command.add_argument('--simhash', action='store_true')
+
+    compare = commands.add_parser('compare', help="compare two reports")
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.set_defaults(handler=compare_reports)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
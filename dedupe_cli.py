@@ -0,0 +1,713 @@
+"""
+Command-line entry point for Obsidian Duplicate Finder.
+
+Runs the same scan as the GUI without a display and writes one JSON
+object per duplicate group to stdout (JSON Lines) as soon as the group is
+final. Progress, errors and per-stage timings go to stderr.
+
+    python dedupe_cli.py scan path/to/vault [more vaults...] --threshold 80
+
+Large vaults can be scanned in shards: `shard` builds one shard's
+artifact (on any machine with access to the vault), `merge` compares the
+artifacts and writes the groups, and `scan --shards N` does both with N
+local worker processes.
+
+`watch` scans a vault once and then keeps running, writing a record for
+every group that appears, changes ('event': 'group') or disappears
+('event': 'removed') as notes are edited.
+
+`blocks` reports paragraphs and headed sections that appear in several
+notes, one JSON object per shared block with the lines it occupies in
+each note, even where the notes as a whole are not similar.
+
+`query` reads a vault (from the scan cache when it can) and answers
+"which notes are most like this one?" for each --note or --text, one
+JSON object per query with the top matches.
+
+`resolve` scans a vault and settles every group at once: a keep policy
+picks the note to keep and the others are moved to the vault's .trash
+folder, with a journal that `undo` uses to move them back.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from dedupe_engine import (
+    DEFAULT_BANDS, DEFAULT_BLOCK_SIZE, DEFAULT_HAMMING_DISTANCE, DEFAULT_NUM_PERM,
+    DEFAULT_SHINGLE_SIZE, ScanProfile, VaultScanner, default_log_path
+)
+from dedupe_index import ScanIndex
+from dedupe_query import DEFAULT_TOP_K, QueryIndex, query_index_path
+from dedupe_resolve import (
+    KEEP_POLICIES, list_cleanups, move_to_trash, plan_cleanup, undo_cleanup
+)
+from dedupe_shard import ShardMerger, build_shard
+from dedupe_simhash import MAX_HAMMING_DISTANCE
+from dedupe_spill import MIN_MEMORY_BUDGET
+from dedupe_watch import DEFAULT_POLL_INTERVAL, ChangeWatcher, LiveIndex, diff_groups
+
+
+def percent(value):
+    return round(value * 100, 2)
+
+
+def group_record(vault_path, group, file_contents):
+    """Return the JSON-serialisable record written for one group."""
+    files = []
+    for file_path in group['files']:
+        entry = file_contents[file_path]
+        files.append({
+            'path': file_path,
+            'size': entry['size'],
+            'modified': datetime.fromtimestamp(
+                entry['mtime_ns'] / 1e9, timezone.utc
+            ).isoformat()
+        })
+    return {
+        'vault': vault_path,
+        'similarity': percent(group['similarity']),
+        'min_similarity': percent(group['min_similarity']),
+        'max_similarity': percent(group['max_similarity']),
+        'pairs': group['pairs'],
+        'files': files
+    }
+
+
+def add_threshold_options(parser):
+    parser.add_argument(
+        '--threshold', type=float, default=80,
+        help="similarity threshold in percent (default: 80)"
+    )
+    parser.add_argument(
+        '--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+        help=f"rows compared per similarity block (default: {DEFAULT_BLOCK_SIZE})"
+    )
+    parser.add_argument(
+        '--bands', type=int, default=DEFAULT_BANDS,
+        help=f"LSH bands (default: {DEFAULT_BANDS})"
+    )
+
+
+def add_signature_options(parser):
+    parser.add_argument(
+        '--lsh', action='store_true',
+        help="only compare notes that share a MinHash/LSH bucket"
+    )
+    parser.add_argument(
+        '--num-perm', type=int, default=DEFAULT_NUM_PERM,
+        help=f"MinHash permutations (default: {DEFAULT_NUM_PERM})"
+    )
+    parser.add_argument(
+        '--shingle-size', type=int, default=DEFAULT_SHINGLE_SIZE,
+        help=f"words per MinHash shingle (default: {DEFAULT_SHINGLE_SIZE})"
+    )
+    parser.add_argument(
+        '--strip-obsidian', action='store_true',
+        help="ignore frontmatter, code blocks, tags and link syntax"
+    )
+
+
+def add_workers_option(parser):
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help="reader threads and preprocessing processes (default: CPU count)"
+    )
+
+
+def add_scan_options(parser):
+    add_threshold_options(parser)
+    add_workers_option(parser)
+    add_signature_options(parser)
+    parser.add_argument(
+        '--simhash', action='store_true',
+        help="only compare notes whose SimHash fingerprints are within "
+             "--hamming-distance bits (fast, finds near-copies only)"
+    )
+    parser.add_argument(
+        '--hamming-distance', type=int, default=DEFAULT_HAMMING_DISTANCE,
+        help=f"SimHash bits two notes may differ in (default: {DEFAULT_HAMMING_DISTANCE})"
+    )
+    parser.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help="do not read or update the persistent scan index"
+    )
+    parser.add_argument(
+        '--cache-dir', default=None,
+        help="directory for scan indexes (default: ~/.cache/obsidian-deduper)"
+    )
+    parser.add_argument(
+        '--profile', choices=ScanProfile.CAPTURE_MODES, default=None,
+        help="capture a cProfile or tracemalloc profile of each scan"
+    )
+    parser.add_argument(
+        '--log', default=None, metavar='PATH',
+        help="append per-stage timings as JSON Lines to PATH (default with "
+             "--profile: scan-log.jsonl in the cache directory)"
+    )
+
+
+def scanner_from_args(vault_path, args):
+    return VaultScanner(
+        vault_path, workers=args.workers, block_size=args.block_size,
+        use_lsh=args.lsh, num_perm=args.num_perm, bands=args.bands,
+        shingle_size=args.shingle_size, use_cache=args.use_cache,
+        cache_dir=args.cache_dir, profile_capture=args.profile,
+        strip_obsidian=args.strip_obsidian,
+        memory_budget=getattr(args, 'memory_budget', None),
+        use_simhash=args.simhash, hamming_distance=args.hamming_distance
+    )
+
+
+def shard_command(vault_path, shard, args, out_path):
+    """Command line that builds one shard in a separate process."""
+    command = [
+        sys.executable, os.path.abspath(__file__), 'shard', vault_path,
+        '--shard', str(shard), '--shards', str(args.shards), '--out', out_path,
+        '--num-perm', str(args.num_perm), '--shingle-size', str(args.shingle_size)
+    ]
+    # Share the CPUs between the shard processes unless told otherwise
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.shards)
+    command += ['--workers', str(workers)]
+    if args.lsh:
+        command.append('--lsh')
+    if args.strip_obsidian:
+        command.append('--strip-obsidian')
+    if args.quiet:
+        command.append('-q')
+    return command
+
+
+def write_groups(vault_path, merger, threshold, out):
+    groups = merger.groups(threshold)
+    for group in groups:
+        record = group_record(vault_path, group, merger.file_contents)
+        out.write(json.dumps(record) + "\n")
+    out.flush()
+    return len(groups)
+
+
+def run_sharded_scan(vault_path, args, out, status):
+    """Build every shard on its own local process, then merge them."""
+    with tempfile.TemporaryDirectory(prefix='obsidian-deduper-') as work_dir:
+        artifacts = [
+            os.path.join(work_dir, f"shard-{shard}.npz")
+            for shard in range(args.shards)
+        ]
+        status(f"Building {args.shards} shards...")
+        workers = [
+            subprocess.Popen(shard_command(vault_path, shard, args, artifact))
+            for shard, artifact in enumerate(artifacts)
+        ]
+        failed = [
+            shard for shard, worker in enumerate(workers) if worker.wait() != 0
+        ]
+        if failed:
+            raise RuntimeError(f"Building shards {failed} failed.")
+        status("Merging shards...")
+        merger = ShardMerger(
+            artifacts, vault_path, block_size=args.block_size, bands=args.bands,
+            workers=args.workers
+        )
+        merger.merge(args.threshold / 100.0)
+    return write_groups(vault_path, merger, args.threshold / 100.0, out)
+
+
+def run_scan(args, out=sys.stdout, err=sys.stderr):
+    total_groups = 0
+    for vault_path in args.vaults:
+        def status(message):
+            if not args.quiet:
+                err.write(f"{vault_path}: {message}\n")
+
+        if args.shards > 1:
+            total_groups += run_sharded_scan(vault_path, args, out, status)
+            continue
+
+        scanner = scanner_from_args(vault_path, args)
+
+        def write_group(group):
+            record = group_record(vault_path, group, scanner.file_contents)
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+        scanner.scan(args.threshold / 100.0, on_status=status, on_group=write_group)
+        total_groups += len(scanner.groups(args.threshold / 100.0))
+        status(scanner.profile.summary())
+        log_path = args.log or (default_log_path() if args.profile else None)
+        if log_path:
+            record = scanner.profile.write(log_path, vault=vault_path)
+            if 'cprofile' in record:
+                status(f"cProfile stats written to {record['cprofile']}")
+    if not args.quiet:
+        err.write(f"Found {total_groups} duplicate groups.\n")
+    return 0
+
+
+def block_record(vault_path, block):
+    """Return the JSON-serialisable record written for one shared block."""
+    return {
+        'vault': vault_path,
+        'notes': block['notes'],
+        'words': block['words'],
+        'fingerprint': block['fingerprint'],
+        'locations': [
+            {'path': file_path, 'first_line': first, 'last_line': last}
+            for file_path, first, last in block['locations']
+        ]
+    }
+
+
+def run_blocks(args, out=sys.stdout, err=sys.stderr):
+    total_blocks = 0
+    for vault_path in args.vaults:
+        def status(message):
+            if not args.quiet:
+                err.write(f"{vault_path}: {message}\n")
+
+        scanner = VaultScanner(
+            vault_path, workers=args.workers, use_cache=args.use_cache,
+            cache_dir=args.cache_dir, strip_obsidian=args.strip_obsidian
+        )
+        blocks = [
+            block for block in scanner.scan_blocks(on_status=status)
+            if block['notes'] >= args.min_notes
+        ]
+        for block in blocks:
+            out.write(json.dumps(block_record(vault_path, block)) + "\n")
+        out.flush()
+        total_blocks += len(blocks)
+        status(scanner.profile.summary())
+    if not args.quiet:
+        err.write(f"Found {total_blocks} shared blocks.\n")
+    return 0
+
+
+def resolve_note(vault_path, note, index):
+    """Return note as given if it is indexed, else relative to the vault."""
+    if note in index:
+        return note
+    return os.path.join(vault_path, note)
+
+
+def run_query(args, out=sys.stdout, err=sys.stderr):
+    def status(message):
+        if not args.quiet:
+            err.write(f"{args.vault}: {message}\n")
+
+    started = time.perf_counter()
+    saved_path = query_index_path(args.vault, args.cache_dir)
+    index = None
+    if args.use_cache:
+        index = QueryIndex.load(saved_path, args.vault, args.strip_obsidian)
+    if index is not None:
+        status(
+            f"Loaded the index of {len(index.paths)} notes in "
+            f"{time.perf_counter() - started:.2f}s."
+        )
+    else:
+        scanner = VaultScanner(
+            args.vault, workers=args.workers, use_cache=args.use_cache,
+            cache_dir=args.cache_dir, strip_obsidian=args.strip_obsidian
+        )
+        scanner.ingest(on_status=status)
+        started = time.perf_counter()
+        index = QueryIndex.from_scanner(scanner)
+        status(
+            f"Indexed {len(index.paths)} notes in "
+            f"{time.perf_counter() - started:.2f}s."
+        )
+        if args.use_cache:
+            try:
+                index.save(saved_path, args.vault)
+            except OSError as e:
+                status(f"Could not save the index: {e}")
+
+    queries = [('note', note) for note in args.notes]
+    for text in args.texts:
+        queries.append(('text', sys.stdin.read() if text == '-' else text))
+    failed = False
+    for kind, value in queries:
+        started = time.perf_counter()
+        if kind == 'note':
+            try:
+                matches = index.similar_to_note(
+                    resolve_note(args.vault, value, index), args.top
+                )
+            except KeyError:
+                err.write(f"error: {value} is not a note in {args.vault}\n")
+                failed = True
+                continue
+        else:
+            matches = index.similar_to_text(value, args.top)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        record = {
+            'vault': args.vault,
+            kind: value,
+            'matches': [
+                {'path': file_path, 'similarity': percent(score)}
+                for file_path, score in matches
+            ],
+            'elapsed_ms': round(elapsed_ms, 3)
+        }
+        out.write(json.dumps(record) + "\n")
+    out.flush()
+    return 1 if failed else 0
+
+
+def run_resolve(args, out=sys.stdout, err=sys.stderr):
+    def status(message):
+        if not args.quiet:
+            err.write(f"{args.vault}: {message}\n")
+
+    threshold = args.threshold / 100.0
+    scanner = scanner_from_args(args.vault, args)
+    scanner.scan(threshold, on_status=status)
+    folder = os.path.join(args.vault, args.folder) if args.folder else None
+    plan = plan_cleanup(
+        [group['files'] for group in scanner.groups(threshold)],
+        scanner.file_contents, args.keep, folder
+    )
+    if args.dry_run:
+        for keep, remove in plan:
+            record = {'vault': args.vault, 'kept': keep, 'trash': remove}
+            out.write(json.dumps(record) + "\n")
+        status(
+            f"Would move {sum(len(remove) for _, remove in plan)} notes from "
+            f"{len(plan)} groups to the trash."
+        )
+        return 0
+
+    journal_path, moved, errors = move_to_trash(args.vault, plan)
+    if args.use_cache and moved:
+        with ScanIndex(args.vault, args.cache_dir) as index:
+            index.update_files({}, removed=moved)
+    moved_set = set(moved)
+    for keep, remove in plan:
+        record = {
+            'vault': args.vault, 'kept': keep,
+            'trash': [file_path for file_path in remove if file_path in moved_set]
+        }
+        out.write(json.dumps(record) + "\n")
+    out.flush()
+    for file_path, message in errors.items():
+        err.write(f"error: could not move {file_path}: {message}\n")
+    status(
+        f"Moved {len(moved)} notes from {len(plan)} groups to "
+        f"{os.path.dirname(journal_path)}; `undo {args.vault}` moves them back."
+    )
+    return 1 if errors else 0
+
+
+def run_undo(args, out=sys.stdout, err=sys.stderr):
+    journal_path = args.journal
+    if journal_path is None:
+        cleanups = list_cleanups(args.vault)
+        if not cleanups:
+            err.write(f"error: {args.vault} has no cleanup to undo\n")
+            return 1
+        journal_path = cleanups[0]
+    restored, errors = undo_cleanup(journal_path)
+    for file_path in restored:
+        out.write(json.dumps({'vault': args.vault, 'restored': file_path}) + "\n")
+    out.flush()
+    for file_path, message in errors.items():
+        err.write(f"error: could not restore {file_path}: {message}\n")
+    if not args.quiet:
+        err.write(f"{args.vault}: restored {len(restored)} notes.\n")
+    return 1 if errors else 0
+
+
+def run_shard(args, out=sys.stdout, err=sys.stderr):
+    errors = build_shard(
+        args.vault, args.shard, args.shards, args.out, workers=args.workers,
+        use_lsh=args.lsh, num_perm=args.num_perm, shingle_size=args.shingle_size,
+        strip_obsidian=args.strip_obsidian
+    )
+    if not args.quiet:
+        err.write(f"{args.vault}: shard {args.shard} of {args.shards} written to {args.out}\n")
+    return 1 if errors and args.strict else 0
+
+
+def run_merge(args, out=sys.stdout, err=sys.stderr):
+    merger = ShardMerger(
+        args.artifacts, args.vault, block_size=args.block_size, bands=args.bands,
+        workers=args.workers
+    )
+    try:
+        merger.merge(args.threshold / 100.0)
+    except ValueError as e:
+        err.write(f"error: {e}\n")
+        return 2
+    total_groups = write_groups(
+        merger.vault_path, merger, args.threshold / 100.0, out
+    )
+    if not args.quiet:
+        err.write(f"Found {total_groups} duplicate groups.\n")
+    return 0
+
+
+def run_watch(args, out=sys.stdout, err=sys.stderr):
+    threshold = args.threshold / 100.0
+
+    def status(message):
+        if not args.quiet:
+            err.write(f"{args.vault}: {message}\n")
+
+    def write(event, group):
+        if event == 'removed':
+            # Its notes may be gone, so only their paths are reported
+            record = {
+                'vault': args.vault,
+                'files': [{'path': file_path} for file_path in group['files']]
+            }
+        else:
+            record = group_record(args.vault, group, live.file_contents)
+        record['event'] = event
+        out.write(json.dumps(record) + "\n")
+
+    # Start watching first so edits made during the scan are not missed
+    with ChangeWatcher(
+        args.vault, poll_interval=args.poll, use_inotify=args.inotify
+    ) as watcher:
+        scanner = scanner_from_args(args.vault, args)
+        scanner.scan(threshold, on_status=status)
+        live = LiveIndex(scanner, threshold)
+        groups = live.groups(threshold)
+        for group in groups:
+            write('group', group)
+        out.flush()
+        status(f"Watching for changes ({watcher.mode})...")
+        try:
+            while True:
+                changed = watcher.wait(1.0)
+                if not changed or not live.update(changed):
+                    continue
+                new_groups = live.groups(threshold)
+                changed_groups, removed_groups = diff_groups(groups, new_groups)
+                for group in removed_groups:
+                    write('removed', group)
+                for group in changed_groups:
+                    write('group', group)
+                out.flush()
+                groups = new_groups
+        except KeyboardInterrupt:
+            return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='dedupe_cli.py',
+        description="Find duplicate notes in Obsidian vaults without a GUI."
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan = commands.add_parser(
+        'scan', help="stream duplicate groups as JSON Lines"
+    )
+    scan.add_argument('vaults', nargs='+', metavar='VAULT')
+    add_scan_options(scan)
+    scan.add_argument(
+        '--shards', type=int, default=1,
+        help="split the vault into this many shards, each built on its own "
+             "local process (default: 1; sharded scans do not use the cache)"
+    )
+    scan.add_argument(
+        '--memory-budget', type=int, default=None, metavar='MB',
+        help="scan out of core, spilling text, vectors and edges to disk and "
+             f"comparing in tiles that fit in MB megabytes (at least "
+             f"{MIN_MEMORY_BUDGET}; does not use the cache)"
+    )
+    scan.add_argument(
+        '-q', '--quiet', action='store_true', help="only print results"
+    )
+    scan.set_defaults(handler=run_scan)
+
+    shard = commands.add_parser(
+        'shard', help="build one shard of a vault into a portable artifact"
+    )
+    shard.add_argument('vault', metavar='VAULT')
+    shard.add_argument('--shard', type=int, required=True, help="shard number, from 0")
+    shard.add_argument('--shards', type=int, required=True, help="number of shards")
+    shard.add_argument('--out', required=True, help="artifact file (.npz) to write")
+    add_workers_option(shard)
+    add_signature_options(shard)
+    shard.add_argument(
+        '--strict', action='store_true', help="exit with 1 if a note cannot be read"
+    )
+    shard.add_argument(
+        '-q', '--quiet', action='store_true', help="do not report progress"
+    )
+    shard.set_defaults(handler=run_shard)
+
+    merge = commands.add_parser(
+        'merge', help="compare shard artifacts and stream the duplicate groups"
+    )
+    merge.add_argument('artifacts', nargs='+', metavar='ARTIFACT')
+    merge.add_argument(
+        '--vault', default=None,
+        help="vault location on this machine (default: the one the shards recorded)"
+    )
+    add_threshold_options(merge)
+    merge.add_argument(
+        '--workers', type=int, default=None,
+        help="processes comparing shard pairs (default: 1)"
+    )
+    merge.add_argument(
+        '-q', '--quiet', action='store_true', help="only print results"
+    )
+    merge.set_defaults(handler=run_merge)
+
+    watch = commands.add_parser(
+        'watch', help="scan a vault, then stream group changes as notes change"
+    )
+    watch.add_argument('vault', metavar='VAULT')
+    add_scan_options(watch)
+    watch.add_argument(
+        '--poll', type=float, default=DEFAULT_POLL_INTERVAL,
+        help="seconds between checks when inotify is unavailable "
+             f"(default: {DEFAULT_POLL_INTERVAL})"
+    )
+    watch.add_argument(
+        '--no-inotify', dest='inotify', action='store_false',
+        help="always poll modification times"
+    )
+    watch.add_argument(
+        '-q', '--quiet', action='store_true', help="only print results"
+    )
+    watch.set_defaults(handler=run_watch)
+
+    blocks = commands.add_parser(
+        'blocks', help="stream paragraphs and sections shared between notes"
+    )
+    blocks.add_argument('vaults', nargs='+', metavar='VAULT')
+    blocks.add_argument(
+        '--min-notes', type=int, default=2,
+        help="only report blocks found in at least this many notes (default: 2)"
+    )
+    add_workers_option(blocks)
+    blocks.add_argument(
+        '--strip-obsidian', action='store_true',
+        help="ignore frontmatter, code blocks, tags and link syntax"
+    )
+    blocks.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help="do not read or update the persistent scan index"
+    )
+    blocks.add_argument(
+        '--cache-dir', default=None,
+        help="directory for scan indexes (default: ~/.cache/obsidian-deduper)"
+    )
+    blocks.add_argument(
+        '-q', '--quiet', action='store_true', help="only print results"
+    )
+    blocks.set_defaults(handler=run_blocks)
+
+    query = commands.add_parser(
+        'query', help="list the notes most similar to a note or to some text"
+    )
+    query.add_argument('vault', metavar='VAULT')
+    query.add_argument(
+        '--note', dest='notes', action='append', default=[], metavar='PATH',
+        help="note to find similar notes for, absolute or relative to the vault "
+             "(repeatable)"
+    )
+    query.add_argument(
+        '--text', dest='texts', action='append', default=[], metavar='TEXT',
+        help="text to find similar notes for; '-' reads it from stdin (repeatable)"
+    )
+    query.add_argument(
+        '-k', '--top', type=int, default=DEFAULT_TOP_K,
+        help=f"matches per query (default: {DEFAULT_TOP_K})"
+    )
+    add_workers_option(query)
+    query.add_argument(
+        '--strip-obsidian', action='store_true',
+        help="ignore frontmatter, code blocks, tags and link syntax"
+    )
+    query.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help="do not read or update the persistent scan index"
+    )
+    query.add_argument(
+        '--cache-dir', default=None,
+        help="directory for scan indexes (default: ~/.cache/obsidian-deduper)"
+    )
+    query.add_argument(
+        '-q', '--quiet', action='store_true', help="only print results"
+    )
+    query.set_defaults(handler=run_query)
+
+    resolve = commands.add_parser(
+        'resolve', help="keep one note per group and move the rest to the trash"
+    )
+    resolve.add_argument('vault', metavar='VAULT')
+    add_scan_options(resolve)
+    resolve.add_argument(
+        '--keep', choices=KEEP_POLICIES, default='newest',
+        help="which note of each group to keep: the newest, the largest, the "
+             "one with the shortest path, or the newest in --folder "
+             "(default: newest)"
+    )
+    resolve.add_argument(
+        '--folder', default=None,
+        help="preferred folder for --keep folder, relative to the vault; groups "
+             "without a note in it are left alone"
+    )
+    resolve.add_argument(
+        '--dry-run', action='store_true',
+        help="print what would be kept and moved without moving anything"
+    )
+    resolve.add_argument(
+        '-q', '--quiet', action='store_true', help="only print results"
+    )
+    resolve.set_defaults(handler=run_resolve)
+
+    undo = commands.add_parser(
+        'undo', help="move the notes of a cleanup back out of the trash"
+    )
+    undo.add_argument('vault', metavar='VAULT')
+    undo.add_argument(
+        '--journal', default=None, metavar='PATH',
+        help="journal of the cleanup to undo (default: the latest cleanup)"
+    )
+    undo.add_argument(
+        '-q', '--quiet', action='store_true', help="only print results"
+    )
+    undo.set_defaults(handler=run_undo)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+    if not 0 <= getattr(args, 'threshold', 0) <= 100:
+        build_parser().error("--threshold must be between 0 and 100")
+    if args.command == 'resolve' and args.keep == 'folder' and not args.folder:
+        build_parser().error("--keep folder needs --folder")
+    if args.command == 'query' and not (args.notes or args.texts):
+        build_parser().error("query needs at least one --note or --text")
+    if getattr(args, 'memory_budget', None) is not None:
+        if args.memory_budget < MIN_MEMORY_BUDGET:
+            build_parser().error(f"--memory-budget must be at least {MIN_MEMORY_BUDGET}")
+        if args.lsh or args.simhash or args.shards > 1:
+            build_parser().error(
+                "--memory-budget cannot be combined with --lsh, --simhash or --shards"
+            )
+    if getattr(args, 'simhash', False):
+        if not 0 <= args.hamming_distance <= MAX_HAMMING_DISTANCE:
+            build_parser().error(
+                f"--hamming-distance must be between 0 and {MAX_HAMMING_DISTANCE}"
+            )
+        if args.lsh or getattr(args, 'shards', 1) > 1:
+            build_parser().error("--simhash cannot be combined with --lsh or --shards")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
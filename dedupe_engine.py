@@ -0,0 +1,1635 @@
+"""
+Similarity engine for Obsidian Duplicate Finder.
+
+Everything here works on the sparse TF-IDF matrix directly, so no
+documents x vocabulary or N x N dense array is ever materialised.
+"""
+import codecs
+import cProfile
+import hashlib
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from dedupe_index import ScanIndex, default_cache_dir
+from dedupe_stopwords import ENGLISH_STOP_WORDS as STOP_WORDS
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever preprocess_text's output changes, so cached
+# preprocessed text from older versions is discarded
+PREPROCESS_VERSION = 2
+
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+# str.translate is slow on non-ASCII text, where these are used instead
+_PUNCTUATION_RE = re.compile(f"[{re.escape(string.punctuation)}]+")
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+# Obsidian syntax that does not belong to a note's prose
+_FRONTMATTER_RE = re.compile(r"\A---[ \t]*\r?\n.*?^(?:---|\.\.\.)[ \t]*$", re.S | re.M)
+_CODE_FENCE_RE = re.compile(r"^[ \t]*(```|~~~).*?^[ \t]*\1[ \t]*$", re.S | re.M)
+_WIKILINK_RE = re.compile(r"!?\[\[([^\]|#^]*)(?:[#^][^\]|]*)?(?:\|([^\]]*))?\]\]")
+_TAG_RE = re.compile(r"(?<![\w/#&])#(?!\d+\b)[\w/-]+")
+
+_HEADING_RE = re.compile(r"#{1,6}\s")
+# Blocks with fewer terms, such as headings and short list items, are too
+# common to be worth reporting (bump PREPROCESS_VERSION when changing it)
+MIN_BLOCK_WORDS = 8
+
+# Rows multiplied against the corpus per step; memory per step is
+# roughly block_size x N similarities before thresholding.
+DEFAULT_BLOCK_SIZE = 1024
+
+# Notes at least this large are decoded straight from a memory map rather
+# than read into a bytes copy first
+MMAP_MIN_BYTES = 8 << 20
+
+# Obsidian's trash folder, where resolved duplicates are moved; scans
+# leave it out
+TRASH_FOLDER = '.trash'
+
+# Notes handed to a preprocessing worker process at a time
+PREPROCESS_BATCH_SIZE = 256
+# Starting worker processes costs more than tokenising a small vault
+PROCESS_POOL_MIN_FILES = 4096
+# Reads and preprocessing batches in flight per worker; the walk waits for
+# one to finish before starting another, so memory stays bounded
+IN_FLIGHT_PER_WORKER = 2
+
+# Lowest threshold the GUI offers; scans keep every edge down to it so the
+# threshold can be changed afterwards without rescanning
+MIN_THRESHOLD = 0.5
+
+# Cosine similarity of identical rows can land a rounding error below 1.0
+SIMILARITY_EPSILON = 1e-9
+
+
+def read_text_hashed(file_path):
+    """Return (text, size in bytes, blake2b hex digest) of a UTF-8 file."""
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_MIN_BYTES:
+            raw = f.read()
+            return (
+                raw.decode('utf-8'), len(raw),
+                hashlib.blake2b(raw, digest_size=16).hexdigest()
+            )
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            digest = hashlib.blake2b(mapped, digest_size=16).hexdigest()
+            text, _ = codecs.utf_8_decode(mapped, 'strict', True)
+            return text, len(mapped), digest
+
+
+def strip_obsidian_syntax(text):
+    """
+    Remove YAML frontmatter, code fences and #tags, and replace each
+    [[wikilink]] by its alias or target.
+    """
+    text = _FRONTMATTER_RE.sub('', text)
+    text = _CODE_FENCE_RE.sub('', text)
+    text = _WIKILINK_RE.sub(lambda match: match.group(2) or match.group(1), text)
+    return _TAG_RE.sub('', text)
+
+
+def preprocess_text(text, strip_obsidian=False):
+    """
+    Return text's terms separated by single spaces: lowercased, without
+    punctuation, stop words or one-character words. The result is the
+    final tokenisation, so vectorizers split it on whitespace
+    (see tfidf_vectorizer) instead of tokenising again.
+    """
+    if strip_obsidian:
+        text = strip_obsidian_syntax(text)
+    text = text.lower()
+    if text.isascii():
+        text = text.translate(_PUNCTUATION_TABLE)
+    else:
+        # Other symbols separate words, like the vectorizer's \w+ tokens
+        text = _NON_WORD_RE.sub(' ', _PUNCTUATION_RE.sub('', text))
+    return ' '.join([
+        word for word in text.split() if len(word) > 1 and word not in STOP_WORDS
+    ])
+
+
+def split_blocks(text):
+    """
+    Yield (first_line, last_line, block) for each block of text, with
+    1-based line numbers counted at '\n' as in an editor. Blocks are
+    separated by blank lines, and every Markdown heading is a block of
+    its own.
+    """
+    lines = []
+    first = 0
+    for number, line in enumerate(text.split('\n'), 1):
+        heading = _HEADING_RE.match(line) is not None
+        if lines and (heading or not line.strip()):
+            yield first, number - 1, '\n'.join(lines)
+            lines = []
+        if heading:
+            yield number, number, line
+        elif line.strip():
+            if not lines:
+                first = number
+            lines.append(line)
+    if lines:
+        yield first, first + len(lines) - 1, '\n'.join(lines)
+
+
+def note_blocks(text, strip_obsidian=False):
+    """
+    Return [fingerprint, first_line, last_line, words] for every block of
+    text with at least MIN_BLOCK_WORDS terms after preprocessing, so
+    blocks that differ only in case, punctuation or stop words match.
+    """
+    blocks = []
+    for first, last, block in split_blocks(text):
+        processed = preprocess_text(block, strip_obsidian)
+        words = processed.count(' ') + 1 if processed else 0
+        if words >= MIN_BLOCK_WORDS:
+            fingerprint = hashlib.blake2b(
+                processed.encode('utf-8'), digest_size=8
+            ).hexdigest()
+            blocks.append([fingerprint, first, last, words])
+    return blocks
+
+
+def preprocess_batch(texts, strip_obsidian=False):
+    return [preprocess_text(text, strip_obsidian) for text in texts]
+
+
+def _timed_preprocess_batch(texts, strip_obsidian=False, find_blocks=False):
+    started = time.process_time()
+    processed = preprocess_batch(texts, strip_obsidian)
+    blocks = (
+        [note_blocks(text, strip_obsidian) for text in texts]
+        if find_blocks else None
+    )
+    return processed, blocks, time.process_time() - started
+
+
+def tfidf_vectorizer():
+    """TfidfVectorizer for preprocess_text output, which is already tokenised."""
+    # scikit-learn takes most of a second to import, so it is only loaded
+    # once a scan needs it
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(analyzer=str.split)
+
+
+def warm_up():
+    """Import the scan dependencies ahead of the first scan."""
+    tfidf_vectorizer()
+
+
+def iter_markdown_files(vault_path):
+    """
+    Yield (path, stat_result) for every .md file below vault_path in a
+    single os.scandir walk. Like os.walk, symlinked folders are skipped,
+    and so are trash folders.
+    """
+    directories = [vault_path]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != TRASH_FOLDER:
+                            directories.append(entry.path)
+                    elif entry.name.endswith(".md") and entry.is_file():
+                        yield entry.path, entry.stat()
+        except OSError:
+            continue
+
+
+def _read_note(file_path, stats):
+    started = time.perf_counter()
+    text, size, digest = read_text_hashed(file_path)
+    # 'original' only lives until the note has been preprocessed
+    entry = {
+        'original': text,
+        'mtime_ns': stats.st_mtime_ns,
+        'size': size,
+        'digest': digest
+    }
+    return entry, time.perf_counter() - started
+
+
+class ScanCancelled(Exception):
+    """Raised inside a scan once its ScanControl has been cancelled."""
+
+
+class ScanControl:
+    """
+    Lets another thread pause, resume or cancel a running scan. The scan
+    calls checkpoint() between units of work, which blocks while paused
+    and raises ScanCancelled once cancelled.
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()  # Wake a paused scan so it can stop
+
+    def pause(self):
+        if not self.cancelled:
+            self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def checkpoint(self):
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise ScanCancelled()
+
+
+def _checkpoint(control):
+    if control is not None:
+        control.checkpoint()
+
+
+def ingest_vault(vault_path, cached_files=None, workers=None, progress=None,
+                 profile=None, control=None, include=None, strip_obsidian=False,
+                 find_blocks=False, spill=None):
+    """
+    Walk vault_path once and read, hash and preprocess every note, or
+    only the notes whose path include(path) accepts.
+
+    Files are read and decoded on a pool of worker threads as soon as the
+    walk finds them, and full batches of decoded text are tokenised on a
+    pool of worker processes once the vault turns out to be large enough
+    to pay for starting them. At most IN_FLIGHT_PER_WORKER reads and
+    batches per worker are pending at a time; finished ones are collected
+    while the walk goes on, so walking, reading and preprocessing overlap
+    and only a bounded number of decoded notes is held at once.
+
+    Entries in cached_files whose mtime and size still match are reused
+    without reading the file, and a note whose content hash matches a
+    cached or already processed note reuses its preprocessed text.
+    progress, if given, is called as progress(done, found) while the walk
+    may still be finding files. If a ScanProfile is given, the time spent
+    walking, reading and preprocessing (summed over workers, as the three
+    overlap) is added to it together with file and byte counts. A
+    ScanControl, if given, is checked for every file. With find_blocks,
+    every entry also gets 'blocks' from note_blocks, and cached entries
+    without them are read again. spill, if given, is called as
+    spill(text) with each preprocessed text, and entries keep the key it
+    returns as 'spilled' instead of the text itself as 'processed'.
+
+    Returns (file_contents, changed_paths, errors) where errors maps each
+    unreadable path to its exception. Entries keep the note's metadata,
+    hashes and preprocessed text but not its original text; use
+    dedupe_preview to show a note.
+    """
+    cached_files = cached_files or {}
+    workers = max(1, workers or os.cpu_count() or 1)
+    process_workers = min(workers, os.cpu_count() or 1)
+    file_contents = {}
+    changed = set()
+    errors = {}
+    found = done = 0
+    walk_s = read_s = preprocess_s = 0.0
+    bytes_read = cached_count = reused_count = 0
+    # Preprocessed entries by content hash
+    known = {entry['digest']: entry for entry in cached_files.values()}
+
+    read_pool = ThreadPoolExecutor(workers) if workers > 1 else None
+    process_pool = None
+    reads = {}
+    batches = {}
+    batch = []
+    read_limit = workers * IN_FLIGHT_PER_WORKER
+    batch_limit = process_workers * IN_FLIGHT_PER_WORKER
+
+    def report():
+        if progress is not None:
+            progress(done, found)
+
+    def preprocess(batch):
+        nonlocal process_pool, preprocess_s
+        texts = [entry['original'] for _, entry in batch]
+        use_processes = process_pool is not None or (
+            process_workers > 1 and found >= PROCESS_POOL_MIN_FILES
+        )
+        if use_processes and len(batch) >= PREPROCESS_BATCH_SIZE:
+            if process_pool is None:
+                # Spawned workers do not inherit the GUI's threads
+                process_pool = ProcessPoolExecutor(
+                    process_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            collect_batches(batch_limit - 1)
+            batches[process_pool.submit(
+                _timed_preprocess_batch, texts, strip_obsidian, find_blocks
+            )] = batch
+        else:
+            processed, blocks, seconds = _timed_preprocess_batch(
+                texts, strip_obsidian, find_blocks
+            )
+            preprocess_s += seconds
+            store(batch, processed, blocks)
+
+    def collect_batches(limit):
+        """Store finished batches until at most limit are pending."""
+        nonlocal preprocess_s
+        while len(batches) > limit:
+            finished, _ = wait(batches, return_when=FIRST_COMPLETED)
+            for future in finished:
+                _checkpoint(control)
+                pending = batches.pop(future)
+                try:
+                    processed, blocks, seconds = future.result()
+                except Exception:
+                    # A crashed worker should not lose the batch
+                    processed, blocks, seconds = _timed_preprocess_batch(
+                        [entry['original'] for _, entry in pending],
+                        strip_obsidian, find_blocks
+                    )
+                preprocess_s += seconds
+                store(pending, processed, blocks)
+
+    def collect_reads(limit):
+        """Collect finished reads until at most limit are pending."""
+        while len(reads) > limit:
+            finished, _ = wait(reads, return_when=FIRST_COMPLETED)
+            for future in finished:
+                _checkpoint(control)
+                collect_read(reads.pop(future), future.result)
+
+    def store(batch, processed, blocks):
+        nonlocal done
+        for row, ((file_path, entry), text) in enumerate(zip(batch, processed)):
+            del entry['original']
+            if spill is None:
+                entry['processed'] = text
+            else:
+                entry['spilled'] = spill(text)
+            entry['normalized_digest'] = text_digest(text) if text else None
+            if blocks is not None:
+                entry['blocks'] = blocks[row]
+            known.setdefault(entry['digest'], entry)
+            file_contents[file_path] = entry
+            changed.add(file_path)
+            done += 1
+        report()
+
+    def collect_read(file_path, read):
+        nonlocal done, read_s, bytes_read, reused_count
+        try:
+            entry, seconds = read()
+        except Exception as e:
+            logger.warning("Error reading %s: %s", file_path, e)
+            errors[file_path] = e
+            done += 1
+            report()
+            return
+        read_s += seconds
+        bytes_read += entry['size']
+        same = known.get(entry['digest'])
+        if same is not None and (not find_blocks or 'blocks' in same):
+            # Moved, touched or copied notes need no preprocessing
+            del entry['original']
+            for key in ('processed', 'spilled'):
+                if key in same:
+                    entry[key] = same[key]
+            entry['normalized_digest'] = same['normalized_digest']
+            if find_blocks:
+                entry['blocks'] = same['blocks']
+            file_contents[file_path] = entry
+            changed.add(file_path)
+            reused_count += 1
+            done += 1
+            report()
+            return
+        batch.append((file_path, entry))
+        if len(batch) >= PREPROCESS_BATCH_SIZE:
+            preprocess(batch[:])
+            batch.clear()
+
+    try:
+        markdown_files = iter_markdown_files(vault_path)
+        while True:
+            started = time.perf_counter()
+            item = next(markdown_files, None)
+            walk_s += time.perf_counter() - started
+            if item is None:
+                break
+            _checkpoint(control)
+            file_path, stats = item
+            if include is not None and not include(file_path):
+                continue
+            found += 1
+            cached = cached_files.get(file_path)
+            if (
+                cached and
+                cached['mtime_ns'] == stats.st_mtime_ns and
+                cached['size'] == stats.st_size and
+                (not find_blocks or 'blocks' in cached)
+            ):
+                # Unchanged since the last scan
+                file_contents[file_path] = cached
+                cached_count += 1
+                done += 1
+                report()
+            elif read_pool is not None:
+                collect_reads(read_limit - 1)
+                reads[read_pool.submit(_read_note, file_path, stats)] = file_path
+            else:
+                collect_read(
+                    file_path, lambda: _read_note(file_path, stats)
+                )
+
+        collect_reads(0)
+        if batch:
+            preprocess(batch[:])
+            batch.clear()
+        collect_batches(0)
+    finally:
+        if read_pool is not None:
+            read_pool.shutdown(cancel_futures=True)
+        if process_pool is not None:
+            process_pool.shutdown(cancel_futures=True)
+
+    if profile is not None:
+        files_read = len(changed) + len(errors)
+        profile.add('walk', busy_s=round(walk_s, 4), files=found)
+        profile.add(
+            'read', busy_s=round(read_s, 4), files=files_read,
+            cached=cached_count, bytes=bytes_read, errors=len(errors)
+        )
+        profile.add(
+            'preprocess', busy_s=round(preprocess_s, 4),
+            files=len(changed) - reused_count, reused=reused_count
+        )
+
+    return dict(sorted(file_contents.items())), changed, errors
+
+
+def text_digest(text):
+    """Return the blake2b hex digest of a (normalised) text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def exact_duplicate_groups(file_contents):
+    """
+    Group files that are byte-identical or identical after preprocessing.
+
+    file_contents maps each path to a dict with 'size', 'digest' and
+    'normalized_digest' (None when nothing survives preprocessing). Files
+    are bucketed by size and raw digest first, then buckets sharing a
+    normalised digest are merged. Each returned group is a sorted list of
+    paths whose first entry serves as the group's representative.
+    """
+    identical = {}
+    for path, info in file_contents.items():
+        identical.setdefault((info['size'], info['digest']), []).append(path)
+
+    groups = {}
+    for (size, digest), paths in identical.items():
+        normalized = file_contents[paths[0]]['normalized_digest']
+        key = ('normalized', normalized) if normalized else ('raw', size, digest)
+        groups.setdefault(key, []).extend(paths)
+    return [sorted(paths) for paths in groups.values() if len(paths) > 1]
+
+
+def shared_blocks(file_contents, min_notes=2):
+    """
+    Return the blocks found in at least min_notes notes, from the
+    'blocks' of each entry in file_contents (see note_blocks).
+
+    Fingerprints go into an inverted index in one pass over the vault.
+    Each result has the block's 'fingerprint', 'words', number of
+    'notes' and its 'locations' as (path, first_line, last_line), and
+    results are sorted by notes times words, largest first.
+    """
+    index = {}
+    for path, entry in file_contents.items():
+        for fingerprint, first, last, words in entry.get('blocks') or ():
+            index.setdefault(fingerprint, (words, []))[1].append((path, first, last))
+
+    blocks = []
+    for fingerprint, (words, locations) in index.items():
+        notes = len({path for path, _, _ in locations})
+        if notes >= min_notes:
+            blocks.append({
+                'fingerprint': fingerprint,
+                'words': words,
+                'notes': notes,
+                'locations': locations
+            })
+    blocks.sort(key=lambda block: (-block['notes'] * block['words'], block['locations']))
+    return blocks
+
+
+def similarity_edges(matrix, threshold, block_size=DEFAULT_BLOCK_SIZE, rows=None,
+                     on_block=None, control=None):
+    """
+    Return (rows, cols, weights) for every pair i < j whose cosine
+    similarity is at or above threshold.
+
+    The matrix must have L2-normalised rows (TfidfVectorizer's default),
+    so a row dot product is the cosine similarity. Rows are processed
+    block_size at a time against the rows that follow them, and each
+    block is thresholded before the next one is computed.
+
+    When rows is given, only pairs involving at least one of those rows
+    are computed, which lets a rescan compare just the changed notes.
+    Otherwise on_block, if given, is called as on_block(stop, rows, cols,
+    weights) after each block; by then every edge of rows below stop is
+    known. A ScanControl, if given, is checked before each block.
+    """
+    matrix = sp.csr_matrix(matrix)
+    n_rows = matrix.shape[0]
+    block_size = max(1, int(block_size))
+    cutoff = threshold - SIMILARITY_EPSILON
+
+    pair_rows, pair_cols, weights = [], [], []
+    if rows is None:
+        for start in range(0, n_rows, block_size):
+            _checkpoint(control)
+            stop = min(start + block_size, n_rows)
+            block = (matrix[start:stop] @ matrix[start:].T).tocoo()
+            # Block column c is corpus row start + c; keep the upper triangle
+            keep = (block.col > block.row) & (block.data >= cutoff)
+            pair_rows.append(block.row[keep].astype(np.int32) + start)
+            pair_cols.append(block.col[keep].astype(np.int32) + start)
+            weights.append(block.data[keep].astype(np.float32))
+            if on_block is not None:
+                on_block(stop, pair_rows[-1], pair_cols[-1], weights[-1])
+    else:
+        rows = np.unique(np.asarray(rows, dtype=np.int32))
+        selected = np.zeros(n_rows, dtype=bool)
+        selected[rows] = True
+        for start in range(0, len(rows), block_size):
+            _checkpoint(control)
+            block_rows = rows[start:start + block_size]
+            block = (matrix[block_rows] @ matrix.T).tocoo()
+            first = block_rows[block.row]
+            second = block.col.astype(np.int32)
+            # Pairs of two selected rows show up twice; keep one of them
+            keep = (
+                (second != first) & (block.data >= cutoff) &
+                (~selected[second] | (second > first))
+            )
+            first, second = first[keep], second[keep]
+            pair_rows.append(np.minimum(first, second))
+            pair_cols.append(np.maximum(first, second))
+            weights.append(block.data[keep].astype(np.float32))
+
+    if not pair_rows:
+        return (
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float32),
+        )
+    return (
+        np.concatenate(pair_rows), np.concatenate(pair_cols),
+        np.concatenate(weights)
+    )
+
+
+def sort_edges(rows, cols, weights):
+    """Return the edge list ordered by descending weight."""
+    order = np.argsort(-weights, kind='stable')
+    return rows[order], cols[order], weights[order]
+
+
+def exact_copy_of(paths, exact_groups):
+    """
+    Return the row in paths of the representative (first member) of each
+    note's exact group, or of the note itself if it has no exact copy.
+    """
+    copy_of = np.arange(len(paths), dtype=np.int64)
+    if exact_groups:
+        row_of = {path: row for row, path in enumerate(paths)}
+        for exact_group in exact_groups:
+            rows = [row_of[path] for path in exact_group if path in row_of]
+            copy_of[rows] = min(rows)
+    return copy_of
+
+
+def group_edges(rows, cols, weights, threshold, copy_of=None):
+    """
+    Cluster the nodes joined by edges at or above threshold into
+    connected components.
+
+    The edges must be sorted by descending weight (see sort_edges), so
+    only the prefix above threshold is used. Returns the groups in order
+    of their first member, each a dict with the sorted member 'indices',
+    the number of matching 'pairs' inside the group and the mean
+    'similarity', 'min_similarity' and 'max_similarity' over those pairs.
+
+    copy_of (see exact_copy_of) maps each node to the node of its exact
+    copy class. An edge of one copy then stands for the same edge of
+    every copy, and the copies match each other at 100%, so the pairs
+    are counted note by note however many copy edges are listed.
+    """
+    cutoff = threshold - SIMILARITY_EPSILON
+    count = int(np.searchsorted(-weights, -cutoff, side='right'))
+    if not count:
+        return []
+    weights = weights[:count].astype(np.float64)
+
+    # Only nodes with at least one edge can be in a group
+    nodes, local = np.unique(
+        np.concatenate([rows[:count], cols[:count]]), return_inverse=True
+    )
+    local_rows, local_cols = local[:count], local[count:]
+    graph = sp.coo_matrix(
+        (np.ones(count, dtype=np.int8), (local_rows, local_cols)),
+        shape=(len(nodes), len(nodes))
+    )
+    n_groups, labels = connected_components(graph, directed=False)
+
+    edge_labels = labels[local_rows]
+    if copy_of is None:
+        pairs = np.bincount(edge_labels, minlength=n_groups)
+        totals = np.bincount(edge_labels, weights=weights, minlength=n_groups)
+    else:
+        pairs, totals = _copy_pair_totals(
+            np.asarray(copy_of)[nodes], labels, local_rows, local_cols,
+            edge_labels, weights, n_groups
+        )
+    means = totals / pairs
+    minimums = np.full(n_groups, np.inf)
+    np.minimum.at(minimums, edge_labels, weights)
+    maximums = np.zeros(n_groups)
+    np.maximum.at(maximums, edge_labels, weights)
+
+    # Stable sort keeps each group's members in ascending order
+    order = np.argsort(labels, kind='stable')
+    members = np.split(nodes[order], np.cumsum(np.bincount(labels))[:-1])
+    groups = [
+        {
+            'indices': members[label].tolist(),
+            'pairs': int(round(pairs[label])),
+            'similarity': float(means[label]),
+            'min_similarity': float(minimums[label]),
+            'max_similarity': float(maximums[label])
+        }
+        for label in range(n_groups)
+    ]
+    groups.sort(key=lambda group: group['indices'][0])
+    return groups
+
+
+def _copy_pair_totals(classes, labels, local_rows, local_cols, edge_labels,
+                      weights, n_groups):
+    """
+    Return the number of note pairs and their summed similarity in each
+    group when the nodes of one class are exact copies (see group_edges).
+    """
+    classes, first, class_of, sizes = np.unique(
+        classes, return_index=True, return_inverse=True, return_counts=True
+    )
+    n_classes = len(classes)
+    a, b = class_of[local_rows], class_of[local_cols]
+    between = a != b
+    # Copies share every edge, so each pair of classes is counted once
+    keys, edges = np.unique(
+        np.minimum(a, b)[between].astype(np.int64) * n_classes
+        + np.maximum(a, b)[between],
+        return_index=True
+    )
+    counts = (sizes[keys // n_classes] * sizes[keys % n_classes]).astype(np.float64)
+    edge_labels = edge_labels[between][edges]
+    pairs = np.bincount(edge_labels, weights=counts, minlength=n_groups)
+    totals = np.bincount(
+        edge_labels, weights=counts * weights[between][edges], minlength=n_groups
+    )
+    copies = sizes * (sizes - 1) / 2.0
+    class_labels = labels[first]
+    pairs = pairs + np.bincount(class_labels, weights=copies, minlength=n_groups)
+    totals = totals + np.bincount(class_labels, weights=copies, minlength=n_groups)
+    return pairs, totals
+
+
+# MinHash / LSH candidate generation
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 32
+DEFAULT_SHINGLE_SIZE = 3
+
+# Universal hashing modulo a Mersenne prime; a * x stays below 2**63 for
+# 32-bit shingle hashes, so the arithmetic fits in uint64.
+_MINHASH_PRIME = np.uint64((1 << 31) - 1)
+# Signature value of a document without any shingles
+EMPTY_SIGNATURE = np.uint32((1 << 31) - 1)
+_SHINGLE_MULTIPLIER = np.uint64(1000003)
+_SHINGLE_CHUNK = 4096
+_PAIR_CHUNK = 65536
+
+# SimHash candidate search (see dedupe_simhash)
+DEFAULT_HAMMING_DISTANCE = 8
+
+
+def _minhash_permutations(num_perm, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, _MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+def shingle_hashes(text, shingle_size=DEFAULT_SHINGLE_SIZE):
+    """Return the unique 32-bit hashes of the word shingles in text."""
+    tokens = text.split()
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    # crc32 is stable across processes, unlike hash() on str
+    token_hashes = np.fromiter(
+        (zlib.crc32(token.encode('utf-8')) for token in tokens),
+        dtype=np.uint64, count=len(tokens)
+    )
+    width = min(shingle_size, len(tokens))
+    count = len(tokens) - width + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    for offset in range(width):
+        shingles = shingles * _SHINGLE_MULTIPLIER + token_hashes[offset:offset + count]
+    return np.unique(shingles & np.uint64(0xFFFFFFFF))
+
+
+def minhash_signatures(texts, num_perm=DEFAULT_NUM_PERM,
+                       shingle_size=DEFAULT_SHINGLE_SIZE, seed=1, control=None):
+    """
+    Return an (len(texts), num_perm) uint32 array of MinHash signatures
+    over the word shingles of each preprocessed text.
+    """
+    a, b = _minhash_permutations(num_perm, seed)
+    signatures = np.full((len(texts), num_perm), EMPTY_SIGNATURE, dtype=np.uint32)
+    for row, text in enumerate(texts):
+        if row % PREPROCESS_BATCH_SIZE == 0:
+            _checkpoint(control)
+        shingles = shingle_hashes(text, shingle_size)
+        for start in range(0, len(shingles), _SHINGLE_CHUNK):
+            chunk = shingles[start:start + _SHINGLE_CHUNK][None, :]
+            hashed = ((a * chunk + b) % _MINHASH_PRIME).min(axis=1)
+            np.minimum(signatures[row], hashed, out=signatures[row])
+    return signatures
+
+
+def run_pairs(keys, members):
+    """
+    Yield (first, second) arrays of the members of every pair within a
+    run of equal sorted keys, one offset at a time, so no step holds more
+    than one pair per member.
+    """
+    starts = np.flatnonzero(keys[1:] == keys[:-1])
+    offset = 1
+    while len(starts):
+        yield members[starts], members[starts + offset]
+        offset += 1
+        starts = starts[starts + offset < len(keys)]
+        starts = starts[keys[starts + offset] == keys[starts]]
+
+
+def lsh_candidate_pairs(signatures, bands=DEFAULT_BANDS):
+    """
+    Bucket each band of the signatures and return (rows, cols) for every
+    pair i < j that shares at least one bucket.
+    """
+    n_docs, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(
+            f"Number of permutations ({num_perm}) must be divisible "
+            f"by the number of bands ({bands})."
+        )
+    rows_per_band = num_perm // bands
+    # Documents without shingles would all share one bucket
+    docs = np.flatnonzero(signatures[:, 0] != EMPTY_SIGNATURE)
+
+    # Pairs found so far; a pair sharing buckets in several bands is kept
+    # once as soon as each band is done
+    keys = np.empty(0, dtype=np.int64)
+    members = docs.astype(np.int64)
+    # Buckets of near-copies tend to recur in every band, and a bucket
+    # whose members an earlier band already paired adds nothing
+    seen = set()
+    for band in range(bands):
+        band_values = signatures[docs, band * rows_per_band:(band + 1) * rows_per_band]
+        _, buckets = np.unique(band_values, axis=0, return_inverse=True)
+        buckets = buckets.ravel()
+        order = np.argsort(buckets, kind='stable')
+        buckets, band_members = buckets[order], members[order]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        sizes = np.diff(np.r_[starts, len(buckets)])
+        new = np.zeros(len(starts), dtype=bool)
+        for run in np.flatnonzero(sizes > 1):
+            start = starts[run]
+            run_members = band_members[start:start + sizes[run]].tobytes()
+            if run_members not in seen:
+                seen.add(run_members)
+                new[run] = True
+        keep = np.repeat(new, sizes)
+        band_keys = [
+            np.minimum(first, second) * n_docs + np.maximum(first, second)
+            for first, second in run_pairs(buckets[keep], band_members[keep])
+        ]
+        if band_keys:
+            keys = np.concatenate([keys] + band_keys)
+            keys.sort()
+            keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+    return (keys // n_docs).astype(np.int32), (keys % n_docs).astype(np.int32)
+
+
+def pair_similarities(matrix, rows, cols, other=None):
+    """
+    Return the cosine similarity of each (rows[k], cols[k]) pair. cols
+    index other, if given, instead of matrix.
+    """
+    matrix = sp.csr_matrix(matrix)
+    other = matrix if other is None else sp.csr_matrix(other)
+    similarities = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), _PAIR_CHUNK):
+        stop = start + _PAIR_CHUNK
+        products = matrix[rows[start:stop]].multiply(other[cols[start:stop]])
+        similarities[start:stop] = np.asarray(products.sum(axis=1)).ravel()
+    return similarities
+
+
+def lsh_similarity_edges(matrix, texts, threshold, num_perm=DEFAULT_NUM_PERM,
+                         bands=DEFAULT_BANDS, shingle_size=DEFAULT_SHINGLE_SIZE,
+                         signatures=None, rows=None):
+    """
+    Like similarity_edges, but only score the candidate pairs that share
+    an LSH bucket. More bands raise recall, fewer bands raise speed.
+
+    Precomputed signatures may be passed instead of being rebuilt from
+    texts, and rows restricts the result to pairs involving those rows.
+    """
+    if signatures is None:
+        signatures = minhash_signatures(texts, num_perm, shingle_size)
+    pair_rows, pair_cols = lsh_candidate_pairs(signatures, bands)
+    if rows is not None:
+        selected = np.zeros(len(signatures), dtype=bool)
+        selected[np.asarray(rows, dtype=np.int32)] = True
+        involved = selected[pair_rows] | selected[pair_cols]
+        pair_rows, pair_cols = pair_rows[involved], pair_cols[involved]
+    weights = pair_similarities(matrix, pair_rows, pair_cols)
+    keep = weights >= threshold - SIMILARITY_EPSILON
+    return pair_rows[keep], pair_cols[keep], weights[keep]
+
+
+def peak_rss_mb():
+    """Return this process's peak resident set size in MB, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def default_log_path():
+    return os.path.join(default_cache_dir(), 'scan-log.jsonl')
+
+
+class ScanProfile:
+    """
+    Wall time, CPU time, counters and peak memory for each stage of a scan.
+
+    capture may be 'cprofile' to run cProfile over the scan, or
+    'tracemalloc' to also record the peak traced allocation of each stage.
+    Both slow the scan down and are off by default.
+    """
+    CAPTURE_MODES = ('cprofile', 'tracemalloc')
+
+    def __init__(self, capture=None):
+        if capture not in (None,) + self.CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode: {capture}")
+        self.capture = capture
+        self.started = datetime.now(timezone.utc)
+        self.stages = {}
+        self.profiler = None
+
+    def start(self):
+        if self.capture == 'cprofile':
+            # cProfile only sees the thread that enables it
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.capture == 'tracemalloc':
+            tracemalloc.start()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        elif self.capture == 'tracemalloc' and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name, **counters):
+        """Time the enclosed block as stage name; yields a dict for counters."""
+        record = dict(counters)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall, 4)
+            record['cpu_s'] = round(time.process_time() - cpu, 4)
+            record['peak_rss_mb'] = peak_rss_mb()
+            if tracing:
+                record['traced_peak_mb'] = round(
+                    tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1
+                )
+            self.add(name, **record)
+
+    def add(self, name, **values):
+        self.stages.setdefault(name, {}).update(values)
+
+    def summary(self):
+        """One line for the status bar, e.g. 'ingest 1.20s (5000 files/s)'."""
+        parts = []
+        for name, record in self.stages.items():
+            if 'wall_s' not in record:
+                continue
+            text = f"{name} {record['wall_s']:.2f}s"
+            if name == 'ingest' and record['wall_s'] and record.get('files'):
+                text += f" ({record['files'] / record['wall_s']:,.0f} files/s)"
+            elif name == 'vectorize' and 'vocabulary' in record:
+                text += f" (vocab {record['vocabulary']:,}, nnz {record['nnz']:,})"
+            elif name == 'similarity' and 'edges' in record:
+                text += f" ({record['edges']:,} edges)"
+            parts.append(text)
+        peak = peak_rss_mb()
+        if peak is not None:
+            parts.append(f"peak {peak:,.0f} MB")
+        return " | ".join(parts)
+
+    def to_dict(self, **extra):
+        record = {
+            'started': self.started.isoformat(),
+            'capture': self.capture,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.stages
+        }
+        record.update(extra)
+        return record
+
+    def write(self, log_path=None, **extra):
+        """
+        Append this profile as one JSON line to log_path (default: the
+        scan log in the cache directory). A cProfile capture is dumped
+        next to it and its path recorded. Returns the written record.
+        """
+        log_path = log_path or default_log_path()
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        record = self.to_dict(**extra)
+        if self.profiler is not None:
+            stamp = self.started.strftime('%Y%m%d-%H%M%S')
+            stats_path = os.path.join(
+                os.path.dirname(os.path.abspath(log_path)), f"scan-{stamp}.prof"
+            )
+            self.profiler.dump_stats(stats_path)
+            record['cprofile'] = stats_path
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+        return record
+
+
+class StreamingGrouper:
+    """
+    Incremental union-find that hands out each group as soon as no later
+    edge can reach it.
+
+    Edges must arrive in row order as similarity_edges produces them, so
+    once rows below stop are done every group whose nodes are all below
+    stop is final. attached maps a node to the number of exact copies
+    folded into it; an edge counts once for every copy at either end, and
+    the copies match each other at 100%, matching what group_edges
+    reports for the same edges with their copies.
+    """
+    def __init__(self, attached=None):
+        self.attached = attached or {}
+        self.parent = {}
+        # root -> [largest node, members, pairs, total, minimum, maximum]
+        self.open_groups = {}
+        self.pending_attached = sorted(self.attached)
+        self.attached_position = 0
+
+    def find(self, node):
+        root = self.parent.setdefault(node, node)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while node != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def add_edges(self, rows, cols, weights):
+        attached = self.attached
+        for a, b, weight in zip(rows.tolist(), cols.tolist(), weights.tolist()):
+            count = (attached.get(a, 0) + 1) * (attached.get(b, 0) + 1)
+            root_a, root_b = self.find(a), self.find(b)
+            group_a = self.open_groups.setdefault(
+                root_a, [root_a, [root_a], 0, 0.0, float('inf'), 0.0]
+            )
+            if root_a != root_b:
+                group_b = self.open_groups.pop(
+                    root_b, [root_b, [root_b], 0, 0.0, float('inf'), 0.0]
+                )
+                if len(group_b[1]) > len(group_a[1]):
+                    group_a, group_b = group_b, group_a
+                    root_a, root_b = root_b, root_a
+                    self.open_groups[root_a] = group_a
+                    del self.open_groups[root_b]
+                self.parent[root_b] = root_a
+                group_a[0] = max(group_a[0], group_b[0])
+                group_a[1].extend(group_b[1])
+                group_a[2] += group_b[2]
+                group_a[3] += group_b[3]
+                group_a[4] = min(group_a[4], group_b[4])
+                group_a[5] = max(group_a[5], group_b[5])
+            group_a[2] += count
+            group_a[3] += count * weight
+            group_a[4] = min(group_a[4], weight)
+            group_a[5] = max(group_a[5], weight)
+
+    def finish_below(self, stop):
+        """Return the groups whose nodes are all below stop."""
+        finished = [
+            self._close(self.open_groups.pop(root)[1:])
+            for root in [
+                root for root, group in self.open_groups.items() if group[0] < stop
+            ]
+        ]
+        # Exact copies of a node that never got an edge form a group alone
+        while (
+            self.attached_position < len(self.pending_attached) and
+            self.pending_attached[self.attached_position] < stop
+        ):
+            node = self.pending_attached[self.attached_position]
+            self.attached_position += 1
+            if node not in self.parent:
+                finished.append(self._close([[node], 0, 0.0, float('inf'), 0.0]))
+        finished.sort(key=lambda group: group['indices'][0])
+        return finished
+
+    def finish(self):
+        """Return every group that has not been handed out yet."""
+        return self.finish_below(float('inf'))
+
+    def _close(self, group):
+        members, pairs, total, minimum, maximum = group
+        # Every two notes of an exact group are a pair at 100%
+        copies = sum(
+            self.attached.get(node, 0) * (self.attached.get(node, 0) + 1) // 2
+            for node in members
+        )
+        if copies:
+            pairs += copies
+            total += copies
+            minimum = min(minimum, 1.0)
+            maximum = 1.0
+        return {
+            'indices': sorted(members),
+            'pairs': pairs,
+            'similarity': total / pairs,
+            'min_similarity': minimum,
+            'max_similarity': maximum
+        }
+
+
+class VaultScanner:
+    """
+    The scan pipeline shared by the GUI and the command line: walk, read,
+    preprocess, hash, vectorize, compare and group.
+
+    After scan(), paths lists every note that was read and edges holds the
+    weight-sorted (rows, cols, weights) over paths, including the 100%
+    edges from each exact copy to its representative. profile holds the
+    ScanProfile of the last scan; profile_capture is passed on to it.
+    strip_obsidian ignores frontmatter, code fences, tags and link syntax.
+    With find_blocks, shared_blocks lists the paragraphs and headed
+    sections that several notes have in common (see shared_blocks).
+
+    Once scan() has compared the notes, their entries drop 'processed',
+    so only metadata and hashes stay in memory. processed_texts() loads
+    the text again from the scan index, or from the notes themselves,
+    for tfidf(), which LiveIndex and QueryIndex are built from.
+
+    With a memory_budget (MB), the scan runs out of core (see
+    dedupe_spill): preprocessed text, the TF-IDF matrix and the edges are
+    spilled to a temporary folder under cache_dir, and entries keep a
+    'spilled' key instead of their 'processed' text. Out-of-core scans
+    compare every pair, so they cannot use LSH, and do not use the scan
+    index.
+
+    With use_simhash, only notes whose SimHash fingerprints are within
+    hamming_distance bits are compared (see dedupe_simhash), a cheap
+    near-duplicate pass that misses looser matches; it replaces LSH.
+    """
+    def __init__(self, vault_path, workers=None, block_size=DEFAULT_BLOCK_SIZE,
+                 use_lsh=False, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS,
+                 shingle_size=DEFAULT_SHINGLE_SIZE, use_cache=True, cache_dir=None,
+                 profile_capture=None, strip_obsidian=False, find_blocks=False,
+                 memory_budget=None, use_simhash=False,
+                 hamming_distance=DEFAULT_HAMMING_DISTANCE):
+        if memory_budget and (use_lsh or use_simhash):
+            raise ValueError("Out-of-core scans cannot use LSH or SimHash.")
+        if use_lsh and use_simhash:
+            raise ValueError("Choose either LSH or SimHash candidates.")
+        self.vault_path = vault_path
+        self.workers = workers
+        self.block_size = block_size
+        self.use_lsh = use_lsh
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.profile_capture = profile_capture
+        self.strip_obsidian = strip_obsidian
+        self.find_blocks = find_blocks
+        self.memory_budget = memory_budget
+        self.use_simhash = use_simhash
+        self.hamming_distance = hamming_distance
+
+        self.profile = ScanProfile(profile_capture)
+        self.file_contents = {}
+        self.changed_files = set()
+        self.errors = {}
+        self.paths = []
+        self.exact_groups = []
+        self.shared_blocks = []
+        self.edges = None
+        self.control = None
+        # Temporary folder and TextSpill of a running out-of-core scan
+        self.work_dir = None
+        self.texts = None
+
+    def scan(self, threshold=MIN_THRESHOLD, progress=None, on_status=None,
+             on_exact_groups=None, on_group=None, control=None):
+        """
+        Scan the vault, keeping every edge at or above threshold (or
+        MIN_THRESHOLD when caching, so cached edges serve any threshold).
+
+        progress is passed on to ingest_vault, on_status receives short
+        status messages and on_exact_groups the exact duplicate groups as
+        soon as they are known. on_group, if given, receives each group at
+        threshold as soon as it is final, with 'files' instead of
+        'indices'. control, a ScanControl, can pause the scan or stop it
+        with ScanCancelled from another thread; a cancelled scan leaves
+        edges as None and does not update the cached edges.
+        """
+        status = on_status or (lambda message: None)
+        with self._session(control) as index:
+            self._scan(index, threshold, progress, status, on_exact_groups, on_group)
+
+    def ingest(self, progress=None, on_status=None, control=None):
+        """
+        Read the vault through the cache without comparing notes, filling
+        file_contents, paths and shared_blocks; edges stay None.
+        """
+        status = on_status or (lambda message: None)
+        self.edges = None
+        with self._session(control) as index:
+            self._ingest(index, progress, status)
+
+    def scan_blocks(self, progress=None, on_status=None, control=None):
+        """Read the vault and return its shared blocks (see ingest)."""
+        self.find_blocks = True
+        self.ingest(progress, on_status, control)
+        return self.shared_blocks
+
+    def groups(self, threshold):
+        """Return the groups at threshold with 'files' instead of 'indices'."""
+        rows, cols, weights = self.edges
+        with self.profile.stage('group', edges=len(weights)) as record:
+            copy_of = exact_copy_of(self.paths, self.exact_groups)
+            groups = [
+                self._with_files(group, self.paths)
+                for group in group_edges(rows, cols, weights, threshold, copy_of)
+            ]
+            record['groups'] = len(groups)
+        return groups
+
+    def forget(self, file_paths):
+        """
+        Drop notes deleted or moved away since the scan from paths,
+        file_contents and edges, so groups() no longer lists them.
+        """
+        gone = set(file_paths)
+        kept = np.array([path not in gone for path in self.paths], dtype=bool)
+        if kept.all():
+            return
+        for path in gone:
+            self.file_contents.pop(path, None)
+        self.paths = [path for path in self.paths if path not in gone]
+        self.exact_groups = [
+            [path for path in group if path not in gone]
+            for group in self.exact_groups
+        ]
+        self.exact_groups = [group for group in self.exact_groups if len(group) > 1]
+        if self.edges is not None:
+            rows, cols, weights = self.edges
+            new_row = (np.cumsum(kept) - 1).astype(np.int32)
+            keep = kept[rows] & kept[cols]
+            self.edges = (new_row[rows[keep]], new_row[cols[keep]], weights[keep])
+
+    def processed_texts(self, paths):
+        """
+        Return the preprocessed text of each note in paths, from the scan
+        index or by reading the note again once scan() has dropped it.
+        """
+        missing = [
+            path for path in paths if 'processed' not in self.file_contents[path]
+        ]
+        loaded = {}
+        if missing and self.use_cache and not self.memory_budget:
+            index = ScanIndex(self.vault_path, self.cache_dir)
+            try:
+                if index.get_meta('preprocess') == self.preprocess_settings():
+                    cached = index.load_files()
+                    loaded = {
+                        path: cached[path]['processed'] for path in missing
+                        if path in cached and
+                        cached[path]['digest'] == self.file_contents[path]['digest']
+                    }
+            finally:
+                index.close()
+        texts = []
+        for path in paths:
+            entry = self.file_contents[path]
+            if 'processed' in entry:
+                texts.append(entry['processed'])
+            elif path in loaded:
+                texts.append(loaded[path])
+            else:
+                try:
+                    text, _, _ = read_text_hashed(path)
+                except (OSError, UnicodeDecodeError) as e:
+                    # Gone or broken since the scan; a rescan will tell
+                    logger.warning("Error reading %s: %s", path, e)
+                    text = ''
+                texts.append(preprocess_text(text, self.strip_obsidian))
+        return texts
+
+    def tfidf(self):
+        """
+        Return (file_contents, vectorizer, matrix) with the TF-IDF row of
+        each note in file_contents. vectorizer is None when no note has a
+        term.
+        """
+        vectorizer = tfidf_vectorizer()
+        try:
+            matrix = vectorizer.fit_transform(self.processed_texts(self.paths)).tocsr()
+        except ValueError:
+            # No note has a single term
+            return self.file_contents, None, sp.csr_matrix((len(self.paths), 0))
+        return self.file_contents, vectorizer, matrix
+
+    @contextmanager
+    def _session(self, control):
+        self.control = control
+        self.profile = ScanProfile(self.profile_capture)
+        self.profile.start()
+        index = None
+        try:
+            if self.memory_budget:
+                from dedupe_spill import TextSpill
+                cache_dir = self.cache_dir or default_cache_dir()
+                os.makedirs(cache_dir, exist_ok=True)
+                # /tmp is often kept in memory, so spill next to the cache
+                self.work_dir = tempfile.mkdtemp(prefix='spill-', dir=cache_dir)
+                self.texts = TextSpill(os.path.join(self.work_dir, 'texts'))
+            elif self.use_cache:
+                index = ScanIndex(self.vault_path, self.cache_dir)
+            yield index
+        finally:
+            if index is not None:
+                index.close()
+            if self.texts is not None:
+                self.texts.close()
+                self.texts = None
+            if self.work_dir is not None:
+                shutil.rmtree(self.work_dir, ignore_errors=True)
+                self.work_dir = None
+            self.profile.stop()
+
+    def _ingest(self, index, progress, status):
+        status("Reading markdown files...")
+        with self.profile.stage('ingest') as record:
+            cached_files = {}
+            if index is not None:
+                # Text preprocessed differently cannot be reused
+                preprocess = self.preprocess_settings()
+                if index.get_meta('preprocess') != preprocess:
+                    index.clear()
+                    index.set_meta('preprocess', preprocess)
+                cached_files = index.load_files()
+            self.file_contents, self.changed_files, self.errors = ingest_vault(
+                self.vault_path, cached_files, self.workers, progress,
+                profile=self.profile, control=self.control,
+                strip_obsidian=self.strip_obsidian, find_blocks=self.find_blocks,
+                spill=self.texts.add if self.texts is not None else None
+            )
+            if self.texts is not None:
+                self.texts.finish()
+            record.update(
+                files=len(self.file_contents), changed=len(self.changed_files)
+            )
+        if index is not None:
+            with self.profile.stage('cache', files=len(self.changed_files)):
+                index.update_files(
+                    {path: self.file_contents[path] for path in self.changed_files},
+                    removed=set(cached_files) - set(self.file_contents)
+                )
+        status("File reading complete.")
+        self.paths = list(self.file_contents.keys())
+        self.shared_blocks = []
+        if self.find_blocks:
+            with self.profile.stage('blocks') as record:
+                self.shared_blocks = shared_blocks(self.file_contents)
+                record['blocks'] = len(self.shared_blocks)
+
+    def _scan(self, index, threshold, progress, status, on_exact_groups, on_group):
+        self.edges = None
+        self._ingest(index, progress, status)
+        _checkpoint(self.control)
+        file_paths = self.paths
+
+        # Exact copies are reported straight away; only one representative
+        # per exact group goes through the similarity stage
+        path_index = {path: row for row, path in enumerate(file_paths)}
+        with self.profile.stage('exact') as record:
+            self.exact_groups = exact_duplicate_groups(self.file_contents)
+            record['groups'] = len(self.exact_groups)
+        copies = set()
+        copy_rows, copy_cols = [], []
+        for exact_group in self.exact_groups:
+            representative = path_index[exact_group[0]]
+            for path in exact_group[1:]:
+                copies.add(path)
+                copy_rows.append(representative)
+                copy_cols.append(path_index[path])
+        if self.exact_groups and on_exact_groups is not None:
+            on_exact_groups(self.exact_groups)
+
+        representatives = np.array(
+            [row for row, path in enumerate(file_paths) if path not in copies],
+            dtype=np.int32
+        )
+        representative_paths = [file_paths[row] for row in representatives]
+
+        status(
+            f"Found {len(self.exact_groups)} exact duplicate groups. "
+            "Calculating similarities..."
+        )
+        compare_threshold = threshold
+        if index is not None:
+            compare_threshold = min(threshold, MIN_THRESHOLD)
+
+        # Groups are handed out in representative order, with each exact
+        # copy folded into its representative
+        grouper = None
+        on_block = None
+        streamed = []
+        if on_group is not None:
+            representative_row = {
+                path: row for row, path in enumerate(representative_paths)
+            }
+            grouper = StreamingGrouper({
+                representative_row[exact_group[0]]: len(exact_group) - 1
+                for exact_group in self.exact_groups
+            })
+            copies = {
+                exact_group[0]: exact_group[1:] for exact_group in self.exact_groups
+            }
+            cutoff = threshold - SIMILARITY_EPSILON
+
+            def emit(groups):
+                for group in groups:
+                    group = self._with_files(group, representative_paths)
+                    group['files'] = sorted(
+                        path for representative in group['files']
+                        for path in [representative] + copies.get(representative, [])
+                    )
+                    on_group(group)
+
+            def stream_block(stop, rows, cols, weights):
+                keep = weights >= cutoff
+                grouper.add_edges(rows[keep], cols[keep], weights[keep])
+                streamed.append(stop)
+                emit(grouper.finish_below(stop))
+            on_block = stream_block
+
+        _checkpoint(self.control)
+        rows, cols, weights = self._compare(
+            representative_paths, compare_threshold, index, on_block
+        )
+        if grouper is not None:
+            with self.profile.stage('stream'):
+                if not streamed:
+                    keep = weights >= cutoff
+                    grouper.add_edges(rows[keep], cols[keep], weights[keep])
+                emit(grouper.finish())
+
+        # The text is reloaded if a LiveIndex or QueryIndex needs it
+        for entry in self.file_contents.values():
+            entry.pop('processed', None)
+
+        rows, cols = representatives[rows], representatives[cols]
+        # Exact copies join their representative at 100%
+        rows = np.concatenate([rows, np.array(copy_rows, dtype=np.int32)])
+        cols = np.concatenate([cols, np.array(copy_cols, dtype=np.int32)])
+        weights = np.concatenate([weights, np.ones(len(copy_rows), dtype=np.float32)])
+        self.edges = sort_edges(rows, cols, weights)
+        status("Duplicate search complete.")
+
+    @staticmethod
+    def _with_files(group, paths):
+        group = dict(group)
+        group['files'] = [paths[row] for row in group.pop('indices')]
+        return group
+
+    def preprocess_settings(self):
+        return {'version': PREPROCESS_VERSION, 'strip_obsidian': self.strip_obsidian}
+
+    def _settings(self):
+        settings = {'lsh': self.use_lsh}
+        if self.use_lsh:
+            settings.update(self._signature_params(), bands=self.bands)
+        if self.use_simhash:
+            settings['simhash'] = self.hamming_distance
+        return settings
+
+    def _signature_params(self):
+        return {'num_perm': self.num_perm, 'shingle_size': self.shingle_size}
+
+    def _compare(self, paths, threshold, index, on_block=None):
+        """
+        Return the similarity edges between paths, reusing the cached
+        edges of notes that have not changed since the last scan. Reused
+        weights keep the IDF statistics of the scan that produced them, so
+        they can differ slightly from a full rescan.
+        """
+        no_edges = (
+            np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float32)
+        )
+        if len(paths) < 2:
+            return no_edges
+        if self.texts is not None:
+            return self._compare_spilled(paths, threshold, on_block)
+
+        settings = self._settings()
+        position = {path: row for row, path in enumerate(paths)}
+        dirty = None  # None compares every pair
+        cached_edges = []
+        if index is not None:
+            stored_edges = index.cached_edges(settings, threshold)
+            if stored_edges is not None:
+                dirty = [
+                    row for row, path in enumerate(paths)
+                    if path in self.changed_files or
+                    not self.file_contents[path].get('compared')
+                ]
+                # Fall back to a full comparison when most notes changed
+                if len(dirty) * 2 > len(paths):
+                    dirty = None
+                else:
+                    dirty_paths = {paths[row] for row in dirty}
+                    cached_edges = [
+                        (position[a], position[b], weight)
+                        for a, b, weight in stored_edges
+                        if a in position and b in position and
+                        a not in dirty_paths and b not in dirty_paths and
+                        weight >= threshold - SIMILARITY_EPSILON
+                    ]
+
+        vectors = None
+        if dirty is None or dirty:
+            contents = [self.file_contents[path]['processed'] for path in paths]
+            # Vectorize the contents, keeping the TF-IDF matrix sparse
+            with self.profile.stage('vectorize', documents=len(contents)) as record:
+                vectorizer = tfidf_vectorizer()
+                try:
+                    vectors = vectorizer.fit_transform(contents)
+                except ValueError:
+                    # No note has a single term, e.g. only stop words
+                    record.update(vocabulary=0, nnz=0)
+                else:
+                    record.update(vocabulary=vectors.shape[1], nnz=int(vectors.nnz))
+
+        if vectors is None:
+            rows, cols, weights = no_edges
+        else:
+            # Only pairs at or above the threshold are kept, either from the
+            # LSH or SimHash candidates or block by block over the whole matrix
+            with self.profile.stage(
+                'similarity', rows=len(paths) if dirty is None else len(dirty)
+            ) as record:
+                if self.use_lsh:
+                    signatures = self._lsh_signatures(paths, contents, index)
+                    rows, cols, weights = lsh_similarity_edges(
+                        vectors, contents, threshold, bands=self.bands,
+                        signatures=signatures, rows=dirty
+                    )
+                elif self.use_simhash:
+                    from dedupe_simhash import simhash_similarity_edges
+                    rows, cols, weights = simhash_similarity_edges(
+                        vectors, vectorizer.get_feature_names_out(), threshold,
+                        self.hamming_distance, rows=dirty
+                    )
+                else:
+                    rows, cols, weights = similarity_edges(
+                        vectors, threshold, self.block_size, rows=dirty,
+                        on_block=on_block, control=self.control
+                    )
+                record['edges'] = len(weights)
+
+        if cached_edges:
+            cached_rows, cached_cols, cached_weights = zip(*cached_edges)
+            rows = np.concatenate([rows, np.array(cached_rows, dtype=np.int32)])
+            cols = np.concatenate([cols, np.array(cached_cols, dtype=np.int32)])
+            weights = np.concatenate(
+                [weights, np.array(cached_weights, dtype=np.float32)]
+            )
+
+        if index is not None:
+            with self.profile.stage('cache_edges', edges=len(weights)):
+                index.store_edges(
+                    settings, threshold, paths,
+                    [
+                        (paths[row], paths[col], float(weight))
+                        for row, col, weight in zip(rows, cols, weights)
+                    ]
+                )
+        return rows, cols, weights
+
+    def _compare_spilled(self, paths, threshold, on_block=None):
+        """Out-of-core _compare: spilled matrix, tiles and edges."""
+        from dedupe_spill import (
+            EdgeSpill, plan_tiles, spilled_tfidf, tiled_similarity_edges
+        )
+        keys = [self.file_contents[path]['spilled'] for path in paths]
+        with self.profile.stage('vectorize', documents=len(keys)) as record:
+            matrix = spilled_tfidf(self.texts, keys, self.work_dir)
+            record.update(vocabulary=matrix.shape[1], nnz=int(matrix.nnz))
+
+        tile_rows, tile_cols = plan_tiles(matrix, self.memory_budget)
+        with self.profile.stage(
+            'similarity', rows=len(paths), tile_rows=tile_rows, tile_cols=tile_cols
+        ) as record:
+            edges = EdgeSpill(os.path.join(self.work_dir, 'edges'))
+            tiled_similarity_edges(
+                matrix, threshold, tile_rows, tile_cols, edges,
+                on_block=on_block, control=self.control
+            )
+            rows, cols, weights = edges.load()
+            record['edges'] = len(weights)
+        return rows, cols, weights
+
+    def _lsh_signatures(self, paths, contents, index):
+        """Return MinHash signatures for paths, reusing cached ones."""
+        params = self._signature_params()
+        cached = index.cached_signatures(params) if index is not None else {}
+        missing = [row for row, path in enumerate(paths) if path not in cached]
+        computed = minhash_signatures(
+            [contents[row] for row in missing], self.num_perm, self.shingle_size,
+            control=self.control
+        )
+        if index is not None and missing:
+            index.store_signatures(
+                [paths[row] for row in missing], computed, params
+            )
+        signatures = np.empty((len(paths), self.num_perm), dtype=np.uint32)
+        for row, path in enumerate(paths):
+            if path in cached:
+                signatures[row] = cached[path]
+        signatures[missing] = computed
+        return signatures
@@ -0,0 +1,210 @@
+"""
+Persistent scan index for Obsidian Duplicate Finder.
+
+A small SQLite database per vault remembers each note's mtime, size,
+hashes, preprocessed text, block fingerprints and MinHash signature,
+together with the similarity edges of the last scan, so a rescan only
+re-reads and re-compares the notes that changed.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    normalized_digest TEXT,
+    processed TEXT NOT NULL,
+    blocks TEXT,
+    signature BLOB,
+    compared INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS edges (
+    a TEXT NOT NULL,
+    b TEXT NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (a, b)
+);
+CREATE INDEX IF NOT EXISTS edges_b ON edges (b);
+"""
+
+
+def default_cache_dir():
+    """Return the per-user cache directory for scan indexes."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'
+    )
+    return os.path.join(base, 'obsidian-deduper')
+
+
+def index_path(vault_path, cache_dir=None):
+    """Return the database file used for vault_path."""
+    vault_key = hashlib.sha1(
+        os.path.abspath(vault_path).encode('utf-8')
+    ).hexdigest()[:16]
+    return os.path.join(cache_dir or default_cache_dir(), f"{vault_key}.sqlite")
+
+
+class ScanIndex:
+    """
+    SQLite-backed record of a vault's files and last similarity results.
+
+    Use it as a context manager; the connection belongs to the thread
+    that opened it.
+    """
+    def __init__(self, vault_path, cache_dir=None):
+        self.path = index_path(vault_path, cache_dir)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(_SCHEMA)
+        if self.get_meta('schema_version') != SCHEMA_VERSION:
+            # Tables from an older schema may lack columns
+            self.connection.executescript(
+                "DROP TABLE files; DROP TABLE edges;" + _SCHEMA
+            )
+            self.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute("DELETE FROM edges")
+            self.connection.execute("DELETE FROM meta")
+        self.set_meta('schema_version', SCHEMA_VERSION)
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value))
+            )
+
+    def load_files(self):
+        """Return {path: entry} for every indexed file."""
+        files = {}
+        for row in self.connection.execute(
+            "SELECT path, mtime_ns, size, digest, normalized_digest, processed, "
+            "compared, blocks FROM files"
+        ):
+            files[row[0]] = {
+                'mtime_ns': row[1],
+                'size': row[2],
+                'digest': row[3],
+                'normalized_digest': row[4],
+                'processed': row[5],
+                'compared': bool(row[6])
+            }
+            if row[7] is not None:
+                files[row[0]]['blocks'] = json.loads(row[7])
+        return files
+
+    def update_files(self, file_contents, removed=()):
+        """Store new or changed entries and forget removed paths."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, digest, "
+                "normalized_digest, processed, blocks, signature, compared) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, NULL, 0)",
+                (
+                    (
+                        path, entry['mtime_ns'], entry['size'], entry['digest'],
+                        entry['normalized_digest'], entry['processed'],
+                        json.dumps(entry['blocks']) if 'blocks' in entry else None
+                    )
+                    for path, entry in file_contents.items()
+                )
+            )
+            self._forget(removed)
+
+    def store_signatures(self, paths, signatures, params):
+        """Cache MinHash signatures computed with the given parameters."""
+        if self.get_meta('signature_params') != params:
+            with self.connection:
+                self.connection.execute("UPDATE files SET signature = NULL")
+            self.set_meta('signature_params', params)
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE files SET signature = ? WHERE path = ?",
+                (
+                    (np.ascontiguousarray(signature).tobytes(), path)
+                    for path, signature in zip(paths, signatures)
+                )
+            )
+
+    def cached_signatures(self, params):
+        """Return {path: signature} when they were built with params."""
+        if self.get_meta('signature_params') != params:
+            return {}
+        return {
+            path: np.frombuffer(blob, dtype=np.uint32)
+            for path, blob in self.connection.execute(
+                "SELECT path, signature FROM files WHERE signature IS NOT NULL"
+            )
+        }
+
+    def cached_edges(self, settings, threshold):
+        """
+        Return the last scan's edges as (a, b, weight) path triples if
+        they were computed with the same settings at or below threshold,
+        otherwise None.
+        """
+        if (
+            self.get_meta('edge_settings') != settings or
+            self.get_meta('edge_threshold', 2.0) > threshold
+        ):
+            return None
+        return self.connection.execute("SELECT a, b, weight FROM edges").fetchall()
+
+    def store_edges(self, settings, threshold, compared, edges):
+        """
+        Replace the stored edges with (a, b, weight) path triples and mark
+        which paths took part in the similarity stage.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM edges")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO edges (a, b, weight) VALUES (?, ?, ?)",
+                edges
+            )
+            self.connection.execute("UPDATE files SET compared = 0")
+            self.connection.executemany(
+                "UPDATE files SET compared = 1 WHERE path = ?",
+                ((path,) for path in compared)
+            )
+        self.set_meta('edge_settings', settings)
+        self.set_meta('edge_threshold', threshold)
+
+    def _forget(self, paths):
+        paths = [(path,) for path in paths]
+        self.connection.executemany("DELETE FROM files WHERE path = ?", paths)
+        self.connection.executemany("DELETE FROM edges WHERE a = ?", paths)
+        self.connection.executemany("DELETE FROM edges WHERE b = ?", paths)
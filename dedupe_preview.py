@@ -0,0 +1,80 @@
+"""
+On-demand note previews for Obsidian Duplicate Finder.
+
+Scans keep only metadata, hashes and preprocessed text per note, so the
+text shown in the preview pane is read from disk when a note is selected
+and kept in a small least-recently-used cache bounded by a byte budget.
+"""
+import codecs
+import mmap
+import os
+from collections import OrderedDict
+
+# Total size of the previews kept in memory
+DEFAULT_PREVIEW_BUDGET = 16 << 20
+
+# Only this much of a note is shown; larger notes are truncated
+PREVIEW_MAX_BYTES = 2 << 20
+
+# Notes at least this large are read through a memory map, so only the
+# previewed part is paged in
+MMAP_MIN_BYTES = 1 << 20
+
+
+def read_preview(file_path, max_bytes=PREVIEW_MAX_BYTES):
+    """
+    Return (text, truncated) for at most the first max_bytes of a UTF-8
+    file. A multi-byte character cut at the limit is dropped.
+    """
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        truncated = size > max_bytes
+        if size < MMAP_MIN_BYTES:
+            raw = f.read(max_bytes)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                raw = mapped[:max_bytes]
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    return decoder.decode(raw, final=not truncated), truncated
+
+
+class PreviewCache:
+    """
+    LRU cache of note previews keyed by path, holding at most budget bytes
+    of (encoded) text. An entry is reloaded when the file's mtime or size
+    changes.
+    """
+    def __init__(self, budget=DEFAULT_PREVIEW_BUDGET, max_bytes=PREVIEW_MAX_BYTES):
+        self.budget = budget
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.used = 0
+
+    def get(self, file_path):
+        """Return (text, truncated), raising OSError or UnicodeDecodeError."""
+        stats = os.stat(file_path)
+        key = (stats.st_mtime_ns, stats.st_size)
+        cached = self.entries.get(file_path)
+        if cached is not None and cached[0] == key:
+            self.entries.move_to_end(file_path)
+            return cached[1], cached[2]
+
+        self.discard(file_path)
+        text, truncated = read_preview(file_path, self.max_bytes)
+        cost = min(stats.st_size, self.max_bytes)
+        if cost <= self.budget:
+            self.entries[file_path] = (key, text, truncated, cost)
+            self.used += cost
+            while self.used > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.used -= evicted[3]
+        return text, truncated
+
+    def discard(self, file_path):
+        cached = self.entries.pop(file_path, None)
+        if cached is not None:
+            self.used -= cached[3]
+
+    def clear(self):
+        self.entries.clear()
+        self.used = 0
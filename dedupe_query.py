@@ -0,0 +1,223 @@
+"""
+Nearest-neighbour queries for Obsidian Duplicate Finder.
+
+QueryIndex keeps the L2-normalised TF-IDF rows of every note of a
+finished scan, together with their transpose as an inverted index, so
+"which notes are most like this one?" is one sparse vector-matrix
+product over the query's terms instead of another scan.
+
+The vocabulary, IDF and matrix can be saved next to the vault's scan
+index and loaded by a later query, as long as no note has changed since,
+so the index is not fitted again for every query.
+"""
+import json
+import os
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+
+from dedupe_engine import (
+    PREPROCESS_VERSION, iter_markdown_files, preprocess_text, tfidf_vectorizer
+)
+from dedupe_index import index_path
+
+DEFAULT_TOP_K = 10
+
+SAVED_INDEX_VERSION = 1
+
+
+def query_index_path(vault_path, cache_dir=None):
+    """Return the file the query index of vault_path is saved to."""
+    return os.path.splitext(index_path(vault_path, cache_dir))[0] + '.query.npz'
+
+
+def _saved_meta(strip_obsidian):
+    return {
+        'version': SAVED_INDEX_VERSION,
+        'preprocess': {'version': PREPROCESS_VERSION, 'strip_obsidian': strip_obsidian}
+    }
+
+
+class QueryIndex:
+    """
+    TF-IDF index over the notes in file_contents, as left by a scan.
+
+    Pasted text is preprocessed like the notes (strip_obsidian must match
+    the scan) and weighted with the notes' IDF; words that no note
+    contains are ignored. The index is read-only once built, so queries
+    may run on any thread. tfidf, if given, is the (vectorizer, matrix)
+    of the notes in file_contents; otherwise it is fitted on their
+    'processed' text.
+    """
+    def __init__(self, file_contents, strip_obsidian=False, tfidf=None):
+        paths = list(file_contents)
+        if tfidf is not None:
+            vectorizer, matrix = tfidf
+        else:
+            vectorizer = tfidf_vectorizer()
+            try:
+                matrix = vectorizer.fit_transform(
+                    [file_contents[path]['processed'] for path in paths]
+                )
+            except ValueError:
+                # No note has a single term
+                vectorizer = None
+                matrix = sp.csr_matrix((len(paths), 0))
+        matrix = sp.csr_matrix(matrix)
+        self._setup(
+            paths, strip_obsidian, vectorizer, matrix,
+            [file_contents[path]['mtime_ns'] for path in paths],
+            [file_contents[path]['size'] for path in paths]
+        )
+
+    def _setup(self, paths, strip_obsidian, vectorizer, matrix, mtimes, sizes,
+               terms=None):
+        self.paths = paths
+        self.strip_obsidian = strip_obsidian
+        self.row_of = {
+            os.path.abspath(path): row for row, path in enumerate(self.paths)
+        }
+        self.vectorizer = vectorizer
+        # (vocabulary, idf) of a loaded index, turned into its vectorizer
+        # only by the first text query, as scikit-learn is slow to import
+        self.terms = terms
+        self.matrix = matrix
+        # One row of note weights per term, so a query only touches the
+        # notes sharing at least one of its terms
+        self.postings = self.matrix.T.tocsr()
+        # What each note looked like when indexed, to tell a stale save
+        self.mtimes = np.asarray(mtimes, dtype=np.int64)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+
+    @classmethod
+    def from_scanner(cls, scanner):
+        """
+        Build the index from a VaultScanner or LiveIndex, reusing its
+        TF-IDF matrix.
+        """
+        file_contents, vectorizer, matrix = scanner.tfidf()
+        return cls(
+            file_contents, getattr(scanner, 'strip_obsidian', False),
+            (vectorizer, matrix)
+        )
+
+    def save(self, path, vault_path):
+        """Write the index to path, replacing it in one step."""
+        if self.terms is not None:
+            vocabulary, idf = self.terms
+        elif self.vectorizer is not None:
+            vocabulary = self.vectorizer.get_feature_names_out()
+            idf = self.vectorizer.idf_
+        else:
+            vocabulary = np.array([], dtype=str)
+            idf = np.empty(0)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f, meta=np.array(json.dumps(_saved_meta(self.strip_obsidian))),
+                    paths=np.array(
+                        [os.path.relpath(note, vault_path) for note in self.paths],
+                        dtype=str
+                    ),
+                    mtimes=self.mtimes, sizes=self.sizes,
+                    vocabulary=np.asarray(vocabulary, dtype=str), idf=idf,
+                    data=self.matrix.data, indices=self.matrix.indices,
+                    indptr=self.matrix.indptr
+                )
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, vault_path, strip_obsidian=False, file_contents=None):
+        """
+        Return the index saved at path, or None when there is none or it
+        is out of date: a note was added, removed or modified since, or
+        it was preprocessed differently. Notes are compared with
+        file_contents, or with the vault on disk when it is None.
+        """
+        if file_contents is None:
+            current = {
+                os.path.relpath(note, vault_path): (stats.st_mtime_ns, stats.st_size)
+                for note, stats in iter_markdown_files(vault_path)
+            }
+        else:
+            current = {
+                os.path.relpath(note, vault_path): (entry['mtime_ns'], entry['size'])
+                for note, entry in file_contents.items()
+            }
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                if json.loads(str(saved['meta'])) != _saved_meta(strip_obsidian):
+                    return None
+                notes = saved['paths'].tolist()
+                mtimes, sizes = saved['mtimes'], saved['sizes']
+                if current != {
+                    note: (int(mtime), int(size))
+                    for note, mtime, size in zip(notes, mtimes, sizes)
+                }:
+                    return None
+                vocabulary = saved['vocabulary'].tolist()
+                idf = saved['idf']
+                matrix = sp.csr_matrix(
+                    (saved['data'], saved['indices'], saved['indptr']),
+                    shape=(len(notes), len(vocabulary))
+                )
+        except (OSError, ValueError, KeyError):
+            return None
+
+        index = cls.__new__(cls)
+        index._setup(
+            [os.path.join(vault_path, note) for note in notes], strip_obsidian,
+            None, matrix, mtimes, sizes, (vocabulary, idf) if vocabulary else None
+        )
+        return index
+
+    def __contains__(self, file_path):
+        return os.path.abspath(file_path) in self.row_of
+
+    def similar_to_note(self, file_path, k=DEFAULT_TOP_K):
+        """
+        Return up to k (path, similarity) pairs for the notes most like
+        the indexed note at file_path, best first, leaving out the note
+        itself. Raises KeyError for a note that is not in the index.
+        """
+        row = self.row_of.get(os.path.abspath(file_path))
+        if row is None:
+            raise KeyError(f"{file_path} is not in the index.")
+        return self._top(self.matrix[row], k, exclude=row)
+
+    def similar_to_text(self, text, k=DEFAULT_TOP_K):
+        """Return up to k (path, similarity) pairs for the notes most like text."""
+        if self.vectorizer is None and self.terms is not None:
+            vocabulary, idf = self.terms
+            vectorizer = tfidf_vectorizer()
+            vectorizer.vocabulary_ = {
+                term: column for column, term in enumerate(vocabulary)
+            }
+            vectorizer.idf_ = idf
+            self.vectorizer = vectorizer
+        if self.vectorizer is None:
+            return []
+        vector = self.vectorizer.transform(
+            [preprocess_text(text, self.strip_obsidian)]
+        )
+        return self._top(vector, k)
+
+    def _top(self, vector, k, exclude=None):
+        scores = (vector @ self.postings).toarray().ravel()
+        if exclude is not None:
+            scores[exclude] = 0.0
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [
+            (self.paths[row], float(scores[row])) for row in top if scores[row] > 0
+        ]
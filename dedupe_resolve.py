@@ -0,0 +1,160 @@
+"""
+Bulk resolution of duplicate groups for Obsidian Duplicate Finder.
+
+A keep policy picks the note to keep in every group at once, and the
+other notes are moved into the vault's .trash folder (where Obsidian puts
+deleted notes, and which scans leave out) in a new cleanup folder that
+mirrors the vault's layout. Each move is appended to the cleanup's
+journal as soon as it is done, so undo_cleanup() can put the notes back
+even after an interrupted cleanup.
+"""
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from dedupe_engine import TRASH_FOLDER
+
+# newest: latest modification time; largest: most bytes; shortest-path:
+# fewest characters in the path; folder: the newest note in a preferred
+# folder
+KEEP_POLICIES = ('newest', 'largest', 'shortest-path', 'folder')
+
+JOURNAL_NAME = 'journal.jsonl'
+CLEANUP_PREFIX = 'dedupe-'
+
+
+def choose_keeper(files, file_contents, policy, folder=None):
+    """
+    Return the file of a group that policy keeps, or None when the
+    'folder' policy finds no file below folder. Ties go to the newest
+    note, then to the shortest path.
+    """
+    def newest(path):
+        return (-file_contents[path]['mtime_ns'], len(path), path)
+
+    if policy == 'newest':
+        return min(files, key=newest)
+    if policy == 'largest':
+        return min(files, key=lambda path: (-file_contents[path]['size'],) + newest(path))
+    if policy == 'shortest-path':
+        return min(files, key=lambda path: (len(path),) + newest(path))
+    if policy == 'folder':
+        if not folder:
+            raise ValueError("The 'folder' keep policy needs a folder.")
+        prefix = os.path.join(os.path.abspath(folder), '')
+        inside = [path for path in files if os.path.abspath(path).startswith(prefix)]
+        return min(inside, key=newest) if inside else None
+    raise ValueError(
+        f"Unknown keep policy {policy!r}; choose one of {', '.join(KEEP_POLICIES)}."
+    )
+
+
+def plan_cleanup(groups, file_contents, policy, folder=None):
+    """
+    Return a (keep, remove) pair for every group of files that policy can
+    resolve; groups it leaves alone are skipped. Files missing from
+    file_contents (deleted since the scan) are left out of their group.
+    """
+    plan = []
+    for files in groups:
+        files = [path for path in files if path in file_contents]
+        if len(files) < 2:
+            continue
+        keep = choose_keeper(files, file_contents, policy, folder)
+        if keep is not None:
+            plan.append((keep, [path for path in files if path != keep]))
+    return plan
+
+
+def move_to_trash(vault_path, plan):
+    """
+    Move every file to remove in plan into a new cleanup folder in the
+    vault's trash. Return (journal_path, moved, errors), where moved
+    lists the original paths that were moved and errors maps the others
+    to a message.
+    """
+    trash = os.path.join(vault_path, TRASH_FOLDER)
+    os.makedirs(trash, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    cleanup_dir = tempfile.mkdtemp(prefix=f'{CLEANUP_PREFIX}{stamp}-', dir=trash)
+    journal_path = os.path.join(cleanup_dir, JOURNAL_NAME)
+    moved = []
+    errors = {}
+    with open(journal_path, 'a', encoding='utf-8') as journal:
+        for keep, remove in plan:
+            kept = os.path.relpath(keep, vault_path)
+            for file_path in remove:
+                note = os.path.relpath(file_path, vault_path)
+                target = os.path.join(cleanup_dir, note)
+                try:
+                    stats = os.stat(file_path)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(file_path, target)
+                except OSError as e:
+                    errors[file_path] = str(e)
+                    continue
+                journal.write(json.dumps({
+                    'note': note, 'kept': kept,
+                    'size': stats.st_size, 'mtime_ns': stats.st_mtime_ns
+                }) + '\n')
+                journal.flush()
+                moved.append(file_path)
+    return journal_path, moved, errors
+
+
+def list_cleanups(vault_path):
+    """Return the journal paths of the vault's cleanups, newest first."""
+    trash = os.path.join(vault_path, TRASH_FOLDER)
+    try:
+        names = os.listdir(trash)
+    except OSError:
+        return []
+    journals = [
+        os.path.join(trash, name, JOURNAL_NAME) for name in names
+        if name.startswith(CLEANUP_PREFIX)
+    ]
+    journals = [path for path in journals if os.path.isfile(path)]
+    return sorted(journals, key=lambda path: (os.path.getmtime(path), path), reverse=True)
+
+
+def read_journal(journal_path):
+    with open(journal_path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def undo_cleanup(journal_path):
+    """
+    Move the notes of a cleanup back to where they were. Return
+    (restored, errors) with the restored paths and a message for each
+    note left in the trash, such as one whose old path is taken again.
+    A fully undone cleanup is removed from the trash; otherwise its
+    journal keeps only the notes still there, so undo can be retried.
+    """
+    cleanup_dir = os.path.dirname(os.path.abspath(journal_path))
+    vault_path = os.path.dirname(os.path.dirname(cleanup_dir))
+    restored = []
+    errors = {}
+    remaining = []
+    for entry in read_journal(journal_path):
+        source = os.path.join(cleanup_dir, entry['note'])
+        file_path = os.path.join(vault_path, entry['note'])
+        try:
+            if os.path.exists(file_path):
+                raise FileExistsError(f"{entry['note']} already exists in the vault")
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            shutil.move(source, file_path)
+        except OSError as e:
+            errors[file_path] = str(e)
+            remaining.append(entry)
+            continue
+        restored.append(file_path)
+
+    if remaining:
+        with open(journal_path, 'w', encoding='utf-8') as journal:
+            for entry in remaining:
+                journal.write(json.dumps(entry) + '\n')
+    else:
+        shutil.rmtree(cleanup_dir, ignore_errors=True)
+    return restored, errors
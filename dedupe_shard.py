@@ -0,0 +1,460 @@
+"""
+Sharded scanning for Obsidian Duplicate Finder.
+
+A vault is split into shards by a hash of each note's relative path. Each
+shard is built independently (on another process or machine) into a
+portable .npz artifact holding the notes' metadata, hashes, raw term
+counts and, optionally, MinHash signatures. The merge step combines the
+document frequencies of all shards into the global IDF, reweights each
+shard with it and compares shards pairwise, so it never holds more than
+two shards' vectors at once and finds the same groups as a single
+VaultScanner scan.
+
+With MinHash signatures, only the pairs sharing an LSH bucket are
+scored. Otherwise the candidates come from prefix filtering: each note's
+terms are ordered rarest first, and its prefix is the shortest run of
+them after which the remaining weights are too small to reach the
+threshold on their own. Two notes at or above the threshold always share
+a prefix term, so a block of notes is only compared with the notes
+sharing a prefix term with one of them, or with all notes when most of
+them do (long prefixes, at low thresholds).
+"""
+import json
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from dedupe_engine import (
+    DEFAULT_BANDS, DEFAULT_BLOCK_SIZE, DEFAULT_NUM_PERM, DEFAULT_SHINGLE_SIZE,
+    PREPROCESS_VERSION, SIMILARITY_EPSILON, exact_copy_of, exact_duplicate_groups,
+    group_edges, ingest_vault, lsh_candidate_pairs, minhash_signatures,
+    pair_similarities, sort_edges
+)
+
+ARTIFACT_VERSION = 2
+
+# Slack on the squared prefix norm, so rounding never drops a prefix term
+_PREFIX_MARGIN = 1e-6
+# Share of candidate rows above which a block is compared with every row
+_PREFIX_DENSE_SHARE = 0.5
+
+
+def shard_of(rel_path, shard_count):
+    """Return the shard a note belongs to, from its '/'-separated path."""
+    return zlib.crc32(rel_path.encode('utf-8')) % shard_count
+
+
+def _rel_path(vault_path, file_path):
+    return os.path.relpath(file_path, vault_path).replace(os.sep, '/')
+
+
+def build_shard(vault_path, shard, shard_count, out_path, workers=None,
+                use_lsh=False, num_perm=DEFAULT_NUM_PERM,
+                shingle_size=DEFAULT_SHINGLE_SIZE, progress=None,
+                strip_obsidian=False):
+    """
+    Read the notes of one shard and save them as an artifact at out_path.
+
+    Term counts are stored rather than TF-IDF weights, since the IDF is
+    only known once every shard has been built. Returns the read errors.
+    """
+    if not 0 <= shard < shard_count:
+        raise ValueError(f"Shard {shard} is not between 0 and {shard_count - 1}.")
+    file_contents, _, errors = ingest_vault(
+        vault_path, workers=workers, progress=progress,
+        include=lambda path: shard_of(
+            _rel_path(vault_path, path), shard_count
+        ) == shard,
+        strip_obsidian=strip_obsidian
+    )
+    paths = list(file_contents)
+    contents = [file_contents[path]['processed'] for path in paths]
+    from sklearn.feature_extraction.text import CountVectorizer
+    try:
+        vectorizer = CountVectorizer(analyzer=str.split, dtype=np.int32)
+        counts = sp.csr_matrix(vectorizer.fit_transform(contents))
+        vocabulary = vectorizer.get_feature_names_out()
+    except ValueError:
+        # No shard document has a single term
+        counts = sp.csr_matrix((len(paths), 0), dtype=np.int32)
+        vocabulary = np.array([], dtype=str)
+
+    meta = {
+        'version': ARTIFACT_VERSION,
+        'vault': os.path.abspath(vault_path),
+        'shard': shard,
+        'shards': shard_count,
+        'lsh': {'num_perm': num_perm, 'shingle_size': shingle_size} if use_lsh else None,
+        'preprocess': {'version': PREPROCESS_VERSION, 'strip_obsidian': strip_obsidian}
+    }
+    arrays = {
+        'meta': np.array(json.dumps(meta)),
+        'paths': np.array([_rel_path(vault_path, path) for path in paths], dtype=str),
+        'sizes': np.array(
+            [file_contents[path]['size'] for path in paths], dtype=np.int64
+        ),
+        'mtimes': np.array(
+            [file_contents[path]['mtime_ns'] for path in paths], dtype=np.int64
+        ),
+        'digests': np.array(
+            [file_contents[path]['digest'] for path in paths], dtype=str
+        ),
+        'normalized_digests': np.array(
+            [file_contents[path]['normalized_digest'] or '' for path in paths],
+            dtype=str
+        ),
+        'vocabulary': np.asarray(vocabulary, dtype=str),
+        'data': counts.data,
+        'indices': counts.indices,
+        'indptr': counts.indptr
+    }
+    if use_lsh:
+        arrays['signatures'] = minhash_signatures(contents, num_perm, shingle_size)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    return errors
+
+
+def _load_counts(artifact_path):
+    with np.load(artifact_path, allow_pickle=False) as artifact:
+        return sp.csr_matrix(
+            (artifact['data'], artifact['indices'], artifact['indptr']),
+            shape=(len(artifact['paths']), len(artifact['vocabulary']))
+        )
+
+
+def _shard_vectors(artifact_path, rows, columns, idf):
+    """L2-normalised TF-IDF rows of a shard, in global vocabulary columns."""
+    from sklearn.preprocessing import normalize
+    counts = _load_counts(artifact_path)[rows].tocoo()
+    weights = sp.csr_matrix(
+        (counts.data.astype(np.float64), (counts.row, columns[counts.col])),
+        shape=(len(rows), len(idf))
+    )
+    return normalize(weights @ sp.diags(idf))
+
+
+def _prefix_matrix(vectors, rank, cutoff):
+    """
+    Return a 0/1 matrix marking the prefix of each row of vectors: its
+    terms in rank order, up to where the norm of the remaining weights
+    drops below cutoff. Its columns are term ranks.
+    """
+    vectors = sp.csr_matrix(vectors)
+    # indptr is copied, as eliminate_zeros() below rewrites it in place
+    prefix = sp.csr_matrix(
+        (
+            vectors.data.astype(np.float64) ** 2, rank[vectors.indices],
+            vectors.indptr.copy()
+        ),
+        shape=vectors.shape
+    )
+    prefix.sort_indices()
+    squares = prefix.data
+    # Squared norm of each entry together with the ones after it in its row
+    cumulative = np.cumsum(squares)
+    row_ends = np.repeat(prefix.indptr[1:] - 1, np.diff(prefix.indptr))
+    tails = cumulative[row_ends] - cumulative + squares
+    prefix.data = (tails >= cutoff * cutoff - _PREFIX_MARGIN).astype(np.float32)
+    prefix.eliminate_zeros()
+    return prefix
+
+
+def _prefix_edges(left, right, same, rank, threshold, block_size):
+    """
+    Edges between the rows of left and right, comparing each block of
+    block_size rows of left only with the rows of right that share a
+    prefix term with one of them. With same (left is right), only pairs
+    i < j.
+    """
+    cutoff = threshold - SIMILARITY_EPSILON
+    left_prefix = _prefix_matrix(left, rank, cutoff)
+    right_prefix = (left_prefix if same else _prefix_matrix(right, rank, cutoff)).tocsc()
+    right_t = right.T.tocsc()
+    pair_rows, pair_cols, weights = [], [], []
+    for start in range(0, left.shape[0], block_size):
+        stop = start + block_size
+        # Only later rows can pair with the block within one shard
+        first = start + 1 if same else 0
+        terms = np.unique(left_prefix[start:stop].indices)
+        candidates = np.unique(right_prefix[:, terms].indices)
+        candidates = candidates[candidates >= first]
+        if not len(candidates):
+            continue
+        if len(candidates) > _PREFIX_DENSE_SHARE * (right.shape[0] - first):
+            block = (left[start:stop] @ right_t[:, first:]).tocoo()
+            cols = (block.col + first).astype(np.int32)
+        else:
+            block = (left[start:stop] @ right[candidates].T).tocoo()
+            cols = candidates[block.col].astype(np.int32)
+        rows = block.row.astype(np.int32) + start
+        keep = block.data >= cutoff
+        if same:
+            keep &= rows < cols
+        pair_rows.append(rows[keep])
+        pair_cols.append(cols[keep])
+        weights.append(block.data[keep].astype(np.float32))
+    if not pair_rows:
+        return (
+            np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float32)
+        )
+    return (
+        np.concatenate(pair_rows), np.concatenate(pair_cols),
+        np.concatenate(weights)
+    )
+
+
+def _compare_shards(left, right, idf, threshold, block_size, pairs=None, rank=None):
+    """
+    Compare the representative rows of two shards, each given as
+    (artifact_path, rows, columns, global_rows). With pairs only those
+    (left row, right row) candidates are scored; otherwise rank, the
+    prefix order of the global terms, picks the rows to compare (see
+    _prefix_edges). Returns edges over global rows.
+    """
+    left_vectors = _shard_vectors(left[0], left[1], left[2], idf)
+    same = left[0] == right[0]
+    right_vectors = (
+        left_vectors if same else _shard_vectors(right[0], right[1], right[2], idf)
+    )
+    if pairs is None:
+        rows, cols, weights = _prefix_edges(
+            left_vectors, right_vectors, same, rank, threshold, block_size
+        )
+    else:
+        rows, cols = pairs
+        weights = pair_similarities(left_vectors, rows, cols, right_vectors)
+        keep = weights >= threshold - SIMILARITY_EPSILON
+        rows, cols, weights = rows[keep], cols[keep], weights[keep]
+    first, second = left[3][rows], right[3][cols]
+    return np.minimum(first, second), np.maximum(first, second), weights
+
+
+class ShardMerger:
+    """
+    Merge shard artifacts into one scan result with the same attributes
+    as VaultScanner: paths, file_contents (metadata only), exact_groups
+    and the weight-sorted edges over paths.
+
+    Paths are rebuilt under vault_path, or under the vault recorded in
+    the first artifact, which merge() then stores as vault_path. With
+    workers > 1, shard pairs are compared on that many local processes.
+    """
+    def __init__(self, artifact_paths, vault_path=None, block_size=DEFAULT_BLOCK_SIZE,
+                 bands=DEFAULT_BANDS, workers=None):
+        self.artifact_paths = list(artifact_paths)
+        self.vault_path = vault_path
+        self.block_size = block_size
+        self.bands = bands
+        self.workers = workers
+
+        self.file_contents = {}
+        self.paths = []
+        self.exact_groups = []
+        self.edges = None
+
+    def merge(self, threshold):
+        """Compare every shard pair, keeping edges at or above threshold."""
+        shards = self._read_metadata()
+        file_paths = self.paths = list(self.file_contents)
+        path_index = {path: row for row, path in enumerate(file_paths)}
+
+        self.exact_groups = exact_duplicate_groups(self.file_contents)
+        copies = set()
+        copy_rows, copy_cols = [], []
+        for exact_group in self.exact_groups:
+            representative = path_index[exact_group[0]]
+            for path in exact_group[1:]:
+                copies.add(path)
+                copy_rows.append(representative)
+                copy_cols.append(path_index[path])
+
+        # Global document frequencies over the representatives, which is
+        # what a single scan fits its TF-IDF model on
+        vocabulary = np.unique(np.concatenate(
+            [shard['vocabulary'] for shard in shards] or [np.array([], dtype=str)]
+        ))
+        document_frequency = np.zeros(len(vocabulary), dtype=np.int64)
+        for shard in shards:
+            shard['columns'] = np.searchsorted(vocabulary, shard['vocabulary'])
+            shard['rows'] = np.array(
+                [row for row, path in enumerate(shard['paths']) if path not in copies],
+                dtype=np.int32
+            )
+            shard['global_rows'] = np.array(
+                [path_index[shard['paths'][row]] for row in shard['rows']],
+                dtype=np.int32
+            )
+            counts = _load_counts(shard['artifact'])[shard['rows']]
+            np.add.at(
+                document_frequency, shard['columns'],
+                np.diff(counts.tocsc().indptr)
+            )
+        n_documents = sum(len(shard['rows']) for shard in shards)
+        # TfidfVectorizer's smoothed IDF
+        idf = np.log((1 + n_documents) / (1 + document_frequency)) + 1
+
+        tasks = self._tasks(shards, idf, document_frequency)
+        results = []
+        if self.workers and self.workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(
+                min(self.workers, len(tasks)),
+                mp_context=multiprocessing.get_context('spawn')
+            ) as pool:
+                futures = [
+                    pool.submit(
+                        _compare_shards, left, right, idf, threshold,
+                        self.block_size, pairs, rank
+                    )
+                    for left, right, pairs, rank in tasks
+                ]
+                results = [future.result() for future in futures]
+        else:
+            results = [
+                _compare_shards(
+                    left, right, idf, threshold, self.block_size, pairs, rank
+                )
+                for left, right, pairs, rank in tasks
+            ]
+
+        results.append((
+            np.array(copy_rows, dtype=np.int32), np.array(copy_cols, dtype=np.int32),
+            np.ones(len(copy_rows), dtype=np.float32)
+        ))
+        rows, cols, weights = (np.concatenate(parts) for parts in zip(*results))
+        self.edges = sort_edges(rows, cols, weights)
+
+    def groups(self, threshold):
+        """Return the groups at threshold with 'files' instead of 'indices'."""
+        rows, cols, weights = self.edges
+        copy_of = exact_copy_of(self.paths, self.exact_groups)
+        groups = []
+        for group in group_edges(rows, cols, weights, threshold, copy_of):
+            group = dict(group)
+            group['files'] = [self.paths[row] for row in group.pop('indices')]
+            groups.append(group)
+        return groups
+
+    def _read_metadata(self):
+        shards = []
+        seen = {}
+        lsh = None
+        for artifact_path in self.artifact_paths:
+            with np.load(artifact_path, allow_pickle=False) as artifact:
+                meta = json.loads(str(artifact['meta']))
+                if meta['version'] != ARTIFACT_VERSION:
+                    raise ValueError(
+                        f"{artifact_path} has artifact version {meta['version']}, "
+                        f"expected {ARTIFACT_VERSION}."
+                    )
+                self.vault_path = self.vault_path or meta['vault']
+                shard = {
+                    'artifact': artifact_path,
+                    'meta': meta,
+                    'paths': [
+                        os.path.join(self.vault_path, *rel_path.split('/'))
+                        for rel_path in artifact['paths']
+                    ],
+                    'vocabulary': artifact['vocabulary'],
+                    'signatures': (
+                        artifact['signatures'] if meta['lsh'] else None
+                    )
+                }
+                # Each artifact[name] reads the array from the file again
+                columns = zip(
+                    artifact['sizes'].tolist(), artifact['mtimes'].tolist(),
+                    artifact['digests'].tolist(),
+                    artifact['normalized_digests'].tolist()
+                )
+                for path, (size, mtime_ns, digest, normalized_digest) in zip(
+                    shard['paths'], columns
+                ):
+                    self.file_contents[path] = {
+                        'size': size,
+                        'mtime_ns': mtime_ns,
+                        'digest': digest,
+                        'normalized_digest': normalized_digest or None
+                    }
+            key = (meta['shard'], meta['shards'])
+            if key in seen:
+                raise ValueError(
+                    f"{artifact_path} and {seen[key]} are both shard "
+                    f"{meta['shard']} of {meta['shards']}."
+                )
+            seen[key] = artifact_path
+            if shards and (meta['shards'], meta['lsh'], meta['preprocess']) != (
+                shards[0]['meta']['shards'], lsh, shards[0]['meta']['preprocess']
+            ):
+                raise ValueError(
+                    f"{artifact_path} was built with different shard, LSH or "
+                    "preprocessing settings from the other artifacts."
+                )
+            lsh = meta['lsh']
+            shards.append(shard)
+        if shards and len(shards) != shards[0]['meta']['shards']:
+            raise ValueError(
+                f"Expected {shards[0]['meta']['shards']} shards, "
+                f"got {len(shards)}."
+            )
+        self.file_contents = dict(sorted(self.file_contents.items()))
+        return shards
+
+    def _tasks(self, shards, idf, document_frequency):
+        """
+        (left, right, pairs, rank) for every shard pair that needs
+        comparing; see _compare_shards.
+        """
+        def side(shard):
+            return (
+                shard['artifact'], shard['rows'], shard['columns'],
+                shard['global_rows']
+            )
+
+        if not len(idf):
+            # No note has a single term, so none is similar to another
+            return []
+        if shards[0]['meta']['lsh'] is None:
+            # Prefixes start with the rarest terms
+            rank = np.empty(len(idf), dtype=np.int64)
+            rank[np.argsort(document_frequency, kind='stable')] = np.arange(len(idf))
+            # A shard may hold nothing but exact copies
+            shards = [shard for shard in shards if len(shard['rows'])]
+            return [
+                (side(shards[i]), side(shards[j]), None, rank)
+                for i in range(len(shards)) for j in range(i, len(shards))
+            ]
+
+        # Candidate pairs come from banding every representative's
+        # signature together, then are scored per shard pair
+        owner = np.concatenate([
+            np.full(len(shard['rows']), number, dtype=np.int32)
+            for number, shard in enumerate(shards)
+        ])
+        local = np.concatenate([
+            np.arange(len(shard['rows']), dtype=np.int32) for shard in shards
+        ])
+        global_rows = np.concatenate([shard['global_rows'] for shard in shards])
+        # Band in global path order, as a single scan does
+        order = np.argsort(global_rows, kind='stable')
+        owner, local = owner[order], local[order]
+        signatures = np.concatenate([
+            shard['signatures'][shard['rows']] for shard in shards
+        ])[order]
+        first, second = lsh_candidate_pairs(signatures, self.bands)
+
+        tasks = []
+        for i in range(len(shards)):
+            for j in range(i, len(shards)):
+                forward = (owner[first] == i) & (owner[second] == j)
+                backward = (owner[first] == j) & (owner[second] == i) & (i != j)
+                rows = np.concatenate([local[first[forward]], local[second[backward]]])
+                cols = np.concatenate([local[second[forward]], local[first[backward]]])
+                if len(rows):
+                    tasks.append((side(shards[i]), side(shards[j]), (rows, cols), None))
+        return tasks
@@ -0,0 +1,244 @@
+"""
+SimHash candidate search for Obsidian Duplicate Finder.
+
+Each note gets a 64-bit SimHash fingerprint: every term votes on each bit
+with its TF-IDF weight, according to one bit of the term's hash, and the
+bits whose votes sum above zero are set. The angle between two notes'
+TF-IDF vectors is roughly pi * (Hamming distance) / 64, so near-copies
+have fingerprints a few bits apart.
+
+Fingerprints within Hamming distance k of each other agree exactly on at
+least B - k of any B > k blocks of bits. SimHashIndex sorts one table per
+combination of B - k blocks, keyed on those bits, so the notes sharing a
+key form one run found by binary search, and only those are checked bit
+by bit. B grows with the number of notes so that keys stay selective.
+Candidate pairs are then scored with the TF-IDF cosine like LSH
+candidates.
+"""
+import hashlib
+import itertools
+import math
+
+import numpy as np
+import scipy.sparse as sp
+
+from dedupe_engine import (
+    DEFAULT_HAMMING_DISTANCE, SIMILARITY_EPSILON, pair_similarities, run_pairs
+)
+
+FINGERPRINT_BITS = 64
+# Larger distances need so many tables that a full comparison is cheaper
+MAX_HAMMING_DISTANCE = 15
+# Most tables simhash_tables considers for one search
+MAX_TABLES = 4096
+# Candidate pairs expanded per step of a lookup
+_LOOKUP_CHUNK = 1 << 20
+
+# Fingerprint bits computed per sparse product
+_BITS_PER_STEP = 16
+
+_BYTE_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def check_distance(distance):
+    if not 0 <= distance <= MAX_HAMMING_DISTANCE:
+        raise ValueError(
+            f"Hamming distance must be between 0 and {MAX_HAMMING_DISTANCE}."
+        )
+
+
+def term_hashes(terms):
+    """Return a stable 64-bit hash of each term as a uint64 array."""
+    return np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little'
+            )
+            for term in terms
+        ),
+        dtype=np.uint64, count=len(terms)
+    )
+
+
+def simhash_fingerprints(matrix, terms):
+    """
+    Return the uint64 SimHash fingerprint of each row of a TF-IDF matrix
+    whose columns are terms. Rows without any term get 0.
+    """
+    matrix = sp.csr_matrix(matrix)
+    hashes = term_hashes(terms)
+    fingerprints = np.zeros(matrix.shape[0], dtype=np.uint64)
+    for start in range(0, FINGERPRINT_BITS, _BITS_PER_STEP):
+        bits = np.arange(start, start + _BITS_PER_STEP, dtype=np.uint64)
+        # +1 where a term's hash has the bit set, -1 where it does not
+        votes = ((hashes[:, None] >> bits) & np.uint64(1)).astype(np.float32) * 2 - 1
+        sums = np.asarray(matrix @ votes)
+        fingerprints |= ((sums > 0).astype(np.uint64) << bits).sum(
+            axis=1, dtype=np.uint64
+        )
+    return fingerprints
+
+
+def hamming_distances(fingerprints, fingerprint):
+    """Return the number of bits in which each fingerprint differs from fingerprint."""
+    differences = np.ascontiguousarray(
+        np.bitwise_xor(fingerprints, fingerprint), dtype=np.uint64
+    )
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(differences)
+    return _BYTE_POPCOUNT[differences.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _bit_blocks(count):
+    """Return the masks of count nearly equal blocks covering all 64 bits."""
+    masks = []
+    offset = 0
+    for block in range(count):
+        width = FINGERPRINT_BITS // count + (block < FINGERPRINT_BITS % count)
+        masks.append(((1 << width) - 1) << offset)
+        offset += width
+    return masks
+
+
+def simhash_tables(distance, n_fingerprints):
+    """
+    Return the key masks of the permuted tables that find every pair of
+    n_fingerprints fingerprints within distance of each other.
+
+    The bits are split into B > distance blocks. Fingerprints within
+    distance differ in at most distance blocks, so they agree exactly on
+    at least B - distance of them, and each table keys the fingerprints
+    on one combination of B - distance blocks. More blocks make longer
+    keys and fewer false candidates per table but need more tables; B is
+    chosen to minimise the estimated work of sorting every table and
+    checking its candidates.
+    """
+    check_distance(distance)
+    n = max(n_fingerprints, 2)
+    best = None
+    for count in range(distance + 1, FINGERPRINT_BITS + 1):
+        tables = math.comb(count, distance)
+        if best is not None and tables > MAX_TABLES:
+            break
+        key_bits = FINGERPRINT_BITS * (count - distance) / count
+        cost = tables * (n * math.log2(n) + n * n / 2 ** key_bits)
+        if best is None or cost < best[0]:
+            best = (cost, count)
+    blocks = _bit_blocks(best[1])
+    masks = []
+    for chosen in itertools.combinations(blocks, best[1] - distance):
+        mask = 0
+        for block in chosen:
+            mask |= block
+        masks.append(np.uint64(mask))
+    return masks
+
+
+class SimHashIndex:
+    """
+    Permuted tables over fingerprints for Hamming distance lookups. Only
+    the given rows (by default all) are indexed; rows number the whole
+    fingerprints array. Tables are sorted one at a time when needed, so
+    the index itself holds nothing but the fingerprints.
+    """
+    def __init__(self, fingerprints, distance=DEFAULT_HAMMING_DISTANCE, rows=None):
+        check_distance(distance)
+        self.fingerprints = np.ascontiguousarray(fingerprints, dtype=np.uint64)
+        self.distance = distance
+        if rows is None:
+            rows = np.arange(len(self.fingerprints), dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.masks = simhash_tables(distance, len(self.rows))
+
+    def _tables(self):
+        """Yield (mask, sorted keys, their rows) for every table."""
+        indexed = self.fingerprints[self.rows]
+        for mask in self.masks:
+            keys = indexed & mask
+            order = np.argsort(keys, kind='stable')
+            yield mask, keys[order], self.rows[order]
+
+    def _close(self, first, second):
+        """Return pair keys i * n + j (i < j) of the pairs within distance."""
+        close = hamming_distances(
+            self.fingerprints[first], self.fingerprints[second]
+        ) <= self.distance
+        first, second = first[close], second[close]
+        n_rows = len(self.fingerprints)
+        return np.minimum(first, second) * n_rows + np.maximum(first, second)
+
+    @staticmethod
+    def _split(keys, n_rows):
+        keys = np.unique(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+        return (keys // n_rows).astype(np.int32), (keys % n_rows).astype(np.int32)
+
+    def pairs(self):
+        """Return (rows, cols) of every indexed pair i < j within distance."""
+        keys = []
+        for _, sorted_keys, members in self._tables():
+            found = [
+                self._close(first, second)
+                for first, second in run_pairs(sorted_keys, members)
+            ]
+            if found:
+                # A pair can turn up in several tables
+                keys.append(np.unique(np.concatenate(found)))
+        return self._split(keys, len(self.fingerprints))
+
+    def pairs_with(self, query_rows, chunk=_LOOKUP_CHUNK):
+        """
+        Return (rows, cols), i < j, of the pairs within distance between
+        query_rows and the indexed rows, found by binary search in each
+        table rather than by listing every pair.
+        """
+        query_rows = np.asarray(query_rows, dtype=np.int64)
+        keys = []
+        for mask, sorted_keys, members in self._tables():
+            queries = self.fingerprints[query_rows] & mask
+            low = np.searchsorted(sorted_keys, queries, side='left')
+            counts = np.searchsorted(sorted_keys, queries, side='right') - low
+            ends = np.cumsum(counts)
+            start = 0
+            while start < len(query_rows):
+                # Queries whose candidates fit in one chunk, at least one
+                before = ends[start] - counts[start]
+                stop = max(
+                    start + 1, int(np.searchsorted(ends, before + chunk, side='right'))
+                )
+                part = counts[start:stop]
+                owner = np.repeat(np.arange(start, stop), part)
+                offset = np.arange(len(owner)) - np.repeat(
+                    ends[start:stop] - part - before, part
+                )
+                first = query_rows[owner]
+                second = members[low[owner] + offset]
+                different = first != second
+                keys.append(self._close(first[different], second[different]))
+                start = stop
+        return self._split(keys, len(self.fingerprints))
+
+
+def simhash_similarity_edges(matrix, terms, threshold,
+                             distance=DEFAULT_HAMMING_DISTANCE, rows=None):
+    """
+    Like similarity_edges, but only score the pairs whose SimHash
+    fingerprints are within Hamming distance. A larger distance catches
+    looser matches but checks more candidates; at the default of 8,
+    nearly all pairs above 98% similarity and most above 90% are found.
+
+    rows restricts the result to pairs involving those rows, each looked
+    up in the index instead of listing every pair.
+    """
+    matrix = sp.csr_matrix(matrix)
+    fingerprints = simhash_fingerprints(matrix, terms)
+    # Notes without terms all have the fingerprint 0
+    has_terms = np.diff(matrix.indptr) > 0
+    index = SimHashIndex(fingerprints, distance, np.flatnonzero(has_terms))
+    if rows is None:
+        pair_rows, pair_cols = index.pairs()
+    else:
+        rows = np.asarray(rows, dtype=np.int64)
+        pair_rows, pair_cols = index.pairs_with(rows[has_terms[rows]])
+    weights = pair_similarities(matrix, pair_rows, pair_cols)
+    keep = weights >= threshold - SIMILARITY_EPSILON
+    return pair_rows[keep], pair_cols[keep], weights[keep]
@@ -0,0 +1,220 @@
+"""
+Out-of-core scanning for Obsidian Duplicate Finder.
+
+With a memory budget, a scan keeps only each note's metadata and hashes
+in memory. Preprocessed text is appended to a spill file, the TF-IDF
+matrix is built from it in two passes into memory-mapped arrays, and
+similarities are computed in tiles sized to the budget, with every
+tile's edges appended to disk before they are grouped.
+"""
+import math
+import mmap
+import os
+from array import array
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+
+from dedupe_engine import SIMILARITY_EPSILON
+
+# Smallest budget accepted (MB); below it the tiles get too small to pay
+# for reading their rows
+MIN_MEMORY_BUDGET = 64
+
+# Notes vectorized per step of the second pass over the spilled text
+SPILL_CHUNK_ROWS = 4096
+
+# Notes per column tile; row tiles are sized from the budget
+TILE_COLUMNS = 1024
+
+# Bytes per entry of a tile product in the worst (dense) case: a float64
+# value and its two indices, plus scipy's temporaries
+PRODUCT_ENTRY_BYTES = 32
+
+
+class TextSpill:
+    """
+    Append-only file of preprocessed texts. add() returns a key for the
+    text; once finish() has been called, get(key) reads it back through a
+    memory map, so the texts stay in the page cache rather than in the
+    process.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.offsets = array('q', [0])
+        self.mapped = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, text):
+        data = text.encode('utf-8')
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        return len(self.offsets) - 2
+
+    def finish(self):
+        self.file.close()
+        if self.offsets[-1]:
+            with open(self.path, 'rb') as f:
+                self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, key):
+        start, stop = self.offsets[key], self.offsets[key + 1]
+        if start == stop:
+            return ''
+        return self.mapped[start:stop].decode('utf-8')
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+
+class EdgeSpill:
+    """Edges appended to three flat files, (rows, cols, weights)."""
+    DTYPES = (np.int32, np.int32, np.float32)
+
+    def __init__(self, prefix):
+        self.paths = [f"{prefix}.{name}" for name in ('rows', 'cols', 'weights')]
+        self.files = [open(path, 'wb') for path in self.paths]
+        self.count = 0
+
+    def add(self, rows, cols, weights):
+        for f, values, dtype in zip(self.files, (rows, cols, weights), self.DTYPES):
+            np.asarray(values, dtype=dtype).tofile(f)
+        self.count += len(weights)
+
+    def load(self):
+        """Close the files and return the edges as in-memory arrays."""
+        for f in self.files:
+            f.close()
+        return tuple(
+            np.fromfile(path, dtype=dtype)
+            for path, dtype in zip(self.paths, self.DTYPES)
+        )
+
+
+def spilled_tfidf(texts, keys, work_dir, chunk_rows=SPILL_CHUNK_ROWS):
+    """
+    Return the L2-normalised TF-IDF matrix of the texts at keys in a
+    TextSpill, as a CSR matrix over memory-mapped arrays in work_dir.
+
+    Weights match TfidfVectorizer's defaults (raw counts, smoothed IDF),
+    so similarities equal an in-memory scan's. Terms found in a single
+    note count towards its norm but cannot contribute to any similarity,
+    so only terms shared by two or more notes get a column. The document
+    frequencies of the vocabulary are the only per-term state in memory.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    n_rows = len(keys)
+    frequencies = Counter()
+    for key in keys:
+        frequencies.update(set(texts.get(key).split()))
+    columns = {}
+    shared = []
+    for term, frequency in frequencies.items():
+        if frequency > 1:
+            columns[term] = len(shared)
+            shared.append(frequency)
+    del frequencies
+    if not columns:
+        # No term is shared, so no two notes can be similar
+        return sp.csr_matrix((n_rows, 0))
+    idf = np.log((1 + n_rows) / (1 + np.array(shared, dtype=np.float64))) + 1
+    single_idf = math.log((1 + n_rows) / 2) + 1
+    counter = CountVectorizer(
+        analyzer=str.split, vocabulary=columns, dtype=np.float64
+    )
+
+    data_path = os.path.join(work_dir, 'matrix.data')
+    indices_path = os.path.join(work_dir, 'matrix.indices')
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    with open(data_path, 'wb') as data_file, open(indices_path, 'wb') as indices_file:
+        for start in range(0, n_rows, chunk_rows):
+            chunk = [texts.get(key) for key in keys[start:start + chunk_rows]]
+            counts = counter.transform(chunk).tocsr()
+            # Squared counts of the terms without a column
+            squares = np.array([
+                sum(count * count for count in Counter(text.split()).values())
+                for text in chunk
+            ], dtype=np.float64)
+            single_squares = squares - np.asarray(
+                counts.multiply(counts).sum(axis=1)
+            ).ravel()
+            weights = counts @ sp.diags(idf)
+            norms = np.sqrt(
+                np.asarray(weights.multiply(weights).sum(axis=1)).ravel() +
+                single_squares * single_idf ** 2
+            )
+            norms[norms == 0] = 1.0
+            weights = sp.csr_matrix(sp.diags(1.0 / norms) @ weights)
+            weights.sort_indices()
+            weights.data.astype(np.float64).tofile(data_file)
+            weights.indices.astype(np.int32).tofile(indices_file)
+            stop = start + len(chunk)
+            indptr[start + 1:stop + 1] = indptr[start] + weights.indptr[1:]
+
+    nnz = int(indptr[-1])
+    if nnz:
+        data = np.memmap(data_path, dtype=np.float64, mode='r', shape=(nnz,))
+        indices = np.memmap(indices_path, dtype=np.int32, mode='r', shape=(nnz,))
+    else:
+        data = np.empty(0, dtype=np.float64)
+        indices = np.empty(0, dtype=np.int32)
+    return sp.csr_matrix((data, indices, indptr), shape=(n_rows, len(idf)))
+
+
+def plan_tiles(matrix, memory_budget):
+    """
+    Return (tile_rows, tile_cols) so that a row tile, a column tile and
+    their product fit in half of memory_budget (MB), leaving the rest
+    for the notes' metadata and the interpreter.
+    """
+    budget = max(memory_budget, MIN_MEMORY_BUDGET) * (1 << 20) // 2
+    n_rows = matrix.shape[0]
+    row_bytes = 12 * matrix.nnz / max(1, n_rows)
+    tile_cols = max(1, min(TILE_COLUMNS, n_rows))
+    tile_rows = int(
+        (budget - tile_cols * row_bytes) //
+        (row_bytes + tile_cols * PRODUCT_ENTRY_BYTES)
+    )
+    return max(1, min(tile_rows, n_rows)), tile_cols
+
+
+def tiled_similarity_edges(matrix, threshold, tile_rows, tile_cols, edges,
+                           on_block=None, control=None):
+    """
+    Append every pair i < j with cosine similarity at or above threshold
+    to edges (an EdgeSpill), computing one tile_rows x tile_cols tile of
+    the similarity matrix at a time.
+
+    on_block, if given, is called as on_block(stop, rows, cols, weights)
+    with the edges of each row tile, like similarity_edges. A
+    ScanControl, if given, is checked before each tile.
+    """
+    n_rows = matrix.shape[0]
+    cutoff = threshold - SIMILARITY_EPSILON
+    for start in range(0, n_rows, tile_rows):
+        stop = min(start + tile_rows, n_rows)
+        block = matrix[start:stop]
+        tile_edges = []
+        for col_start in range(start, n_rows, tile_cols):
+            if control is not None:
+                control.checkpoint()
+            col_stop = min(col_start + tile_cols, n_rows)
+            product = (block @ matrix[col_start:col_stop].T).tocoo()
+            rows = product.row.astype(np.int32) + start
+            cols = product.col.astype(np.int32) + col_start
+            keep = (cols > rows) & (product.data >= cutoff)
+            tile_edges.append(
+                (rows[keep], cols[keep], product.data[keep].astype(np.float32))
+            )
+            edges.add(*tile_edges[-1])
+        if on_block is not None:
+            on_block(stop, *(np.concatenate(part) for part in zip(*tile_edges)))
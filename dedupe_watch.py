@@ -0,0 +1,484 @@
+"""
+Watch mode for Obsidian Duplicate Finder.
+
+ChangeWatcher reports which notes were created, edited, moved or deleted,
+using inotify on Linux and mtime polling elsewhere. LiveIndex takes over
+a finished VaultScanner and folds those changes in one note at a time,
+comparing only the changed notes against the stored TF-IDF vectors, so
+the work per change does not grow with the vault the way a rescan does.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from dedupe_engine import (
+    MIN_THRESHOLD, SIMILARITY_EPSILON, TRASH_FOLDER, group_edges, iter_markdown_files,
+    preprocess_text, read_text_hashed, sort_edges, text_digest
+)
+
+logger = logging.getLogger(__name__)
+
+# Changes are reported once the vault has been quiet this long (seconds),
+# so an editor's save-rename-touch sequence counts once
+DEBOUNCE_SECONDS = 0.3
+DEFAULT_POLL_INTERVAL = 2.0
+
+# Replaced vectors are folded back into the base matrix past this many
+REBUILD_OVERRIDES = 1024
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+    _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _PollingBackend:
+    """Find changes by comparing each note's mtime and size between walks."""
+    def __init__(self, vault_path, interval=DEFAULT_POLL_INTERVAL):
+        self.vault_path = vault_path
+        self.interval = interval
+        self.snapshot = self._walk()
+        self.next_poll = time.monotonic() + interval
+
+    def _walk(self):
+        return {
+            path: (stats.st_mtime_ns, stats.st_size)
+            for path, stats in iter_markdown_files(self.vault_path)
+        }
+
+    def read(self, timeout):
+        time.sleep(max(0.0, min(timeout, self.next_poll - time.monotonic())))
+        if time.monotonic() < self.next_poll:
+            return set()
+        self.next_poll = time.monotonic() + self.interval
+        snapshot = self._walk()
+        changed = {
+            path for path, key in snapshot.items() if self.snapshot.get(path) != key
+        }
+        changed |= set(self.snapshot) - set(snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class _InotifyBackend:
+    """Linux inotify watches on every folder of the vault, through ctypes."""
+    def __init__(self, vault_path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+        self.vault_path = vault_path
+        self._watch_tree(vault_path)
+
+    def _watch_tree(self, folder):
+        """Watch folder and its subfolders; return the notes found in them."""
+        notes = set()
+        folders = [folder]
+        while folders:
+            folder = folders.pop()
+            wd = self._add_watch(self.fd, os.fsencode(folder), _WATCH_MASK)
+            if wd < 0:
+                logger.warning(
+                    "Cannot watch %s: %s", folder, os.strerror(ctypes.get_errno())
+                )
+                continue
+            self.folders[wd] = folder
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != TRASH_FOLDER:
+                                folders.append(entry.path)
+                        elif entry.name.endswith(".md"):
+                            notes.add(entry.path)
+            except OSError:
+                continue
+        return notes
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        try:
+            buffer = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                # Events were lost; treat every note as changed
+                changed |= {path for path, _ in iter_markdown_files(self.vault_path)}
+                continue
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+            if mask & _IN_IGNORED:
+                del self.folders[wd]
+                continue
+            path = os.path.join(folder, name) if name else folder
+            if mask & _IN_ISDIR:
+                if name == TRASH_FOLDER:
+                    continue
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # Notes inside a folder moved in produce no events
+                    changed |= self._watch_tree(path)
+                elif mask & _IN_MOVED_FROM:
+                    changed.add(path + os.sep)
+            elif name.endswith(".md"):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class ChangeWatcher:
+    """
+    Report the notes below vault_path that changed since the last call.
+
+    Uses inotify when available (Linux) unless use_inotify is False, and
+    otherwise walks the vault every poll_interval seconds. A path in the
+    result may also name a note that was deleted or moved away, or end in
+    os.sep for a whole folder that was moved away.
+    """
+    def __init__(self, vault_path, poll_interval=DEFAULT_POLL_INTERVAL,
+                 use_inotify=True):
+        self.backend = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self.backend = _InotifyBackend(vault_path)
+            except (OSError, AttributeError) as e:
+                logger.info("inotify unavailable, polling instead: %s", e)
+        if self.backend is None:
+            self.backend = _PollingBackend(vault_path, poll_interval)
+        self.pending = set()
+        self.last_event = None
+
+    @property
+    def mode(self):
+        return 'inotify' if isinstance(self.backend, _InotifyBackend) else 'polling'
+
+    def wait(self, timeout=0.5):
+        """
+        Return the changed paths once DEBOUNCE_SECONDS have passed without
+        new events, or an empty set after timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if self.pending and now - self.last_event >= DEBOUNCE_SECONDS:
+                changed, self.pending = self.pending, set()
+                return changed
+            remaining = deadline - now
+            if remaining <= 0:
+                return set()
+            if self.pending:
+                remaining = min(remaining, DEBOUNCE_SECONDS)
+            changed = self.backend.read(remaining)
+            if changed:
+                self.pending |= changed
+                self.last_event = time.monotonic()
+
+    def close(self):
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+def diff_groups(old_groups, new_groups):
+    """
+    Return (changed, removed): the groups in new_groups that are new or
+    whose statistics changed, and the groups in old_groups whose set of
+    files no longer exists.
+    """
+    old = {frozenset(group['files']): group for group in old_groups}
+    new_keys = set()
+    changed = []
+    for group in new_groups:
+        key = frozenset(group['files'])
+        new_keys.add(key)
+        if old.get(key) != group:
+            changed.append(group)
+    removed = [group for key, group in old.items() if key not in new_keys]
+    return changed, removed
+
+
+class LiveIndex:
+    """
+    A vault's notes, vectors and similarity edges that stay current as
+    notes change. Built from a completed VaultScanner, it offers the same
+    paths, file_contents and groups(threshold); update() may run on
+    another thread than groups().
+
+    The TF-IDF vocabulary and IDF are fixed when the index is built, so
+    words that first appear later are ignored until the next full scan.
+    """
+    def __init__(self, scanner, threshold=MIN_THRESHOLD):
+        self.vault_path = scanner.vault_path
+        self.threshold = threshold
+        self.strip_obsidian = getattr(scanner, 'strip_obsidian', False)
+        self.lock = threading.Lock()
+        self.paths = list(scanner.paths)
+        file_contents, self.vectorizer, self.base = scanner.tfidf()
+        self.file_contents = dict(file_contents)
+        self.row_of = {path: row for row, path in enumerate(self.paths)}
+        self.alive = np.ones(len(self.paths), dtype=bool)
+        # Rows whose base vector is out of date, and their current vectors
+        self.stale = np.zeros(len(self.paths), dtype=bool)
+        self.overrides = {}
+
+        # Notes sharing one of these keys are exact copies of each other
+        self.exact_keys = {}
+        for path in self.paths:
+            self._add_exact_key(path)
+
+        rows, cols, weights = scanner.edges
+        keep = weights >= threshold - SIMILARITY_EPSILON
+        self.edges = (rows[keep], cols[keep], weights[keep])
+
+    def groups(self, threshold):
+        """Return the groups at threshold with 'files' instead of 'indices'."""
+        with self.lock:
+            rows, cols, weights = self.edges
+            paths = list(self.paths)
+            copy_of = np.arange(len(paths), dtype=np.int64)
+            for peers in self.exact_keys.values():
+                if len(peers) > 1:
+                    peer_rows = [self.row_of[path] for path in peers]
+                    copy_of[peer_rows] = min(peer_rows)
+        groups = []
+        for group in group_edges(rows, cols, weights, threshold, copy_of):
+            group = dict(group)
+            group['files'] = [paths[row] for row in group.pop('indices')]
+            groups.append(group)
+        return groups
+
+    def update(self, changed_paths):
+        """
+        Fold in the notes at changed_paths (created, edited or deleted; a
+        path ending in os.sep stands for every note below it) and return
+        the paths whose edges were recomputed or dropped.
+        """
+        changed = set()
+        for path in changed_paths:
+            if path.endswith(os.sep):
+                changed |= {
+                    known for known, row in self.row_of.items()
+                    if known.startswith(path) and self.alive[row]
+                }
+            else:
+                changed.add(path)
+
+        entries = {}
+        removed = set()
+        for path in changed:
+            try:
+                stats = os.stat(path)
+                known = self.file_contents.get(path)
+                if (
+                    known is not None and self.alive[self.row_of[path]] and
+                    (known['mtime_ns'], known['size']) ==
+                    (stats.st_mtime_ns, stats.st_size)
+                ):
+                    continue  # Touched but not changed
+                text, size, digest = read_text_hashed(path)
+            except FileNotFoundError:
+                # A note removed by an earlier update is already gone
+                if path in self.row_of and self.alive[self.row_of[path]]:
+                    removed.add(path)
+                continue
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning("Error reading %s: %s", path, e)
+                continue
+            processed = preprocess_text(text, self.strip_obsidian)
+            entries[path] = {
+                'mtime_ns': stats.st_mtime_ns,
+                'size': size,
+                'digest': digest,
+                'normalized_digest': text_digest(processed) if processed else None,
+                'processed': processed
+            }
+        if not entries and not removed:
+            return set()
+
+        with self.lock:
+            # Exact copies of a changed note lost their link through it,
+            # so their edges are recomputed as well
+            affected = set(entries) | removed
+            for path in set(affected):
+                if path in self.row_of and self.alive[self.row_of[path]]:
+                    affected |= self._exact_peers(path)
+                    self._remove_exact_key(path)
+
+            for path in removed:
+                row = self.row_of[path]
+                self.alive[row] = False
+                self.overrides.pop(row, None)
+                self.file_contents.pop(path, None)
+            new_paths = [path for path in entries if path not in self.row_of]
+            for path in new_paths:
+                self.row_of[path] = len(self.paths)
+                self.paths.append(path)
+            if new_paths:
+                grow = len(new_paths)
+                self.alive = np.concatenate([self.alive, np.ones(grow, dtype=bool)])
+                self.stale = np.concatenate([self.stale, np.ones(grow, dtype=bool)])
+                self.base = sp.vstack([
+                    self.base, sp.csr_matrix((grow, self.base.shape[1]))
+                ]).tocsr()
+            for path, entry in entries.items():
+                row = self.row_of[path]
+                self.alive[row] = True
+                self.file_contents[path] = entry
+                self._add_exact_key(path)
+                self.stale[row] = True
+                self.overrides[row] = self._vectorize(entry['processed'])
+
+            recomputed = [
+                self.row_of[path] for path in affected - removed
+                if path in self.row_of and self.alive[self.row_of[path]]
+            ]
+            self._replace_edges(
+                [self.row_of[path] for path in affected], recomputed
+            )
+            if len(self.overrides) > REBUILD_OVERRIDES:
+                self._rebuild_base()
+        return affected
+
+    def tfidf(self):
+        """
+        Return (file_contents, vectorizer, matrix) as VaultScanner.tfidf
+        does, from a consistent snapshot of the current notes.
+        """
+        with self.lock:
+            file_contents = dict(self.file_contents)
+            rows = np.array([self.row_of[path] for path in file_contents], dtype=np.int64)
+            matrix = self.base
+            if self.overrides:
+                # Changed notes' rows follow the base rows
+                override_rows = sorted(self.overrides)
+                matrix = sp.vstack(
+                    [self.base] + [self.overrides[row] for row in override_rows]
+                ).tocsr()
+                position = {
+                    row: self.base.shape[0] + k for k, row in enumerate(override_rows)
+                }
+                rows = np.array([position.get(row, row) for row in rows], dtype=np.int64)
+            return file_contents, self.vectorizer, matrix[rows]
+
+    def _vectorize(self, processed):
+        if self.vectorizer is None:
+            return sp.csr_matrix((1, 0))
+        return self.vectorizer.transform([processed]).tocsr()
+
+    def _vector(self, row):
+        if row in self.overrides:
+            return self.overrides[row]
+        return self.base[row]
+
+    def _exact_key(self, path):
+        entry = self.file_contents[path]
+        if entry['normalized_digest']:
+            return ('normalized', entry['normalized_digest'])
+        return ('raw', entry['size'], entry['digest'])
+
+    def _add_exact_key(self, path):
+        self.exact_keys.setdefault(self._exact_key(path), set()).add(path)
+
+    def _remove_exact_key(self, path):
+        peers = self.exact_keys.get(self._exact_key(path))
+        if peers is not None:
+            peers.discard(path)
+
+    def _exact_peers(self, path):
+        return self.exact_keys.get(self._exact_key(path), set()) - {path}
+
+    def _replace_edges(self, dropped, recomputed):
+        """Drop every edge of dropped rows, then add recomputed rows' edges."""
+        rows, cols, weights = self.edges
+        dropped = np.asarray(dropped, dtype=np.int32)
+        keep = ~(np.isin(rows, dropped) | np.isin(cols, dropped))
+        parts = [(rows[keep], cols[keep], weights[keep])]
+
+        cutoff = self.threshold - SIMILARITY_EPSILON
+        current = self.alive & ~self.stale
+        override_rows = np.array(sorted(self.overrides), dtype=np.int32)
+        override_matrix = (
+            sp.vstack([self.overrides[row] for row in override_rows]).tocsr()
+            if len(override_rows) else None
+        )
+        done = set()
+        for row in recomputed:
+            vector = self._vector(row)
+            similarities = np.asarray((self.base @ vector.T).todense()).ravel()
+            similarities[~current] = 0
+            if override_matrix is not None:
+                similarities[override_rows] = np.asarray(
+                    (override_matrix @ vector.T).todense()
+                ).ravel()
+            for peer in self._exact_peers(self.paths[row]):
+                similarities[self.row_of[peer]] = 1.0
+            similarities[row] = 0
+            similarities[~self.alive] = 0
+            others = np.flatnonzero(similarities >= cutoff).astype(np.int32)
+            # A pair of two recomputed rows is only added once
+            others = np.array(
+                [other for other in others if (other, row) not in done],
+                dtype=np.int32
+            )
+            done.update((row, other) for other in others)
+            parts.append((
+                np.minimum(others, row).astype(np.int32),
+                np.maximum(others, row).astype(np.int32),
+                np.minimum(similarities[others], 1.0).astype(np.float32)
+            ))
+        self.edges = sort_edges(*(np.concatenate(part) for part in zip(*parts)))
+
+    def _rebuild_base(self):
+        rows = sp.vstack([
+            self._vector(row) for row in range(len(self.paths))
+        ]).tocsr()
+        self.base = rows
+        self.stale[:] = False
+        self.overrides = {}
@@ -1,19 +1,40 @@
+import logging
 import os
+import queue
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
 import threading
-import string
-import nltk
-from nltk.corpus import stopwords
 from datetime import datetime
 from tkinter import font
-
-# Ensure NLTK stopwords are downloaded
-nltk.download('stopwords', quiet=True)
-STOP_WORDS = set(stopwords.words('english'))
+from dedupe_engine import (
+    DEFAULT_BANDS, DEFAULT_BLOCK_SIZE, DEFAULT_HAMMING_DISTANCE, DEFAULT_NUM_PERM,
+    DEFAULT_SHINGLE_SIZE, MIN_THRESHOLD, ScanCancelled, ScanControl, VaultScanner,
+    default_log_path, warm_up
+)
+from dedupe_index import ScanIndex, index_path
+from dedupe_preview import PreviewCache
+from dedupe_query import DEFAULT_TOP_K, QueryIndex, query_index_path
+from dedupe_resolve import (
+    list_cleanups, move_to_trash, plan_cleanup, read_journal, undo_cleanup
+)
+from dedupe_simhash import MAX_HAMMING_DISTANCE
+from dedupe_spill import MIN_MEMORY_BUDGET
+from dedupe_watch import ChangeWatcher, LiveIndex
+
+logger = logging.getLogger(__name__)
+
+# Group rows inserted into the tree per idle callback, so large results
+# render without freezing the window
+TREE_CHUNK_SIZE = 500
+
+# How often the main loop drains scan events, and the shortest interval
+# between two progress updates sent by a scan (seconds)
+EVENT_POLL_MS = 50
+PROGRESS_INTERVAL = 0.1
+
+# Largest shared blocks listed in the Shared Blocks window
+SHARED_BLOCKS_SHOWN = 1000
 
 class DuplicateFinderApp:
     def __init__(self, root):
@@ -28,7 +49,48 @@ class DuplicateFinderApp:
         self.vault_path = ""
         self.duplicate_groups = []
         self.file_contents = {}
+        self.block_size = DEFAULT_BLOCK_SIZE
+        self.lsh_num_perm = DEFAULT_NUM_PERM
+        self.lsh_bands = DEFAULT_BANDS
+        self.shingle_size = DEFAULT_SHINGLE_SIZE
+        self.hamming_distance = DEFAULT_HAMMING_DISTANCE
+        self.workers = os.cpu_count() or 1
+        # MB; 0 keeps the whole scan in memory
+        self.memory_budget = 0
+        self.cache_dir = None  # None uses the per-user cache directory
+        self.log_path = default_log_path()
+        self.preview_cache = PreviewCache()
+        # Last completed scan, kept so the threshold can change afterwards
+        self.scanner = None
+        # Blocks several notes share, and (first, last, notes) line ranges
+        # of shared blocks per path for highlighting in the preview
+        self.shared_blocks = []
+        self.block_lines = {}
+        # Similarity index for "find similar notes", built on the first
+        # query after a scan, and the scanner it was built from
+        self.query_index = None
+        self.query_scanner = None
+        # Group indices in display order, how many are in the tree so far,
+        # and the pending after() job inserting the rest
+        self.group_order = []
+        self.rendered_groups = 0
+        self.render_job = None
+        self.sort_column = None
+        self.sort_reverse = False
+        # The scan worker never touches Tk; it posts (generation, callable,
+        # args) here and the main loop runs them. Events from a scan that
+        # has since been cancelled or replaced are dropped.
+        self.events = queue.Queue()
+        self.scan_generation = 0
+        self.scan_control = None
+        # Set to stop the thread keeping results live in watch mode
+        self.watch_stop = None
         self.setup_gui()
+        self.root.after(EVENT_POLL_MS, self.process_events)
+        # Load scikit-learn once the window is up rather than on the first scan
+        self.root.after_idle(
+            lambda: threading.Thread(target=warm_up, daemon=True).start()
+        )
 
     def setup_gui(self):
         self.create_menu()
@@ -65,8 +127,9 @@ class DuplicateFinderApp:
         threshold_label.grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
 
         self.threshold_var = tk.IntVar(value=80)
+        self.threshold_var.trace_add('write', self.on_threshold_change)
         threshold_spin = ttk.Spinbox(
-            control_frame, from_=50, to=100, increment=5,
+            control_frame, from_=int(MIN_THRESHOLD * 100), to=100, increment=5,
             textvariable=self.threshold_var, width=5
         )
         threshold_spin.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
@@ -74,6 +137,39 @@ class DuplicateFinderApp:
             threshold_spin, "Set the similarity threshold for detecting duplicates"
         )
 
+        # LSH candidate search
+        self.use_lsh_var = tk.BooleanVar(value=False)
+        lsh_check = ttk.Checkbutton(
+            control_frame, text="Fast candidate search (LSH)",
+            variable=self.use_lsh_var
+        )
+        lsh_check.grid(row=1, column=2, padx=5, pady=5, sticky=tk.W)
+        self.create_tooltip(
+            lsh_check,
+            "Only compare notes that share MinHash buckets (faster, may miss some matches)"
+        )
+
+        # Persistent scan index
+        self.use_cache_var = tk.BooleanVar(value=True)
+        cache_check = ttk.Checkbutton(
+            control_frame, text="Reuse scan cache", variable=self.use_cache_var
+        )
+        cache_check.grid(row=2, column=2, padx=5, pady=10, sticky=tk.W)
+        self.create_tooltip(
+            cache_check, "Only re-read and re-compare notes changed since the last scan"
+        )
+
+        # Watch mode
+        self.use_watch_var = tk.BooleanVar(value=False)
+        self.use_watch_var.trace_add('write', self.on_watch_toggle)
+        watch_check = ttk.Checkbutton(
+            control_frame, text="Watch for changes", variable=self.use_watch_var
+        )
+        watch_check.grid(row=1, column=3, columnspan=2, padx=5, pady=5, sticky=tk.W)
+        self.create_tooltip(
+            watch_check, "Keep the results up to date as notes are created or edited"
+        )
+
         # Find duplicates button
         find_button = ttk.Button(
             control_frame, text="Find Duplicates", command=self.find_duplicates_thread
@@ -89,6 +185,16 @@ class DuplicateFinderApp:
         )
         self.progress.grid(row=2, column=1, padx=5, pady=10, sticky=tk.W)
 
+        # Pause/resume and cancel a running scan
+        self.pause_button = ttk.Button(
+            control_frame, text="Pause", command=self.toggle_pause, state='disabled'
+        )
+        self.pause_button.grid(row=2, column=3, padx=5, pady=10, sticky=tk.W)
+        self.cancel_button = ttk.Button(
+            control_frame, text="Cancel", command=self.cancel_scan, state='disabled'
+        )
+        self.cancel_button.grid(row=2, column=4, padx=5, pady=10, sticky=tk.W)
+
         # Paned window for the treeview and preview panes
         paned_window = ttk.PanedWindow(main_frame, orient=tk.HORIZONTAL)
         paned_window.grid(row=1, column=0, sticky="nsew")
@@ -102,13 +208,18 @@ class DuplicateFinderApp:
         self.tree = ttk.Treeview(
             tree_frame, columns=columns, show='tree headings', selectmode='extended'
         )
-        self.tree.heading("#0", text="Group")
+        self.tree.heading(
+            "#0", text="Group", command=lambda: self.sort_groups("#0")
+        )
         for col in columns:
             self.tree.heading(col, text=col)
             if col == "Similarity %":
-                self.tree.column(col, anchor='center', width=100)
+                self.tree.column(col, anchor='center', width=150)
             else:
                 self.tree.column(col, anchor='w', width=150)
+        self.tree.heading(
+            "Similarity %", command=lambda: self.sort_groups("Similarity %")
+        )
         self.tree.grid(row=0, column=0, sticky="nsew")
 
         # Scrollbars for the treeview
@@ -126,6 +237,17 @@ class DuplicateFinderApp:
 
         # Bind selection event to update preview
         self.tree.bind('<<TreeviewSelect>>', self.update_preview)
+        # File rows are only created when a group is expanded
+        self.tree.bind('<<TreeviewOpen>>', self.on_group_open)
+        # Right-click menu for file rows
+        self.tree_menu = tk.Menu(self.root, tearoff=False)
+        self.tree_menu.add_command(
+            label='Find Similar Notes', command=self.find_similar_to_selected
+        )
+        aqua = self.root.tk.call('tk', 'windowingsystem') == 'aqua'
+        self.tree.bind('<Button-2>' if aqua else '<Button-3>', self.show_tree_menu)
+        # Groups that appeared while watching the vault
+        self.tree.tag_configure('changed', background='#fff4c2')
 
         # Configure tree_frame
         tree_frame.columnconfigure(0, weight=1)
@@ -150,6 +272,8 @@ class DuplicateFinderApp:
         )
         self.file_preview.configure(yscroll=file_scrollbar.set)
         file_scrollbar.grid(row=1, column=1, sticky="ns")
+        # Paragraphs and sections that also appear in other notes
+        self.file_preview.tag_configure('shared', background='#e3f0ff')
 
         # Configure preview frame
         preview_frame.columnconfigure(0, weight=1)
@@ -183,6 +307,7 @@ class DuplicateFinderApp:
         file_menu = tk.Menu(menubar, tearoff=False)
         menubar.add_cascade(label='File', menu=file_menu)
         file_menu.add_command(label='Open Vault', command=self.select_folder)
+        file_menu.add_command(label='Clear Scan Cache', command=self.clear_cache)
         file_menu.add_separator()
         file_menu.add_command(label='Exit', command=self.root.quit)
 
@@ -192,6 +317,43 @@ class DuplicateFinderApp:
         edit_menu.add_command(
             label='Delete Selected Files', command=self.delete_duplicates
         )
+        edit_menu.add_command(
+            label='Resolve All Groups...', command=self.show_resolve_dialog
+        )
+        edit_menu.add_command(
+            label='Undo Last Cleanup', command=self.undo_last_cleanup
+        )
+        edit_menu.add_separator()
+        edit_menu.add_command(
+            label='Scan Settings...', command=self.show_scan_settings
+        )
+        self.strip_obsidian_var = tk.BooleanVar(value=False)
+        edit_menu.add_checkbutton(
+            label='Ignore Obsidian Syntax', variable=self.strip_obsidian_var
+        )
+        self.use_simhash_var = tk.BooleanVar(value=False)
+        edit_menu.add_checkbutton(
+            label='Near-Copy Search (SimHash)', variable=self.use_simhash_var
+        )
+        self.find_blocks_var = tk.BooleanVar(value=False)
+        edit_menu.add_checkbutton(
+            label='Find Shared Blocks', variable=self.find_blocks_var
+        )
+        edit_menu.add_command(
+            label='Shared Blocks...', command=self.show_shared_blocks
+        )
+        edit_menu.add_command(
+            label='Find Notes Similar to Text...', command=self.ask_query_text
+        )
+        profiling_menu = tk.Menu(edit_menu, tearoff=False)
+        edit_menu.add_cascade(label='Profiling', menu=profiling_menu)
+        self.profile_capture_var = tk.StringVar(value='')
+        for label, value in (
+            ('Off', ''), ('cProfile', 'cprofile'), ('tracemalloc', 'tracemalloc')
+        ):
+            profiling_menu.add_radiobutton(
+                label=label, value=value, variable=self.profile_capture_var
+            )
 
         # Help menu
         help_menu = tk.Menu(menubar, tearoff=False)
@@ -203,6 +365,77 @@ class DuplicateFinderApp:
             "About", "Obsidian Duplicate Finder\nVersion 1.1\nEnhanced GUI"
         )
 
+    def show_scan_settings(self):
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Scan Settings")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        dialog.resizable(False, False)
+
+        settings = [
+            ("Worker threads/processes:", 'workers', 1, 256, 1),
+            ("Similarity block size (rows):", 'block_size', 64, 65536, 64),
+            ("LSH permutations:", 'lsh_num_perm', 16, 512, 16),
+            ("LSH bands:", 'lsh_bands', 1, 512, 1),
+            ("Shingle size (words):", 'shingle_size', 1, 10, 1),
+            ("SimHash distance (bits):", 'hamming_distance', 0, MAX_HAMMING_DISTANCE, 1),
+            ("Memory budget (MB, 0 = no limit):", 'memory_budget', 0, 1 << 20, 256),
+        ]
+        settings_vars = {}
+        for row, (text, attribute, low, high, step) in enumerate(settings):
+            ttk.Label(dialog, text=text).grid(
+                row=row, column=0, padx=10, pady=5, sticky=tk.W
+            )
+            var = tk.IntVar(value=getattr(self, attribute))
+            ttk.Spinbox(
+                dialog, from_=low, to=high, increment=step,
+                textvariable=var, width=6
+            ).grid(row=row, column=1, padx=10, pady=5, sticky=tk.W)
+            settings_vars[attribute] = var
+
+        def on_confirm():
+            try:
+                values = {
+                    attribute: var.get() for attribute, var in settings_vars.items()
+                }
+            except tk.TclError:
+                messagebox.showwarning(
+                    "Invalid Value", "All settings must be whole numbers.", parent=dialog
+                )
+                return
+            if (
+                any(values[attribute] < low for _, attribute, low, _, _ in settings) or
+                values['lsh_num_perm'] % values['lsh_bands']
+            ):
+                messagebox.showwarning(
+                    "Invalid Value",
+                    "Settings must be positive and LSH permutations must be "
+                    "a multiple of the number of bands.",
+                    parent=dialog
+                )
+                return
+            if values['hamming_distance'] > MAX_HAMMING_DISTANCE:
+                messagebox.showwarning(
+                    "Invalid Value",
+                    f"The SimHash distance must be at most {MAX_HAMMING_DISTANCE} bits.",
+                    parent=dialog
+                )
+                return
+            if 0 < values['memory_budget'] < MIN_MEMORY_BUDGET:
+                messagebox.showwarning(
+                    "Invalid Value",
+                    f"The memory budget must be 0 or at least {MIN_MEMORY_BUDGET} MB.",
+                    parent=dialog
+                )
+                return
+            for attribute, value in values.items():
+                setattr(self, attribute, value)
+            dialog.destroy()
+
+        ttk.Button(dialog, text="OK", command=on_confirm).grid(
+            row=len(settings), column=0, columnspan=2, pady=10
+        )
+
     def create_tooltip(self, widget, text):
         tooltip = ToolTip(widget)
         def enter(event):
@@ -215,159 +448,435 @@ class DuplicateFinderApp:
     def select_folder(self):
         folder_selected = filedialog.askdirectory()
         if folder_selected:
+            self.cancel_scan()
+            self.stop_watch()
             self.vault_path = folder_selected
             self.folder_label.config(text=self.vault_path)
             self.duplicate_groups = []
+            self.scanner = None
+            self.set_shared_blocks([])
+            self.preview_cache.clear()
             self.clear_treeview()
             self.clear_preview()
             self.update_status("Vault folder selected.")
         else:
             self.update_status("Vault folder selection canceled.")
 
+    def clear_cache(self):
+        if not self.vault_path:
+            messagebox.showwarning(
+                "No Folder Selected", "Please select an Obsidian vault folder first."
+            )
+            return
+        with ScanIndex(self.vault_path, self.cache_dir) as index:
+            index.clear()
+        self.update_status("Scan cache cleared.")
+
     def clear_treeview(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        if self.render_job is not None:
+            self.root.after_cancel(self.render_job)
+            self.render_job = None
+        self.group_order = []
+        self.rendered_groups = 0
+        self.tree.delete(*self.tree.get_children())
 
     def clear_preview(self):
         self.file_preview.delete('1.0', tk.END)
 
-    def read_markdown_files(self):
-        self.file_contents = {}
-        total_files = sum(len(files) for _, _, files in os.walk(self.vault_path))
-        file_counter = 0
-        for root_dir, dirs, files in os.walk(self.vault_path):
-            for file in files:
-                if file.endswith(".md"):
-                    file_path = os.path.join(root_dir, file)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            content_processed = self.preprocess_text(content)
-                            self.file_contents[file_path] = {
-                                'original': content,
-                                'processed': content_processed
-                            }
-                    except Exception as e:
-                        print(f"Error reading {file_path}: {e}")
-                file_counter += 1
-                self.update_progress(file_counter, total_files)
-        self.update_status("File reading complete.")
-
-    def preprocess_text(self, text):
-        text = text.lower()
-        text = text.translate(str.maketrans('', '', string.punctuation))
-        tokens = text.split()
-        tokens = [word for word in tokens if word not in STOP_WORDS]
-        return ' '.join(tokens)
-
     def update_progress(self, current, total):
-        progress = int((current / total) * 100)
+        progress = int((current / total) * 100) if total else 0
         self.progress['value'] = progress
-        self.root.update_idletasks()
 
     def update_status(self, message):
         self.status_var.set(message)
 
-    def find_duplicates_thread(self):
-        threading.Thread(target=self.find_duplicates).start()
+    def post(self, generation, callback, *args):
+        """Queue callback(*args) for the main loop; safe from any thread."""
+        self.events.put((generation, callback, args))
+
+    def process_events(self):
+        try:
+            while True:
+                try:
+                    generation, callback, args = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                if generation != self.scan_generation:
+                    continue
+                try:
+                    callback(*args)
+                except Exception:
+                    # One failing event must not stop the ones after it
+                    logger.exception("Handling %r failed", callback)
+        finally:
+            self.root.after(EVENT_POLL_MS, self.process_events)
+
+    def set_scan_buttons(self, running):
+        state = 'normal' if running else 'disabled'
+        self.pause_button.config(state=state, text="Pause")
+        self.cancel_button.config(state=state)
+
+    def toggle_pause(self):
+        control = self.scan_control
+        if control is None:
+            return
+        if control.paused:
+            control.resume()
+            self.pause_button.config(text="Pause")
+            self.update_status("Scan resumed.")
+        else:
+            control.pause()
+            self.pause_button.config(text="Resume")
+            self.update_status("Scan paused.")
+
+    def cancel_scan(self):
+        if self.scan_control is None:
+            return
+        self.scan_control.cancel()
+        self.scan_control = None
+        self.stop_watch()
+        # Anything the cancelled scan still posts is ignored
+        self.scan_generation += 1
+        self.set_scan_buttons(False)
+        self.progress['value'] = 0
+        self.update_status("Scan cancelled.")
 
-    def find_duplicates(self):
+    def find_duplicates_thread(self):
         if not self.vault_path:
             messagebox.showwarning(
                 "No Folder Selected", "Please select an Obsidian vault folder first."
             )
             return
+        if self.memory_budget and (self.use_lsh_var.get() or self.use_simhash_var.get()):
+            messagebox.showwarning(
+                "Incompatible Settings",
+                "Scans with a memory budget compare every pair of notes. Untick "
+                "fast candidate search and near-copy search or set the memory "
+                "budget to 0."
+            )
+            return
+        if self.use_lsh_var.get() and self.use_simhash_var.get():
+            messagebox.showwarning(
+                "Incompatible Settings",
+                "Fast candidate search (LSH) and near-copy search (SimHash) "
+                "cannot be used together. Untick one of them."
+            )
+            return
 
+        # Starting a new scan stops the one still running
+        if self.scan_control is not None:
+            self.scan_control.cancel()
+        self.stop_watch()
+        self.scan_generation += 1
+        self.scan_control = ScanControl()
+        self.scanner = None
+        self.set_shared_blocks([])
         self.progress['value'] = 0
         self.clear_treeview()
         self.clear_preview()
-        self.update_status("Reading markdown files...")
-        self.read_markdown_files()
-        file_paths = list(self.file_contents.keys())
-        contents = [
-            self.file_contents[path]['processed'] for path in file_paths
-        ]
-
-        if len(contents) < 2:
+        self.set_scan_buttons(True)
+        scanner = VaultScanner(
+            self.vault_path, workers=self.workers, block_size=self.block_size,
+            use_lsh=self.use_lsh_var.get(), num_perm=self.lsh_num_perm,
+            bands=self.lsh_bands, shingle_size=self.shingle_size,
+            use_cache=self.use_cache_var.get(), cache_dir=self.cache_dir,
+            profile_capture=self.profile_capture_var.get() or None,
+            strip_obsidian=self.strip_obsidian_var.get(),
+            find_blocks=self.find_blocks_var.get(),
+            memory_budget=self.memory_budget or None,
+            use_simhash=self.use_simhash_var.get(),
+            hamming_distance=self.hamming_distance
+        )
+        if self.use_watch_var.get() and not self.memory_budget:
+            # The watcher starts with the scan so edits made meanwhile are
+            # not missed
+            self.watch_stop = threading.Event()
+        threading.Thread(
+            target=self.find_duplicates,
+            args=(scanner, self.scan_control, self.scan_generation, self.watch_stop),
+            daemon=True
+        ).start()
+
+    def find_duplicates(self, scanner, control, generation, watch_stop=None):
+        """
+        Run scanner on a worker thread, posting every result as an event.
+        With watch_stop, watch the vault from before the scan starts and
+        go on to fold changes into a LiveIndex once it is done.
+        """
+        last_progress = 0.0
+        latest = None
+        watcher = None
+        if watch_stop is not None:
+            try:
+                watcher = ChangeWatcher(scanner.vault_path)
+            except Exception as e:
+                logger.exception("Watching %s failed", scanner.vault_path)
+                self.post(generation, self.update_status, f"Watch mode stopped: {e}")
+
+        def progress(current, total):
+            nonlocal last_progress, latest
+            latest = (current, total)
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                self.post(generation, self.update_progress, current, total)
+
+        try:
+            # Keep every edge down to the spinbox minimum so the threshold
+            # can be changed without rescanning
+            scanner.scan(
+                MIN_THRESHOLD, progress=progress,
+                on_status=lambda message: self.post(
+                    generation, self.update_status, message
+                ),
+                on_exact_groups=lambda groups: self.post(
+                    generation, self.show_exact_groups, groups
+                ),
+                control=control
+            )
+        except ScanCancelled:
+            if watcher is not None:
+                watcher.close()
+            return
+        except Exception as e:
+            logger.exception("Scan of %s failed", scanner.vault_path)
+            if watcher is not None:
+                watcher.close()
+            self.post(generation, self.scan_failed, e)
+            return
+        if latest is not None:
+            # The throttle may have skipped the last update
+            self.post(generation, self.update_progress, *latest)
+        self.post(generation, self.scan_finished, scanner)
+        if watcher is not None and watch_stop.is_set():
+            # Watching was turned off during the scan
+            watcher.close()
+        elif watcher is not None:
+            self.watch_vault(scanner, watch_stop, generation, watcher)
+
+    def scan_failed(self, error):
+        self.scan_control = None
+        self.stop_watch()
+        self.set_scan_buttons(False)
+        self.update_status("Scan failed.")
+        messagebox.showerror("Scan Failed", f"Could not scan the vault: {error}")
+
+    def scan_finished(self, scanner):
+        self.scan_control = None
+        self.set_scan_buttons(False)
+        self.file_contents = scanner.file_contents
+        self.set_shared_blocks(scanner.shared_blocks)
+
+        if len(scanner.paths) < 2:
             messagebox.showinfo(
                 "Not Enough Files",
                 "Need at least two Markdown files to find duplicates."
             )
             self.update_status("Not enough files to find duplicates.")
+            self.stop_watch()
             return
 
-        threshold = self.threshold_var.get() / 100.0
-        self.update_status("Calculating similarities...")
-
-        # Vectorize the contents
-        vectorizer = TfidfVectorizer().fit_transform(contents)
-        vectors = vectorizer.toarray()
+        self.scanner = scanner
+        self.regroup()
 
-        # Compute cosine similarity matrix
-        similarity_matrix = cosine_similarity(vectors)
-        np.fill_diagonal(similarity_matrix, 0)
+        def rendered(seconds):
+            scanner.profile.add(
+                'render', wall_s=round(seconds, 4), groups=len(self.duplicate_groups)
+            )
+            self.log_profile(scanner)
+            self.update_status(
+                f"Duplicate search complete. {scanner.profile.summary()}"
+            )
+        self.populate_treeview(on_complete=rendered)
+        if self.use_watch_var.get() and self.watch_stop is None:
+            # Watching was turned on during the scan
+            self.start_watch()
+        messagebox.showinfo(
+            "Duplicates Found", f"Found {len(self.duplicate_groups)} duplicate groups."
+        )
 
-        # Group similar files and store similarities
-        groups = []
-        visited = set()
+    def on_watch_toggle(self, *args):
+        if not self.use_watch_var.get():
+            self.stop_watch()
+            if self.scanner is not None:
+                self.update_status("Stopped watching for changes.")
+        elif self.scanner is not None and self.scan_control is None:
+            self.start_watch()
+
+    def start_watch(self):
+        self.stop_watch()
+        if getattr(self.scanner, 'memory_budget', None):
+            # Its notes' text was only kept on disk during the scan
+            self.update_status(
+                "Watch mode is not available for scans with a memory budget."
+            )
+            return
+        self.watch_stop = threading.Event()
+        threading.Thread(
+            target=self.watch_vault,
+            args=(self.scanner, self.watch_stop, self.scan_generation),
+            daemon=True
+        ).start()
+
+    def stop_watch(self):
+        if self.watch_stop is not None:
+            self.watch_stop.set()
+            self.watch_stop = None
+
+    def watch_vault(self, scanner, stop, generation, watcher=None):
+        """
+        Fold note changes into a LiveIndex until stop is set (worker
+        thread), using watcher if it is already running.
+        """
+        try:
+            with watcher or ChangeWatcher(scanner.vault_path) as watcher:
+                live = scanner if isinstance(scanner, LiveIndex) else LiveIndex(scanner)
+                self.post(generation, self.watch_started, live, watcher.mode)
+                while not stop.is_set():
+                    changed = watcher.wait(0.5)
+                    if changed and not stop.is_set():
+                        affected = live.update(changed)
+                        if affected:
+                            self.post(generation, self.apply_live_update, affected)
+        except Exception as e:
+            logger.exception("Watching %s failed", scanner.vault_path)
+            self.post(generation, self.update_status, f"Watch mode stopped: {e}")
+
+    def watch_started(self, live, mode):
+        if self.watch_stop is None:
+            return
+        self.scanner = live
+        self.file_contents = live.file_contents
+        self.update_status(f"Watching the vault for changes ({mode}).")
 
-        for i in range(len(file_paths)):
-            if i in visited:
+    def apply_live_update(self, affected):
+        """Update only the tree rows of groups that changed."""
+        if self.watch_stop is None:
+            return
+        self.query_index = None
+        threshold = self.threshold_var.get() / 100.0
+        old = {
+            frozenset(group['files']): idx
+            for idx, group in enumerate(self.duplicate_groups) if group is not None
+        }
+        new_groups = [self.display_group(group) for group in self.scanner.groups(threshold)]
+        new_keys = {frozenset(group['files']) for group in new_groups}
+        removed = [idx for key, idx in old.items() if key not in new_keys]
+        old_row_of = {
+            file_path: idx for idx in removed
+            for file_path in self.duplicate_groups[idx]['files']
+        }
+
+        alerts = []
+        for group in new_groups:
+            idx = old.get(frozenset(group['files']))
+            if idx is not None:
+                if self.duplicate_groups[idx] != group:
+                    self.duplicate_groups[idx] = group
+                    if self.tree.exists(f"group_{idx}"):
+                        text, values = self.group_row(idx)
+                        self.tree.item(f"group_{idx}", text=text, values=values)
                 continue
-            group_indices = {i}
-            similarities = []
-            stack = [i]
-            while stack:
-                current = stack.pop()
-                for j in range(len(file_paths)):
-                    if (
-                        j != current and
-                        j not in group_indices and
-                        similarity_matrix[current][j] >= threshold
-                    ):
-                        group_indices.add(j)
-                        stack.append(j)
-                        similarities.append(similarity_matrix[current][j])
-            if len(group_indices) > 1:
-                group_similarities = {
-                    'indices': group_indices,
-                    'similarities': similarities
-                }
-                groups.append(group_similarities)
-                visited.update(group_indices)
+            # A new or reshaped group takes the place of the group it grew
+            # from, if any
+            idx = len(self.duplicate_groups)
+            self.duplicate_groups.append(group)
+            self.group_order.append(idx)
+            if self.render_job is None:
+                position = 0
+                for file_path in group['files']:
+                    old_id = f"group_{old_row_of.get(file_path)}"
+                    if file_path in old_row_of and self.tree.exists(old_id):
+                        position = self.tree.index(old_id)
+                        break
+                self.insert_group_row(idx, position)
+                self.tree.item(f"group_{idx}", tags=('changed',))
+                self.rendered_groups += 1
+            alerts.extend(
+                (file_path, group) for file_path in group['files']
+                if file_path in affected
+            )
+        for idx in removed:
+            self.duplicate_groups[idx] = None
+            if self.tree.exists(f"group_{idx}"):
+                self.tree.delete(f"group_{idx}")
+        for file_path in affected:
+            self.preview_cache.discard(file_path)
+
+        if alerts:
+            file_path, group = alerts[0]
+            self.update_status(
+                f"New duplicate: {os.path.relpath(file_path, self.vault_path)} "
+                f"matches {len(group['files']) - 1} other notes "
+                f"({group['max_similarity']}%)."
+            )
+        else:
+            self.update_status(f"Updated {len(affected)} changed notes.")
+
+    def log_profile(self, scanner):
+        summary = scanner.profile.summary()
+        logger.info("Scan of %s: %s", self.vault_path, summary)
+        try:
+            record = scanner.profile.write(self.log_path, vault=self.vault_path)
+        except OSError as e:
+            logger.warning("Could not write scan log %s: %s", self.log_path, e)
+            return
+        if 'cprofile' in record:
+            logger.info("cProfile stats written to %s", record['cprofile'])
+
+    def show_exact_groups(self, exact_groups):
+        self.duplicate_groups = [
+            {
+                'files': list(exact_group), 'similarity': 100.0,
+                'min_similarity': 100.0, 'max_similarity': 100.0
+            }
+            for exact_group in exact_groups
+        ]
+        self.populate_treeview()
 
-        self.duplicate_groups = []
-        total_groups = len(groups)
-        group_counter = 0
-
-        for group in groups:
-            indices = group['indices']
-            similarities = group['similarities']
-            file_group = [file_paths[index] for index in indices]
-            if similarities:
-                avg_similarity = np.mean(similarities) * 100  # Convert to percentage
-            else:
-                avg_similarity = threshold * 100  # If only two files, use threshold
-            self.duplicate_groups.append({
-                'files': file_group,
-                'similarity': round(avg_similarity, 2)
-            })
-            group_counter += 1
-            progress = int((group_counter / total_groups) * 100)
-            self.progress['value'] = progress
-            self.root.update_idletasks()
+    @staticmethod
+    def display_group(group):
+        return {
+            'files': group['files'],
+            'similarity': round(group['similarity'] * 100, 2),
+            'min_similarity': round(group['min_similarity'] * 100, 2),
+            'max_similarity': round(group['max_similarity'] * 100, 2)
+        }
+
+    def regroup(self):
+        threshold = self.threshold_var.get() / 100.0
+        self.duplicate_groups = [
+            self.display_group(group) for group in self.scanner.groups(threshold)
+        ]
 
+    def on_threshold_change(self, *args):
+        if self.scanner is None:
+            return
+        try:
+            threshold = self.threshold_var.get()
+        except tk.TclError:
+            return  # Partially typed value
+        if not int(MIN_THRESHOLD * 100) <= threshold <= 100:
+            return
+        self.regroup()
         self.populate_treeview()
-        self.update_status("Duplicate search complete.")
-        messagebox.showinfo(
-            "Duplicates Found", f"Found {len(self.duplicate_groups)} duplicate groups."
+        self.clear_preview()
+        self.update_status(
+            f"Found {len(self.duplicate_groups)} duplicate groups at {threshold}%."
         )
 
     def get_file_info(self, file_path):
-        stats = os.stat(file_path)
-        size = self.human_readable_size(stats.st_size)
-        mtime = datetime.fromtimestamp(stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-        return {'size': size, 'mtime': mtime}
+        entry = self.file_contents.get(file_path)
+        if entry is not None:
+            # Reuse what the scan already knows instead of stat-ing again
+            size, mtime = entry['size'], entry['mtime_ns'] / 1e9
+        else:
+            stats = os.stat(file_path)
+            size, mtime = stats.st_size, stats.st_mtime
+        return {
+            'size': self.human_readable_size(size),
+            'mtime': datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
+        }
 
     @staticmethod
     def human_readable_size(size, decimal_places=2):
@@ -377,27 +886,106 @@ class DuplicateFinderApp:
             size /= 1024.0
         return f"{size:.{decimal_places}f} TB"
 
-    def populate_treeview(self):
+    def populate_treeview(self, on_complete=None):
+        """
+        Show self.duplicate_groups, inserting TREE_CHUNK_SIZE group rows
+        per idle callback. on_complete, if given, is called with the
+        seconds rendering took once every group row is in the tree.
+        """
         self.clear_treeview()
-        for idx, group in enumerate(self.duplicate_groups):
-            group_id = f"group_{idx}"
-            similarity = group['similarity']
-            self.tree.insert(
-                '', tk.END, iid=group_id,
-                text=f"Group {idx+1} ({len(group['files'])} files)",
-                values=(f"{similarity}%", "", "", "")
+        self.group_order = self.sorted_group_order()
+        started = time.perf_counter()
+
+        def insert_chunk():
+            self.render_job = None
+            stop = min(self.rendered_groups + TREE_CHUNK_SIZE, len(self.group_order))
+            for position in range(self.rendered_groups, stop):
+                idx = self.group_order[position]
+                if not self.tree.exists(f"group_{idx}"):
+                    self.insert_group_row(idx, position)
+            self.rendered_groups = stop
+            if stop < len(self.group_order):
+                self.render_job = self.root.after(1, insert_chunk)
+            elif on_complete is not None:
+                on_complete(time.perf_counter() - started)
+
+        insert_chunk()
+
+    def group_row(self, idx):
+        """Return the (text, values) shown on a group's row."""
+        group = self.duplicate_groups[idx]
+        similarity = f"{group['similarity']}%"
+        if group['min_similarity'] != group['max_similarity']:
+            similarity += (
+                f" ({group['min_similarity']}-{group['max_similarity']})"
             )
-            for file_path in group['files']:
-                file_rel = os.path.relpath(file_path, self.vault_path)
+        return (
+            f"Group {idx+1} ({len(group['files'])} files)",
+            (similarity, "", "", "")
+        )
+
+    def insert_group_row(self, idx, position=tk.END):
+        group_id = f"group_{idx}"
+        text, values = self.group_row(idx)
+        self.tree.insert('', position, iid=group_id, text=text, values=values)
+        # Placeholder so the group can be expanded before its files exist
+        self.tree.insert(group_id, tk.END, iid=f"{group_id}_placeholder")
+
+    def on_group_open(self, event):
+        group_id = self.tree.focus()
+        if self.tree.parent(group_id) or not self.tree.exists(
+            f"{group_id}_placeholder"
+        ):
+            return
+        self.tree.delete(f"{group_id}_placeholder")
+        group = self.duplicate_groups[int(group_id.split('_')[1])]
+        for file_path in group['files']:
+            file_rel = os.path.relpath(file_path, self.vault_path)
+            try:
                 file_info = self.get_file_info(file_path)
-                self.tree.insert(
-                    group_id, tk.END, values=(
-                        "",  # Empty similarity for files
-                        file_rel,
-                        file_info['size'],
-                        file_info['mtime']
-                    )
+            except OSError:
+                file_info = {'size': "", 'mtime': ""}
+            self.tree.insert(
+                group_id, tk.END, values=(
+                    "",  # Empty similarity for files
+                    file_rel,
+                    file_info['size'],
+                    file_info['mtime']
                 )
+            )
+
+    def sorted_group_order(self):
+        # Groups dissolved in watch mode leave None behind
+        order = [
+            idx for idx, group in enumerate(self.duplicate_groups) if group is not None
+        ]
+        if self.sort_column == "Similarity %":
+            order.sort(
+                key=lambda idx: self.duplicate_groups[idx]['similarity'],
+                reverse=self.sort_reverse
+            )
+        elif self.sort_column == "#0":
+            order.sort(
+                key=lambda idx: len(self.duplicate_groups[idx]['files']),
+                reverse=self.sort_reverse
+            )
+        return order
+
+    def sort_groups(self, column):
+        """Reorder group rows by column, toggling the direction on repeat."""
+        if self.sort_column == column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column, self.sort_reverse = column, True
+        self.group_order = self.sorted_group_order()
+        # Move the rows already shown in one call; rows still to come are
+        # inserted at their sorted position
+        self.tree.set_children('', *[
+            f"group_{idx}" for idx in self.group_order
+            if self.tree.exists(f"group_{idx}")
+        ])
+        if self.render_job is not None:
+            self.rendered_groups = 0
 
     def update_preview(self, event):
         selected_items = self.tree.selection()
@@ -410,17 +998,257 @@ class DuplicateFinderApp:
         if parent:
             # It's a file item
             file_rel = self.tree.item(item, 'values')[1]
-            file_path = os.path.join(self.vault_path, file_rel)
-
-            self.file_preview.delete('1.0', tk.END)
-            try:
-                content = self.file_contents[file_path]['original']
-                self.file_preview.insert(tk.END, content)
-            except KeyError:
-                self.file_preview.insert(tk.END, "Unable to load content.")
+            self.show_preview(os.path.join(self.vault_path, file_rel))
         else:
             # It's a group item
-            self.file_preview.delete('1.0', tk.END)
+            self.clear_preview()
+
+    def show_preview(self, file_path, line=None):
+        """Show file_path with its shared blocks highlighted, from line."""
+        self.file_preview.delete('1.0', tk.END)
+        try:
+            content, truncated = self.preview_cache.get(file_path)
+        except (OSError, UnicodeDecodeError):
+            self.file_preview.insert(tk.END, "Unable to load content.")
+            return
+        self.file_preview.insert(tk.END, content)
+        if truncated:
+            self.file_preview.insert(
+                tk.END, "\n\n[Preview truncated; the note is larger.]"
+            )
+        blocks = self.block_lines.get(file_path, [])
+        for first, last, _ in blocks:
+            self.file_preview.tag_add('shared', f"{first}.0", f"{last}.end")
+        if blocks:
+            self.update_status(
+                f"{len(blocks)} highlighted blocks of this note appear in "
+                f"up to {max(notes for _, _, notes in blocks) - 1} other notes."
+            )
+        if line is not None:
+            self.file_preview.see(f"{line}.0")
+
+    def show_tree_menu(self, event):
+        item = self.tree.identify_row(event.y)
+        if not item or not self.tree.parent(item):
+            return  # Only file rows have a menu
+        self.tree.selection_set(item)
+        try:
+            self.tree_menu.tk_popup(event.x_root, event.y_root)
+        finally:
+            self.tree_menu.grab_release()
+
+    def find_similar_to_selected(self):
+        selected_items = self.tree.selection()
+        if not selected_items or not self.tree.parent(selected_items[0]):
+            return
+        file_rel = self.tree.item(selected_items[0], 'values')[1]
+        self.run_query('note', os.path.join(self.vault_path, file_rel), file_rel)
+
+    def ask_query_text(self):
+        if self.scanner is None:
+            messagebox.showwarning(
+                "No Scan Results", "Scan the vault before looking for similar notes."
+            )
+            return
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Find Notes Similar to Text")
+        dialog.transient(self.root)
+        dialog.geometry("500x300")
+
+        ttk.Label(dialog, text="Paste or type the text to look for:").pack(
+            anchor='w', padx=10, pady=5
+        )
+        text_box = tk.Text(dialog, wrap='word', height=10)
+        text_box.pack(fill='both', expand=True, padx=10)
+        text_box.focus_set()
+
+        def on_search():
+            text = text_box.get('1.0', 'end-1c')
+            if not text.strip():
+                messagebox.showwarning(
+                    "No Text", "Enter some text to search for.", parent=dialog
+                )
+                return
+            dialog.destroy()
+            self.run_query('text', text, "Pasted Text")
+
+        ttk.Button(dialog, text="Find Similar Notes", command=on_search).pack(pady=10)
+
+    def run_query(self, kind, value, title):
+        """
+        Show the notes most similar to a note (kind 'note') or to text
+        (kind 'text'), building the query index on a worker thread first
+        if the results changed since the last query.
+        """
+        if self.scanner is None or self.scan_control is not None:
+            messagebox.showwarning(
+                "No Scan Results", "Scan the vault before looking for similar notes."
+            )
+            return
+        if getattr(self.scanner, 'memory_budget', None):
+            messagebox.showwarning(
+                "Not Available",
+                "Finding similar notes needs a scan without a memory budget."
+            )
+            return
+        if self.query_index is not None and self.query_scanner is self.scanner:
+            self.show_query_results(kind, value, title)
+            return
+
+        self.update_status("Building the similarity index...")
+        scanner, generation = self.scanner, self.scan_generation
+        # Copied here, since a watch thread may change it meanwhile
+        file_contents = dict(scanner.file_contents)
+
+        def build():
+            strip_obsidian = getattr(scanner, 'strip_obsidian', False)
+            saved_path = None
+            if getattr(scanner, 'use_cache', False):
+                saved_path = query_index_path(scanner.vault_path, scanner.cache_dir)
+            try:
+                index = None
+                if saved_path is not None:
+                    index = QueryIndex.load(
+                        saved_path, scanner.vault_path, strip_obsidian, file_contents
+                    )
+                if index is None:
+                    index = QueryIndex.from_scanner(scanner)
+                    if saved_path is not None:
+                        try:
+                            index.save(saved_path, scanner.vault_path)
+                        except OSError as e:
+                            logger.warning("Could not save %s: %s", saved_path, e)
+            except Exception as e:
+                logger.exception("Building the query index failed")
+                self.post(generation, self.update_status, f"Query failed: {e}")
+                return
+            self.post(
+                generation, self.query_index_ready, scanner, index, kind, value, title
+            )
+        threading.Thread(target=build, daemon=True).start()
+
+    def query_index_ready(self, scanner, index, kind, value, title):
+        if scanner is not self.scanner:
+            return  # Replaced by a newer scan or by watch mode
+        self.query_index, self.query_scanner = index, scanner
+        self.show_query_results(kind, value, title)
+
+    def show_query_results(self, kind, value, title):
+        started = time.perf_counter()
+        try:
+            if kind == 'note':
+                matches = self.query_index.similar_to_note(value, DEFAULT_TOP_K)
+            else:
+                matches = self.query_index.similar_to_text(value, DEFAULT_TOP_K)
+        except KeyError:
+            messagebox.showwarning(
+                "Note Not Indexed", f"{title} was not part of the last scan."
+            )
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.update_status(
+            f"Found {len(matches)} similar notes in {elapsed_ms:.1f} ms."
+        )
+        if not matches:
+            messagebox.showinfo(
+                "No Similar Notes", f"No note shares any terms with {title}."
+            )
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"Notes Similar to {title}")
+        dialog.transient(self.root)
+        dialog.geometry("600x300")
+        columns = ("Similarity %", "File Path")
+        tree = ttk.Treeview(dialog, columns=columns, show='headings')
+        tree.heading("Similarity %", text="Similarity %")
+        tree.column("Similarity %", anchor='center', width=100, stretch=False)
+        tree.heading("File Path", text="File Path")
+        tree.grid(row=0, column=0, sticky="nsew")
+        scrollbar = ttk.Scrollbar(dialog, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscroll=scrollbar.set)
+        scrollbar.grid(row=0, column=1, sticky="ns")
+        dialog.columnconfigure(0, weight=1)
+        dialog.rowconfigure(0, weight=1)
+
+        paths = {}
+        for file_path, score in matches:
+            item = tree.insert('', tk.END, values=(
+                round(score * 100, 2), os.path.relpath(file_path, self.vault_path)
+            ))
+            paths[item] = file_path
+
+        def on_select(event):
+            selected = tree.selection()
+            if selected:
+                self.show_preview(paths[selected[0]])
+        tree.bind('<<TreeviewSelect>>', on_select)
+
+    def set_shared_blocks(self, blocks):
+        self.shared_blocks = blocks
+        self.block_lines = {}
+        for block in blocks:
+            for file_path, first, last in block['locations']:
+                self.block_lines.setdefault(file_path, []).append(
+                    (first, last, block['notes'])
+                )
+
+    def show_shared_blocks(self):
+        """List the blocks found in several notes; selecting one previews it."""
+        if not self.shared_blocks:
+            messagebox.showinfo(
+                "No Shared Blocks",
+                "No shared blocks were found. Tick Edit > Find Shared Blocks "
+                "before scanning to look for paragraphs that appear in "
+                "several notes."
+            )
+            return
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Shared Blocks")
+        dialog.transient(self.root)
+        dialog.geometry("700x400")
+
+        shown = self.shared_blocks[:SHARED_BLOCKS_SHOWN]
+        text = f"{len(self.shared_blocks)} blocks appear in more than one note"
+        if len(shown) < len(self.shared_blocks):
+            text += f"; the {len(shown)} largest are listed"
+        ttk.Label(dialog, text=text + ".", font=self.bold_font).grid(
+            row=0, column=0, columnspan=2, padx=10, pady=5, sticky=tk.W
+        )
+
+        tree = ttk.Treeview(
+            dialog, columns=("Notes", "Words", "Lines"), show='tree headings'
+        )
+        tree.heading("#0", text="Block / File")
+        for col in ("Notes", "Words", "Lines"):
+            tree.heading(col, text=col)
+            tree.column(col, anchor='center', width=80, stretch=False)
+        tree.grid(row=1, column=0, sticky="nsew")
+        scrollbar = ttk.Scrollbar(dialog, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscroll=scrollbar.set)
+        scrollbar.grid(row=1, column=1, sticky="ns")
+        dialog.columnconfigure(0, weight=1)
+        dialog.rowconfigure(1, weight=1)
+
+        locations = {}
+        for number, block in enumerate(shown, 1):
+            block_id = tree.insert(
+                '', tk.END, text=f"Block {number}",
+                values=(block['notes'], block['words'], "")
+            )
+            for file_path, first, last in block['locations']:
+                item = tree.insert(
+                    block_id, tk.END,
+                    text=os.path.relpath(file_path, self.vault_path),
+                    values=("", "", f"{first}-{last}")
+                )
+                locations[item] = (file_path, first)
+
+        def on_select(event):
+            selected = tree.selection()
+            if selected and selected[0] in locations:
+                self.show_preview(*locations[selected[0]])
+        tree.bind('<<TreeviewSelect>>', on_select)
 
     def delete_duplicates(self):
         selected_items = self.tree.selection()
@@ -433,25 +1261,22 @@ class DuplicateFinderApp:
         deleted_files = []
 
         for item in selected_items:
+            if not self.tree.exists(item):
+                continue  # Its group was already removed
             parent = self.tree.parent(item)
+            group_id = parent or item
+            group = self.duplicate_groups[int(group_id.split('_')[1])]
             if parent:
                 # It's a file item
                 file_rel = self.tree.item(item, 'values')[1]
-                file_path = os.path.join(self.vault_path, file_rel)
-                files_to_delete = [file_path]
-                group_id = parent
+                files_to_delete = [
+                    file_path for file_path in group['files']
+                    if os.path.relpath(file_path, self.vault_path) == file_rel
+                ]
             else:
-                # It's a group item
-                group_id = item
-                # Get all file paths in the group
-                files_in_group = []
-                for child in self.tree.get_children(item):
-                    file_rel = self.tree.item(child, 'values')[1]
-                    file_path = os.path.join(self.vault_path, file_rel)
-                    files_in_group.append(file_path)
-
-                # Use the custom dialog to select files to delete
-                files_to_delete = self.ask_files_to_delete(files_in_group)
+                # It's a group item; its file rows may not exist yet, so
+                # use the group's own file list
+                files_to_delete = self.ask_files_to_delete(list(group['files']))
                 if not files_to_delete:
                     continue  # Skip deletion for this group
 
@@ -460,32 +1285,212 @@ class DuplicateFinderApp:
                     os.remove(file_to_delete)
                     deleted_files.append(file_to_delete)
                     # Remove from Treeview and internal data
-                    items_to_remove = []
+                    group['files'].remove(file_to_delete)
+                    file_rel = os.path.relpath(file_to_delete, self.vault_path)
                     for child in self.tree.get_children(group_id):
-                        file_rel = self.tree.item(child, 'values')[1]
-                        file_path = os.path.join(self.vault_path, file_rel)
-                        if file_path == file_to_delete:
-                            items_to_remove.append(child)
+                        values = self.tree.item(child, 'values')
+                        if values and values[1] == file_rel:
+                            self.tree.delete(child)
                             break  # Each file appears only once
-                    for i in items_to_remove:
-                        self.tree.delete(i)
-                    if file_to_delete in self.file_contents:
-                        del self.file_contents[file_to_delete]
                 except Exception as e:
                     messagebox.showerror(
                         "Error Deleting File", f"Could not delete {file_to_delete}: {e}"
                     )
 
             # If all files in the group are deleted, remove the group
-            if not self.tree.get_children(group_id):
+            if not group['files']:
                 self.tree.delete(group_id)
+            else:
+                text, _ = self.group_row(int(group_id.split('_')[1]))
+                self.tree.item(group_id, text=text)
 
         if deleted_files:
+            self.forget_notes(deleted_files)
             messagebox.showinfo(
                 "Deletion Complete", f"Deleted {len(deleted_files)} files."
             )
             self.update_status(f"Deleted {len(deleted_files)} files.")
 
+    def show_resolve_dialog(self):
+        if self.scan_control is not None:
+            messagebox.showwarning(
+                "Scan Running", "Wait for the scan to finish before resolving groups."
+            )
+            return
+        groups = [group for group in self.duplicate_groups if group is not None]
+        if self.scanner is None or not groups:
+            messagebox.showinfo(
+                "No Duplicates", "Find duplicates before resolving them."
+            )
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Resolve All Groups")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        dialog.resizable(False, False)
+
+        ttk.Label(
+            dialog, text=f"In each of the {len(groups)} groups:", font=self.bold_font
+        ).grid(row=0, column=0, columnspan=3, padx=10, pady=10, sticky=tk.W)
+        policy_var = tk.StringVar(value='newest')
+        for row, (text, policy) in enumerate((
+            ("Keep the newest note", 'newest'),
+            ("Keep the largest note", 'largest'),
+            ("Keep the note with the shortest path", 'shortest-path'),
+            ("Keep the newest note in this folder:", 'folder'),
+        ), start=1):
+            ttk.Radiobutton(
+                dialog, text=text, value=policy, variable=policy_var
+            ).grid(row=row, column=0, columnspan=3, padx=20, pady=2, sticky=tk.W)
+        folder_var = tk.StringVar()
+        ttk.Entry(dialog, textvariable=folder_var, width=40).grid(
+            row=5, column=0, columnspan=2, padx=(40, 5), pady=5, sticky=tk.W
+        )
+
+        def browse():
+            folder = filedialog.askdirectory(initialdir=self.vault_path, parent=dialog)
+            if folder:
+                folder_var.set(folder)
+                policy_var.set('folder')
+
+        ttk.Button(dialog, text="Browse...", command=browse).grid(
+            row=5, column=2, padx=10, pady=5, sticky=tk.W
+        )
+        ttk.Label(
+            dialog,
+            text="The other notes are moved to the vault's .trash folder.\n"
+                 "Edit → Undo Last Cleanup moves them back."
+        ).grid(row=6, column=0, columnspan=3, padx=10, pady=10, sticky=tk.W)
+
+        def on_confirm():
+            policy = policy_var.get()
+            folder = folder_var.get().strip()
+            if policy == 'folder' and not folder:
+                messagebox.showwarning(
+                    "No Folder Selected", "Choose the folder whose notes to keep.",
+                    parent=dialog
+                )
+                return
+            plan = plan_cleanup(
+                [group['files'] for group in groups], self.file_contents, policy,
+                os.path.join(self.vault_path, folder) if folder else None
+            )
+            moving = sum(len(remove) for _, remove in plan)
+            if not moving:
+                messagebox.showinfo(
+                    "Nothing to Resolve", "No group has a note in that folder.",
+                    parent=dialog
+                )
+                return
+            if not messagebox.askyesno(
+                "Confirm Cleanup",
+                f"Move {moving} notes from {len(plan)} groups to the trash?",
+                parent=dialog
+            ):
+                return
+            dialog.destroy()
+            self.resolve_groups(plan)
+
+        ttk.Button(dialog, text="Resolve", command=on_confirm).grid(
+            row=7, column=0, columnspan=3, pady=10
+        )
+
+    def resolve_groups(self, plan):
+        """Move the notes plan removes to the trash and update the results."""
+        try:
+            journal_path, moved, errors = move_to_trash(self.vault_path, plan)
+        except OSError as e:
+            messagebox.showerror(
+                "Error Moving Files", f"Could not create the trash folder: {e}"
+            )
+            return
+        self.remove_from_results(moved)
+        if errors:
+            file_path, message = next(iter(errors.items()))
+            messagebox.showerror(
+                "Error Moving Files",
+                f"Could not move {len(errors)} files, including {file_path}: {message}"
+            )
+        self.update_status(
+            f"Moved {len(moved)} notes from {len(plan)} groups to "
+            f"{os.path.relpath(os.path.dirname(journal_path), self.vault_path)}."
+        )
+
+    def forget_notes(self, file_paths):
+        """
+        Drop notes deleted or moved out of the vault from the scan index,
+        the scan (so regrouping cannot bring them back) and the caches.
+        """
+        if os.path.exists(index_path(self.vault_path, self.cache_dir)):
+            with ScanIndex(self.vault_path, self.cache_dir) as index:
+                index.update_files({}, removed=file_paths)
+        # While watching, the watcher folds the changes in itself
+        if self.watch_stop is None:
+            if isinstance(self.scanner, LiveIndex):
+                self.scanner.update(set(file_paths))
+            elif self.scanner is not None:
+                self.scanner.forget(file_paths)
+        for file_path in file_paths:
+            self.preview_cache.discard(file_path)
+        self.query_index = None
+
+    def remove_from_results(self, file_paths):
+        """
+        Drop notes moved out of the vault from the scan index, the scan and
+        the groups, then redraw the tree once.
+        """
+        gone = set(file_paths)
+        if not gone:
+            return
+        self.forget_notes(gone)
+        for idx, group in enumerate(self.duplicate_groups):
+            if group is None:
+                continue
+            files = [file_path for file_path in group['files'] if file_path not in gone]
+            if len(files) < len(group['files']):
+                self.duplicate_groups[idx] = (
+                    dict(group, files=files) if len(files) > 1 else None
+                )
+        self.populate_treeview()
+        self.clear_preview()
+
+    def undo_last_cleanup(self):
+        if not self.vault_path:
+            messagebox.showwarning(
+                "No Folder Selected", "Please select an Obsidian vault folder first."
+            )
+            return
+        cleanups = list_cleanups(self.vault_path)
+        if not cleanups:
+            messagebox.showinfo("Nothing to Undo", "This vault has no cleanup to undo.")
+            return
+        try:
+            notes = len(read_journal(cleanups[0]))
+        except (OSError, ValueError) as e:
+            messagebox.showerror(
+                "Error Reading Journal", f"Could not read {cleanups[0]}: {e}"
+            )
+            return
+        if not messagebox.askyesno(
+            "Undo Last Cleanup", f"Move {notes} notes back from the trash?"
+        ):
+            return
+        restored, errors = undo_cleanup(cleanups[0])
+        if errors:
+            file_path, message = next(iter(errors.items()))
+            messagebox.showerror(
+                "Error Restoring Files",
+                f"Could not restore {len(errors)} files, including {file_path}: "
+                f"{message}"
+            )
+        if self.watch_stop is not None:
+            self.update_status(f"Restored {len(restored)} notes.")
+        else:
+            self.update_status(
+                f"Restored {len(restored)} notes. Find duplicates again to include them."
+            )
+
     def ask_files_to_delete(self, file_paths):
         dialog = tk.Toplevel(self.root)
         dialog.title("Select Files to Delete")
@@ -561,6 +1566,9 @@ class ToolTip:
             tw.destroy()
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
     root = tk.Tk()
     app = DuplicateFinderApp(root)
     root.mainloop()
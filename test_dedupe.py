@@ -0,0 +1,397 @@
+"""
+Tests for Obsidian Duplicate Finder, mostly on a synthetic vault whose
+plain in-memory scan is the reference for the other scan modes.
+
+    python -m pytest -q
+"""
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import dedupe_engine
+from dedupe_bench import generate_vault
+from dedupe_engine import (
+    EMPTY_SIGNATURE, ScanCancelled, ScanControl, VaultScanner, ingest_vault,
+    lsh_candidate_pairs, preprocess_text, split_blocks, strip_obsidian_syntax
+)
+from dedupe_query import QueryIndex
+from dedupe_resolve import list_cleanups, move_to_trash, plan_cleanup, undo_cleanup
+from dedupe_shard import ShardMerger, build_shard
+from dedupe_spill import MIN_MEMORY_BUDGET
+from dedupe_watch import LiveIndex
+
+THRESHOLD = 0.8
+
+
+def group_set(scanner, threshold=THRESHOLD):
+    return sorted(tuple(sorted(group['files'])) for group in scanner.groups(threshold))
+
+
+def scan(vault_path, cache_dir=None, **options):
+    scanner = VaultScanner(
+        vault_path, workers=2, use_cache=cache_dir is not None,
+        cache_dir=cache_dir, **options
+    )
+    scanner.scan(THRESHOLD)
+    return scanner
+
+
+OBSIDIAN_NOTE = """---
+tags: [draft]
+---
+# Heading about #project notes
+See [[Folder/Target Note#Section|the alias]] and [[Plain Link]] or ![[image.png]].
+```python
+print('code')
+```
+Issue #42 stays, #tag/sub goes.
+"""
+
+
+@pytest.fixture(scope='module')
+def vault(tmp_path_factory):
+    vault_path = str(tmp_path_factory.mktemp('vault'))
+    generate_vault(
+        vault_path, 150, words_per_note=80, vocabulary_size=3000, seed=7
+    )
+    return vault_path
+
+
+@pytest.fixture(scope='module')
+def plain_groups(vault):
+    groups = group_set(scan(vault))
+    assert any(len(group) > 2 for group in groups)
+    return groups
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'use_lsh': True},
+    {'memory_budget': MIN_MEMORY_BUDGET},
+    {'find_blocks': True},
+], ids=['cached', 'lsh', 'spill', 'blocks'])
+def test_scan_modes_match_plain_scan(vault, plain_groups, tmp_path, options):
+    assert group_set(scan(vault, cache_dir=str(tmp_path), **options)) == plain_groups
+
+
+def test_ingest_on_worker_processes(vault, monkeypatch):
+    expected, _, _ = ingest_vault(vault, workers=1)
+    submitted = []
+
+    class RecordingPool(dedupe_engine.ProcessPoolExecutor):
+        def submit(self, *args, **kwargs):
+            future = super().submit(*args, **kwargs)
+            submitted.append(future)
+            return future
+
+    # Small batches, so even this vault is preprocessed on two processes
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+    monkeypatch.setattr(dedupe_engine, 'PROCESS_POOL_MIN_FILES', 1)
+    monkeypatch.setattr(dedupe_engine, 'PREPROCESS_BATCH_SIZE', 16)
+    monkeypatch.setattr(dedupe_engine, 'ProcessPoolExecutor', RecordingPool)
+    file_contents, changed, errors = ingest_vault(vault, workers=2)
+
+    assert len(submitted) > 1
+    # A failed batch would have been preprocessed again in this process
+    assert all(future.exception() is None for future in submitted)
+    assert errors == {}
+    assert changed == set(expected)
+    assert file_contents == expected
+
+
+@pytest.mark.parametrize('cached', [False, True], ids=['uncached', 'cached'])
+def test_scan_drops_preprocessed_text(vault, tmp_path, cached):
+    expected, _, _ = ingest_vault(vault, workers=1)
+    scanner = scan(vault, cache_dir=str(tmp_path) if cached else None)
+    assert not any('processed' in entry for entry in scanner.file_contents.values())
+    # It comes back from the scan index or the notes when needed
+    assert scanner.processed_texts(scanner.paths) == [
+        expected[path]['processed'] for path in scanner.paths
+    ]
+
+
+def test_strip_obsidian_syntax():
+    assert strip_obsidian_syntax(OBSIDIAN_NOTE) == (
+        "\n# Heading about  notes\n"
+        "See the alias and Plain Link or image.png.\n\n"
+        "Issue #42 stays,  goes.\n"
+    )
+    assert preprocess_text(OBSIDIAN_NOTE, strip_obsidian=True) == (
+        "heading notes see alias plain link imagepng issue 42 stays goes"
+    )
+    assert preprocess_text("Hello, World! It's the Café-Crème… a b") == (
+        "hello world cafécrème"
+    )
+
+
+def test_split_blocks_line_numbers():
+    text = "Intro line one\nline two\n\n\n# Title\nBody after heading\n## Sub\n\nLast"
+    assert list(split_blocks(text)) == [
+        (1, 2, "Intro line one\nline two"),
+        (5, 5, "# Title"),
+        (6, 6, "Body after heading"),
+        (7, 7, "## Sub"),
+        (9, 9, "Last"),
+    ]
+
+
+def test_shared_blocks_locations(tmp_path):
+    paragraph = (
+        "Shared paragraphs about compound interest, savings accounts and "
+        "retirement planning appear in both notes"
+    )
+    (tmp_path / 'a.md').write_text(
+        f"# Money\n\n{paragraph}\n\nOnly in the first note.\n", encoding='utf-8'
+    )
+    (tmp_path / 'b.md').write_text(
+        f"Intro\n\nSomething else entirely.\n\n{paragraph.upper()}!\n", encoding='utf-8'
+    )
+    scanner = VaultScanner(str(tmp_path), workers=1, use_cache=False)
+    [block] = scanner.scan_blocks()
+    assert block['notes'] == 2
+    assert sorted(block['locations']) == [
+        (str(tmp_path / 'a.md'), 3, 3), (str(tmp_path / 'b.md'), 5, 5)
+    ]
+
+
+def test_lsh_candidates_of_one_large_bucket():
+    rng = np.random.default_rng(0)
+    signatures = rng.integers(0, 3, size=(400, 32), dtype=np.uint64)
+    # 300 near copies share a bucket in every band but the first
+    signatures[:300, 4:] = signatures[0, 4:]
+    signatures[-1] = EMPTY_SIGNATURE
+    rows, cols = lsh_candidate_pairs(signatures, bands=8)
+
+    bands = signatures[:-1].reshape(399, 8, 4)
+    shared = (bands[:, None] == bands[None]).all(axis=3).any(axis=2)
+    expected_rows, expected_cols = np.nonzero(np.triu(shared, 1))
+    assert rows.tolist() == expected_rows.tolist()
+    assert cols.tolist() == expected_cols.tolist()
+
+
+def test_simhash_groups_are_within_plain_groups(vault, plain_groups):
+    # SimHash only finds near copies, so its groups may be smaller
+    scanner = scan(vault, use_simhash=True)
+    groups = group_set(scanner)
+    assert groups
+    for group in groups:
+        assert any(set(group) <= set(plain) for plain in plain_groups)
+    for exact_group in scanner.exact_groups:
+        assert any(set(exact_group) <= set(group) for group in groups)
+
+
+@pytest.mark.parametrize('shards', [1, 3])
+@pytest.mark.parametrize('use_lsh', [False, True], ids=['full', 'lsh'])
+def test_sharded_scan_matches_plain_scan(vault, plain_groups, tmp_path, shards, use_lsh):
+    artifacts = [str(tmp_path / f'shard-{shard}.npz') for shard in range(shards)]
+    for shard, artifact in enumerate(artifacts):
+        assert build_shard(vault, shard, shards, artifact, use_lsh=use_lsh) == {}
+    merger = ShardMerger(artifacts, vault)
+    merger.merge(THRESHOLD)
+    assert group_set(merger) == plain_groups
+
+
+def start_paused_scan(vault_path):
+    """Start a scan on a thread that pauses it at its first progress report."""
+    control = ScanControl()
+    paused = threading.Event()
+    reports = []
+    outcome = {}
+
+    def progress(done, found):
+        reports.append(done)
+        if not paused.is_set():
+            control.pause()
+            paused.set()
+
+    def run():
+        try:
+            scanner.scan(THRESHOLD, progress=progress, control=control)
+            outcome['finished'] = True
+        except ScanCancelled:
+            outcome['cancelled'] = True
+
+    scanner = VaultScanner(vault_path, workers=1, use_cache=False)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert paused.wait(10)
+    time.sleep(0.2)
+    count = len(reports)
+    time.sleep(0.2)
+    # A paused scan does no more work
+    assert control.paused and thread.is_alive() and len(reports) == count
+    return scanner, control, thread, outcome
+
+
+def test_scan_control_pause_and_resume(vault, plain_groups):
+    scanner, control, thread, outcome = start_paused_scan(vault)
+    control.resume()
+    thread.join(30)
+    assert outcome == {'finished': True}
+    assert group_set(scanner) == plain_groups
+
+
+def test_scan_control_cancels_a_paused_scan(vault):
+    _, control, thread, outcome = start_paused_scan(vault)
+    control.cancel()
+    thread.join(10)
+    assert outcome == {'cancelled': True}
+    assert control.cancelled and not control.paused
+
+
+def test_unchanged_rescan_matches_plain_scan(vault, plain_groups, tmp_path):
+    cache_dir = str(tmp_path)
+    scan(vault, cache_dir)
+    rescanner = scan(vault, cache_dir)
+    assert not rescanner.changed_files
+    assert group_set(rescanner) == plain_groups
+
+
+@pytest.mark.parametrize('use_lsh', [False, True], ids=['full', 'lsh'])
+def test_incremental_rescan_after_changes(vault, tmp_path, use_lsh):
+    vault_path = str(tmp_path / 'vault')
+    shutil.copytree(vault, vault_path)
+    cache_dir = str(tmp_path / 'cache')
+    scan(vault_path, cache_dir, use_lsh=use_lsh)
+
+    notes = sorted(
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(vault_path) for name in names
+    )
+    edited, deleted, copied = notes[0], notes[1], notes[2]
+    with open(edited, 'a', encoding='utf-8') as f:
+        f.write("\nA new closing paragraph about something else entirely.\n")
+    os.remove(deleted)
+    shutil.copyfile(copied, os.path.join(vault_path, 'added-copy.md'))
+
+    rescanner = scan(vault_path, cache_dir, use_lsh=use_lsh)
+    assert rescanner.changed_files == {
+        edited, os.path.join(vault_path, 'added-copy.md')
+    }
+    assert deleted not in rescanner.file_contents
+    groups = group_set(rescanner)
+    assert groups == group_set(scan(vault_path, use_lsh=use_lsh))
+    assert any(
+        copied in group and os.path.join(vault_path, 'added-copy.md') in group
+        for group in groups
+    )
+
+
+def test_live_index_update_matches_fresh_scan(vault, tmp_path):
+    vault_path = str(tmp_path / 'vault')
+    shutil.copytree(vault, vault_path)
+    live = LiveIndex(scan(vault_path))
+    assert group_set(live) == group_set(scan(vault_path))
+
+    scanner = scan(vault_path)
+    [exact_group, *_] = scanner.exact_groups
+    edited, deleted = exact_group[0], scanner.paths[-1]
+    added = os.path.join(vault_path, 'new', 'added-copy.md')
+    with open(edited, 'a', encoding='utf-8') as f:
+        f.write("\nA new closing paragraph about something else entirely.\n")
+    os.remove(deleted)
+    os.makedirs(os.path.dirname(added))
+    shutil.copyfile(scanner.paths[0], added)
+
+    affected = live.update({edited, deleted, added})
+    # The edited note's exact copies lost their link through it
+    assert {edited, deleted, added} | set(exact_group[1:]) <= affected
+    assert deleted not in live.file_contents
+    assert group_set(live) == group_set(scan(vault_path))
+    assert live.update({edited}) == set()
+
+
+def test_query_index_top_k_and_saved_round_trip(vault, tmp_path):
+    vault_path = str(tmp_path / 'vault')
+    shutil.copytree(vault, vault_path)
+    scanner = scan(vault_path)
+    index = QueryIndex.from_scanner(scanner)
+    note = scanner.exact_groups[0][0]
+
+    matches = index.similar_to_note(note, k=5)
+    assert len(matches) == 5
+    assert note not in [path for path, _ in matches]
+    # Best first, and nothing outside the top k scores higher
+    row = index.row_of[note]
+    scores = (index.matrix @ index.matrix[row].T).toarray().ravel()
+    scores[row] = 0
+    assert [score for _, score in matches] == pytest.approx(sorted(scores)[::-1][:5])
+    assert matches[0][0] in scanner.exact_groups[0][1:]
+    assert matches[0][1] == pytest.approx(1.0)
+
+    saved_path = str(tmp_path / 'query.npz')
+    index.save(saved_path, vault_path)
+    loaded = QueryIndex.load(saved_path, vault_path)
+    assert loaded is not None and loaded.paths == index.paths
+    assert loaded.similar_to_note(note, k=5) == matches
+    with open(note, encoding='utf-8') as f:
+        text = f.read()
+    assert loaded.similar_to_text(text, k=3) == index.similar_to_text(text, k=3)
+
+    # A changed note makes the saved index stale
+    with open(note, 'a', encoding='utf-8') as f:
+        f.write("\nOne more line.\n")
+    assert QueryIndex.load(saved_path, vault_path) is None
+
+
+def test_exact_copies_count_every_pair(tmp_path):
+    text = (
+        "The quick brown fox jumps over the lazy dog near the river bank "
+        "every single morning before breakfast while the birds sing loudly"
+    )
+    for name in ('a', 'b', 'c'):
+        (tmp_path / f'{name}.md').write_text(text, encoding='utf-8')
+    (tmp_path / 'd.md').write_text(text + " today", encoding='utf-8')
+    (tmp_path / 'e.md').write_text("A shopping list of apples and bread", encoding='utf-8')
+    scanner = VaultScanner(str(tmp_path), workers=1, use_cache=False)
+    streamed = []
+    scanner.scan(THRESHOLD, on_group=streamed.append)
+
+    # Three copies and a near copy make six pairs, not the three edges
+    # of their representative
+    [group] = scanner.groups(THRESHOLD)
+    assert len(group['files']) == 4
+    assert group['pairs'] == 6
+    assert group['max_similarity'] == pytest.approx(1.0)
+    assert group['similarity'] == pytest.approx(
+        (3 + 3 * group['min_similarity']) / 6
+    )
+    [streamed_group] = streamed
+    assert streamed_group['pairs'] == 6
+    assert streamed_group['similarity'] == pytest.approx(group['similarity'])
+
+
+def test_move_to_trash_and_undo(vault, tmp_path):
+    vault_path = str(tmp_path / 'vault')
+    shutil.copytree(vault, vault_path)
+    scanner = scan(vault_path)
+    contents = {}
+    for path in scanner.paths:
+        with open(path, 'rb') as f:
+            contents[path] = f.read()
+
+    plan = plan_cleanup(
+        [group['files'] for group in scanner.groups(THRESHOLD)],
+        scanner.file_contents, 'newest'
+    )
+    removed = [path for _, remove in plan for path in remove]
+    journal_path, moved, errors = move_to_trash(vault_path, plan)
+    assert errors == {}
+    assert sorted(moved) == sorted(removed)
+    assert not any(os.path.exists(path) for path in removed)
+    assert list_cleanups(vault_path) == [journal_path]
+    # Trashed notes are not scanned again
+    assert group_set(scan(vault_path)) == []
+
+    restored, errors = undo_cleanup(journal_path)
+    assert errors == {}
+    assert sorted(restored) == sorted(removed)
+    for path, content in contents.items():
+        with open(path, 'rb') as f:
+            assert f.read() == content
+    assert list_cleanups(vault_path) == []
+    assert group_set(scan(vault_path)) == group_set(scanner)